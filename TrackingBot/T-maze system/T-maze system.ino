@@ -1,15 +1,21 @@
 /*
 Interface wtih Python through COM port communication
-Read input
+Read framed binary packets:
+SYNC | LEN | CMD | SEQ | DATA... | CHECKSUM
+LEN counts SEQ and DATA, CHECKSUM is XOR of LEN, CMD, SEQ and DATA
+CMD_SET data is (channel, value) pairs, channel 0-5 are LEDs, channel 6 is the gate
+Every valid packet is answered with an ACK echoing SEQ
 */
 
-String userCommand = "";
-int ledpin1 = 13;
-int ledpin2 = 11;
-int ledpin3 = 10;
-int ledpin4 = 7;
-int ledpin5 = 6;
-int ledpin6 = 5;
+const byte SYNC = 0xA5;
+const byte CMD_SET = 0x01;
+const byte CMD_PING = 0x02;
+const byte ACK_FLAG = 0x80;
+const byte GATE_CHANNEL = 6;
+const byte MAX_LENGTH = 64; // longer packets are rejected
+
+int ledPins[] = {13, 11, 10, 7, 6, 5};
+const int ledCount = 6;
 
 // negative to pin2
 // positive to pin 3
@@ -19,26 +25,32 @@ int brakePin = 9;//Motor brake
 
 bool motionState; //Switch on or off state
 
+// gate motor runs without blocking the serial parser
+const unsigned long motorRunTime = 1500; // time to complete action
+const unsigned long motorRestTime = 1000; // brake time before next action
+enum MotorPhase {MOTOR_IDLE, MOTOR_RUNNING, MOTOR_RESTING};
+MotorPhase motorPhase = MOTOR_IDLE;
+unsigned long motorPhaseStart = 0;
+bool targetState; // requested gate state, applied when motor is idle
+
+// packet parser state
+enum ParserState {WAIT_SYNC, READ_LEN, READ_BODY, READ_CHECKSUM};
+ParserState parserState = WAIT_SYNC;
+byte packet[MAX_LENGTH + 1];
+byte packetLength = 0;
+int bodyIndex = 0;
+byte packetChecksum = 0;
+
 // the setup function runs once when you press reset or power the board
 void setup() {
   Serial.begin(19200);
-  // initialize digital pin 9 as an output.
-  pinMode(ledpin1, OUTPUT);
-  pinMode(ledpin2, OUTPUT);
-  pinMode(ledpin3, OUTPUT);
-  pinMode(ledpin4, OUTPUT);
-  pinMode(ledpin5, OUTPUT);
-  pinMode(ledpin6, OUTPUT);
-  // initial state
-//  analogWrite (ledpin,0);
-  digitalWrite(ledpin1,LOW);
-  digitalWrite(ledpin2,LOW);
-  digitalWrite(ledpin3,LOW);
-  digitalWrite(ledpin4,LOW);
-  digitalWrite(ledpin5,LOW);
-  digitalWrite(ledpin6,LOW);
-  
-// for default LED connection test  
+  for (int i = 0; i < ledCount; i++) {
+    pinMode(ledPins[i], OUTPUT);
+    // initial state
+    digitalWrite(ledPins[i], LOW);
+  }
+
+// for default LED connection test
   pinMode(LED_BUILTIN, OUTPUT);
   digitalWrite(LED_BUILTIN, LOW);
 
@@ -47,106 +59,106 @@ void setup() {
   pinMode(directionPin, OUTPUT); //Initiates Motor Channel A pin
   pinMode(brakePin, OUTPUT); //Initiates Brake Channel A pin
   pinMode(pwmPin, OUTPUT);
-  motionState == false;
+  motionState = false;
+  targetState = false;
 }
 
 // the loop function runs over and over again forever
 void loop() {
-  while (Serial.available())
-  {  
-////////////////////////////////////////  
-    userCommand = Serial.readStringUntil('\n');
-    if (userCommand == "01"){ 
-      digitalWrite(LED_BUILTIN, HIGH); 
-      digitalWrite(ledpin1,HIGH);
-    }
-    if (userCommand == "00"){
-      digitalWrite(LED_BUILTIN, LOW);
-      digitalWrite(ledpin1,LOW);
-    }
-    if (userCommand == "11"){
-      digitalWrite(ledpin2,HIGH);
-    }
-    if (userCommand == "10"){
-      digitalWrite(ledpin2,LOW);
-    }      
-    if (userCommand == "21"){
-       digitalWrite(ledpin3,HIGH);
-    }       
-    if (userCommand == "20"){
-      digitalWrite(ledpin3,LOW);
-    }      
-    if (userCommand == "31"){
-      digitalWrite(ledpin4,HIGH);
-    }  
-    if (userCommand == "30"){
-      digitalWrite(ledpin4,LOW);
-    } 
-    if (userCommand == "41"){
-       digitalWrite(ledpin5,HIGH);
-    }   
-    if (userCommand == "40"){
-      digitalWrite(ledpin5,LOW);
-    }  
-    if (userCommand == "51"){
-       digitalWrite(ledpin6,HIGH);
-    }  
-    if (userCommand == "50"){
-      digitalWrite(ledpin6,LOW);
-    } 
-    if (userCommand == "61"){
+  while (Serial.available()) {
+    parseByte(Serial.read());
+  }
+  updateMotor();
+}
 
-       if(motionState == false){
-              digitalWrite(directionPin, HIGH); //High goes forward
-                //release breaks
-              digitalWrite(brakePin, LOW);
-              
-              //set work duty for the motor
-              analogWrite(pwmPin, 100);
-            
-              //Make sure motor complete action
-              delay(1500);
-            
-              //activate breaks
-              digitalWrite(brakePin, HIGH);
-              // and set work duty for the motor to 0 (off)
-              analogWrite(pwmPin, 0);
-              
-              delay(1000);
-              motionState = true;
-            }
-          else{
-              //  
-              //  delay(2000);
-          }
+void parseByte(byte value) {
+  switch (parserState) {
+    case WAIT_SYNC:
+      if (value == SYNC) {
+        parserState = READ_LEN;
+      }
+      break;
+    case READ_LEN:
+      packetLength = value;
+      packetChecksum = value;
+      bodyIndex = 0;
+      // CMD and SEQ at least
+      parserState = (packetLength >= 1 && packetLength <= MAX_LENGTH) ? READ_BODY : WAIT_SYNC;
+      break;
+    case READ_BODY:
+      packet[bodyIndex++] = value;
+      packetChecksum ^= value;
+      // CMD + SEQ + DATA
+      if (bodyIndex == packetLength + 1) {
+        parserState = READ_CHECKSUM;
+      }
+      break;
+    case READ_CHECKSUM:
+      if (value == packetChecksum) {
+        handlePacket(packet[0], packet[1], packet + 2, packetLength - 1);
+      }
+      parserState = WAIT_SYNC;
+      break;
+  }
+}
+
+void handlePacket(byte cmd, byte seq, byte *data, int dataLength) {
+  if (cmd == CMD_SET) {
+    for (int i = 0; i + 1 < dataLength; i += 2) {
+      setChannel(data[i], data[i + 1]);
     }
-    
-    if (userCommand == "60"){
+  }
+  sendAck(cmd, seq);
+}
 
-       if(motionState == true){
-          digitalWrite(directionPin, LOW); //LOW goes backward
-            //release breaks
-          digitalWrite(brakePin, LOW);
-          
-          //set work duty for the motor
-          analogWrite(pwmPin, 100);
-        
-          //Make sure motor complete action
-          delay(1500);
-        
-          //activate breaks
-          digitalWrite(brakePin, HIGH);
-          // and set work duty for the motor to 0 (off)
-          analogWrite(pwmPin, 0);
-          
-          delay(1000);
-          motionState = false;
-        }
-      
-        else{
-            //  
-            //  delay(2000);
-        }
+void setChannel(byte channel, byte value) {
+  if (channel < ledCount) {
+    digitalWrite(ledPins[channel], value ? HIGH : LOW);
+    if (channel == 0) {
+      digitalWrite(LED_BUILTIN, value ? HIGH : LOW);
     }
   }
+  else if (channel == GATE_CHANNEL) {
+    targetState = value != 0;
+  }
+}
+
+void sendAck(byte cmd, byte seq) {
+  byte reply[5] = {SYNC, 1, (byte)(cmd | ACK_FLAG), seq, 0};
+  reply[4] = reply[1] ^ reply[2] ^ reply[3];
+  Serial.write(reply, 5);
+}
+
+void updateMotor() {
+  unsigned long now = millis();
+  switch (motorPhase) {
+    case MOTOR_IDLE:
+      if (targetState != motionState) {
+        digitalWrite(directionPin, targetState ? HIGH : LOW); //High goes forward, LOW goes backward
+        //release breaks
+        digitalWrite(brakePin, LOW);
+        //set work duty for the motor
+        analogWrite(pwmPin, 100);
+        motorPhase = MOTOR_RUNNING;
+        motorPhaseStart = now;
+      }
+      break;
+    case MOTOR_RUNNING:
+      //Make sure motor complete action
+      if (now - motorPhaseStart >= motorRunTime) {
+        //activate breaks
+        digitalWrite(brakePin, HIGH);
+        // and set work duty for the motor to 0 (off)
+        analogWrite(pwmPin, 0);
+        motionState = !motionState;
+        motorPhase = MOTOR_RESTING;
+        motorPhaseStart = now;
+      }
+      break;
+    case MOTOR_RESTING:
+      if (now - motorPhaseStart >= motorRestTime) {
+        motorPhase = MOTOR_IDLE;
+      }
+      break;
+  }
 }
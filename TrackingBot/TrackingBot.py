@@ -22,31 +22,43 @@
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QFileDialog, QStyle, QSplashScreen, QWhatsThis, QProgressBar, \
-    QDialog,QVBoxLayout,QLabel
-from PyQt5.QtGui import QImage, QPixmap, QPixmapCache
-from PyQt5.QtCore import pyqtSignal, Qt, QThread, QObject, QMutex, QMutexLocker, QRect
+    QDialog,QVBoxLayout,QLabel,QInputDialog,QComboBox,QShortcut,QFormLayout,QSpinBox,QLineEdit,QDialogButtonBox,\
+    QDoubleSpinBox,QPushButton,QHBoxLayout
+from PyQt5.QtGui import QImage, QPixmap, QPixmapCache, QKeySequence
+from PyQt5.QtCore import pyqtSignal, Qt, QThread, QObject, QMutex, QMutexLocker, QRect, QTimer
 from qtwidgets import Toggle
 
 import os
+import queue
 import subprocess
 import cv2
 import time
 import numpy as np
 from collections import namedtuple
 from datetime import datetime, timedelta
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
-import matplotlib.cm as cm
 import serial
 import serial.tools.list_ports
 import gui
 from video_player import VideoThread
 from threshold import ThreshVidThread, ThreshCamThread
-from tracking import TrackingThread, TrackingCamThread
+from tracking import TrackingThread, TrackingCamThread, RetrackThread
+from tracker import DEFAULT_SETTINGS, load_settings, save_settings
 import graphic_interactive as graphic
 from datalog import TrackingTimeStamp, DataLogThread, DataExportThread,CamDataExportThread,\
     TraceExportThread,GraphExportThread, VideoExportThread
 from hardware_wizard import Ui_HardwireWizardWindow
+from frame_index import FrameIndex, seek_time, position_time, frame_time
+from capture import BACKENDS, CameraConfig, CameraSource, VirtualCameraSource
+from latency import LatencyMonitor
+from zones import ZoneEngine
+from serial_channel import SerialChannel, GATE_CHANNEL
+from transport import open_transport, LOOPBACK_PORT
+from profiler import profiler
+from autotune import AutoTuneThread
+from seek_index import IndexedCapture, FrameCache, SeekIndexThread
+from proxy import ProxyThread, find_proxy, needs_proxy
+from detection_cache import DetectionCache, DetectionCacheWriter, cache_key, default_cache_dir, cache_entries, \
+    clear_cache
 
 
 
@@ -55,7 +67,12 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
     STATUS_PLAYING = 1
     STATUS_PAUSE = 2
 
-    def __init__(self):
+    def __init__(self, camera_source=None, fake_arduino=False):
+        '''
+        :param camera_source: source of live mode frames, e.g. VirtualCameraSource,
+                              camera described by camera_config if None
+        :param fake_arduino: list the emulated T-maze firmware in the port list, for testing
+        '''
         super().__init__()
         self.setupUi(self)
 
@@ -66,11 +83,20 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         self.background_frame = None # the first frame of video
         self.last_frame = None # the last frame of video for trace drawing
         self.video_prop = None
+        # frame index of a live recording, None if the video has no sidecar
+        self.frameIndex = None
         self.camera_prop = None
+        # camera device and backend of live mode, backend defaults to native backend of current platform
+        self.camera_config = CameraConfig()
+        self.camera_source = CameraSource(self.camera_config) if camera_source is None else camera_source
+        # identification settings of local, cached and live tracking
+        self.tracker_settings = dict(DEFAULT_SETTINGS)
         self.scale_factor = None
         self.status = self.STATUS_INIT  # 0: init 1:playing 2: pause
 
-        self.playCapture = cv2.VideoCapture()
+        # decoded frames of video and threshold players, one memory budget for both
+        self.frameCache = FrameCache()
+        self.playCapture = IndexedCapture(self.frameCache)
         self.verticalLayoutWidget.lower()
 
         #################################################################################
@@ -80,12 +106,18 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         self.videoThread.timeSignal.signal[str].connect(self.display_video)
 
         # timer for threshold video player on load tab
-        self.threshThread = ThreshVidThread()
+        self.threshThread = ThreshVidThread(frameCache=self.frameCache)
         self.threshThread.timeSignal.thresh_signal.connect(self.display_threshold_video)
         self.threshThread.timeSignal.updateSliderPos.connect(self.update_thre_slider)
         self.threshThread.timeSignal.thresh_reset.connect(self.reset_video)
         self.threshThread.timeSignal.detect_cnt.connect(self.update_detect_cnt)
 
+        # re-threshold the paused frame after settings stop changing for a moment
+        self.threshRefreshTimer = QTimer()
+        self.threshRefreshTimer.setSingleShot(True)
+        self.threshRefreshTimer.setInterval(30)
+        self.threshRefreshTimer.timeout.connect(self.refresh_thresh_frame)
+
         # timer for tracking video
         self.trackingThread = TrackingThread()
         self.trackingThread.timeSignal.tracking_signal.connect(self.display_tracking_video)
@@ -95,11 +127,39 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         self.trackingThread.timeSignal.track_reset.connect(self.reset_video)
         self.trackingThread.timeSignal.track_reset_alarm.connect(self.complete_tracking)
         self.trackingThread.timeSignal.exceed_index_alarm.connect(self.exceed_index_alarm)
+        self.trackingThread.timeSignal.cache_failed.connect(self.detection_cache_failed)
+
+        # re-run identification from detections cached by a previous tracking task
+        self.cache_dir = default_cache_dir()
+        self.retrackThread = RetrackThread()
+        self.retrackThread.timeSignal.updateSliderPos.connect(self.update_track_slider)
+        self.retrackThread.timeSignal.track_reset.connect(self.reset_video)
+        self.retrackThread.timeSignal.track_reset_alarm.connect(self.complete_tracking)
+        self.retrackThread.timeSignal.exceed_index_alarm.connect(self.exceed_index_alarm)
+
+        # keyframe and timestamp index for exact seeking, built once per video in background
+        self.seekIndexThread = SeekIndexThread()
+        self.seekIndexThread.cache_dir = self.cache_dir
+        self.seekIndexThread.timeSignal.index_ready.connect(self.set_seek_index)
+        self.seekIndexThread.timeSignal.index_failed.connect(self.seek_index_failed)
+
+        # low resolution proxy played by interactive views, tracking always reads the source video
+        self.proxy_file = None
+        self.proxyThread = ProxyThread()
+        self.proxyThread.cache_dir = self.cache_dir
+        self.proxyThread.timeSignal.proxy_progress.connect(self.update_proxy_progress)
+        self.proxyThread.timeSignal.proxy_ready.connect(self.set_proxy_file)
+        self.proxyThread.timeSignal.proxy_failed.connect(self.proxy_failed)
+
+        # step one frame backward/forward on paused video
+        QShortcut(QKeySequence(Qt.Key_Comma), self, lambda: self.step_frame(-1))
+        QShortcut(QKeySequence(Qt.Key_Period), self, lambda: self.step_frame(1))
 
         self.start_tic = 0
         self.stop_toc = 0
 
         self.threshCamThread = ThreshCamThread()
+        self.threshCamThread.captureThread.source = self.camera_source
         self.threshCamThread.timeSignal.cam_thresh_signal.connect(self.display_threshold_cam)
         self.threshCamThread.timeSignal.update_clock.connect(self.update_clock)
         self.threshCamThread.timeSignal.update_elapse.connect(self.update_elapse)
@@ -107,6 +167,7 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         self.threshCamThread.timeSignal.cam_detect_cnt.connect(self.update_cam_detect_cnt)
 
         self.trackingCamThread = TrackingCamThread()
+        self.trackingCamThread.captureThread.source = self.camera_source
         self.trackingCamThread.timeSignal.cam_tracking_signal.connect(self.display_tracking_cam)
         self.trackingCamThread.timeSignal.update_clock.connect(self.update_clock)
         self.trackingCamThread.timeSignal.update_elapse.connect(self.update_elapse)
@@ -116,9 +177,17 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         self.trackingCamThread.timeSignal.exceed_index_alarm.connect(self.cam_exceed_index_alarm)
 
         self.videoExportThread = VideoExportThread()
+        self.videoExportThread.timesignal.record_failed.connect(self.recording_failed)
 
-        self.hardwareWizard = HardwareWizard()
+        # capture to serial command latency of live tracking
+        self.latencyMonitor = LatencyMonitor()
+        self.trackingCamThread.latencyMonitor = self.latencyMonitor
+
+        self.hardwareWizard = HardwareWizard(fake_arduino)
         self.controllerThread = ControllerThread()
+        # all commands to device go through serial channel of hardware wizard
+        self.controllerThread.serialChannel = self.hardwareWizard.serialChannel
+        self.hardwareWizard.serialChannel.latencyMonitor = self.latencyMonitor
 
         self.dataLogThread = DataLogThread()
         self.dataExportThread = DataExportThread()
@@ -285,6 +354,16 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         self.applyThreButton.clicked.connect(self.apply_thre_setting)
         self.resetThreButton.clicked.connect(self.reset_thre_setting)
 
+        # recommend threshold settings from frames sampled across the video
+        self.autoTuneButton = QtWidgets.QPushButton('Auto-tune', self.threTab)
+        self.autoTuneButton.setEnabled(False)
+        self.autoTuneButton.setGeometry(QtCore.QRect(1050, 630, 249, 35))
+        self.autoTuneButton.clicked.connect(self.auto_tune_threshold)
+        self.autoTuneThread = AutoTuneThread()
+        self.autoTuneThread.timeSignal.tune_progress.connect(self.update_auto_tune_progress)
+        self.autoTuneThread.timeSignal.tune_finished.connect(self.apply_auto_tune)
+        self.autoTuneThread.timeSignal.tune_failed.connect(self.auto_tune_failed)
+
         # enable WhatsThis mode
         self.blocksizeHelpLabel.enterEvent = self.enable_blocksize_help
         self.blocksizeHelpLabel.leaveEvent = self.disable_blocksize_help
@@ -316,6 +395,9 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         self.exportTraceButton.clicked.connect(self.export_trace)
         self.exportHeatmapButton.clicked.connect(self.export_heatmap)
 
+        # time bin width (s) of the result sheet
+        self.bin_width = 1
+
         self.traceToggle = Toggle(self.trackingTab)
         self.traceToggle.setEnabled(True)
         self.traceToggle.setGeometry(QtCore.QRect(1210, 95, 85, 35))
@@ -334,16 +416,44 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         self.heatmapHelpLabel.enterEvent = self.enable_heatmap_help
         self.heatmapHelpLabel.leaveEvent = self.disable_heatmap_help
 
-        self.figure = Figure()
-        # set background color
-        self.figure.set_facecolor("black")
-        # the Canvas Widget that displays the `figure`
-        self.canvas = FigureCanvas(self.figure)
-        self.canvas.setFixedSize(1024, 576)
-        self.heatmapLayout.addWidget(self.canvas)
+        # density estimation of heatmap
+        self.heatmapModeBox = QComboBox(self.trackingTab)
+        self.heatmapModeBox.setGeometry(QtCore.QRect(1210, 235, 85, 25))
+        self.heatmapModeBox.addItem('Histogram', 'histogram')
+        self.heatmapModeBox.addItem('kNN density', 'knn')
+        self.heatmapModeBox.currentIndexChanged.connect(self.select_heatmap_mode)
 
         self.heat_map = None
 
+        # time window of trace map and heatmap, None for full session
+        self.exportWindowText = QLabel('Time window', self.trackingTab)
+        self.exportWindowText.setGeometry(QtCore.QRect(1033, 290, 111, 25))
+        self.exportWindowBox = QComboBox(self.trackingTab)
+        self.exportWindowBox.setGeometry(QtCore.QRect(1210, 290, 85, 25))
+        self.exportWindowBox.addItem('Full session', None)
+        self.exportWindowBox.addItem('Last 1 min', 60)
+        self.exportWindowBox.addItem('Last 5 min', 300)
+        self.exportWindowBox.addItem('Last 10 min', 600)
+        self.exportWindowBox.currentIndexChanged.connect(self.select_export_window)
+
+        # single subject heatmap, None for all subjects
+        self.heatmapSubjectText = QLabel('Heatmap subject', self.trackingTab)
+        self.heatmapSubjectText.setGeometry(QtCore.QRect(1033, 325, 111, 25))
+        self.heatmapSubjectBox = QComboBox(self.trackingTab)
+        self.heatmapSubjectBox.setGeometry(QtCore.QRect(1210, 325, 85, 25))
+        self.heatmapSubjectBox.addItem('All', None)
+        self.heatmapSubjectBox.currentIndexChanged.connect(self.select_heatmap_subject)
+
+        # grid cell size of heatmap in pixels
+        self.heatmapBinText = QLabel('Heatmap grid', self.trackingTab)
+        self.heatmapBinText.setGeometry(QtCore.QRect(1033, 360, 111, 25))
+        self.heatmapBinBox = QComboBox(self.trackingTab)
+        self.heatmapBinBox.setGeometry(QtCore.QRect(1210, 360, 85, 25))
+        for bin_size in (2, 4, 8):
+            self.heatmapBinBox.addItem(f'{bin_size} px', bin_size)
+        self.heatmapBinBox.setCurrentIndex(self.heatmapBinBox.findData(4))
+        self.heatmapBinBox.currentIndexChanged.connect(self.select_heatmap_bin_size)
+
         #####################################################################################
         # signals and widgets for live tracking section
         #####################################################################################
@@ -423,6 +533,24 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         ###################################################################################
         self.actionAbout.triggered.connect(self.about_info)
 
+        self.menuTools = self.menubar.addMenu('Tools')
+        self.actionLatencyOverlay = self.menuTools.addAction('Show latency on live view')
+        self.actionLatencyOverlay.setCheckable(True)
+        self.actionLatencyOverlay.toggled.connect(self.set_latency_overlay)
+        self.actionProfiler = self.menuTools.addAction('Record performance timeline')
+        self.actionProfiler.setCheckable(True)
+        self.actionProfiler.setChecked(profiler.enabled)
+        self.actionProfiler.toggled.connect(self.set_profiler)
+        self.actionProxy = self.menuTools.addAction('Use low resolution proxy for preview')
+        self.actionProxy.setCheckable(True)
+        self.actionProxy.toggled.connect(self.set_proxy)
+        self.actionCameraSettings = self.menuTools.addAction('Camera settings...')
+        self.actionCameraSettings.triggered.connect(self.camera_settings)
+        self.actionTrackerSettings = self.menuTools.addAction('Tracker settings...')
+        self.actionTrackerSettings.triggered.connect(self.tracker_settings_dialog)
+        self.actionClearCache = self.menuTools.addAction('Clear cache...')
+        self.actionClearCache.triggered.connect(self.clear_cache_dialog)
+
     def about_info(self):
 
         self.about_msg = QMessageBox()
@@ -468,10 +596,17 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         self.tabWidget.setCurrentIndex(5)
         self.leaveCamTracking.setEnabled(True)
 
+        self.detect_camera()
+
+    def detect_camera(self):
+        '''
+        read frame size of the configured camera
+        '''
         try:
-            self.camera_prop = self.read_cam_prop(cv2.VideoCapture(0, cv2.CAP_DSHOW))
+            cap = self.camera_source.open()
+            self.camera_prop = self.read_cam_prop(cap)
             # print(self.camera_prop)
-            cv2.VideoCapture(0, cv2.CAP_DSHOW).release()
+            cap.release()
         except Exception as e:
             error = str(e)
             self.error_msg = QMessageBox()
@@ -515,6 +650,8 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
 
                 # auto read and display file property
                 self.read_video_file(self.video_file[0])
+                self.load_seek_index(self.video_file[0])
+                self.load_proxy(self.video_file[0])
 
         except Exception as e:
             error = str(e)
@@ -534,6 +671,8 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         try:
             video_cap = cv2.VideoCapture(file_path)
             self.read_video_prop(video_cap)
+            self.frameIndex = FrameIndex.load(file_path)
+            self.threshThread.frameIndex = self.frameIndex
             self.video_name = os.path.split(file_path)
 
             self.set_vid_progressbar(self.video_prop)
@@ -678,7 +817,7 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         # play
         if self.status is MainWindow.STATUS_INIT:
             try:
-                self.playCapture.open(self.video_file[0])
+                self.playCapture.open(self.preview_file())
                 self.videoThread.start()
                 self.status = MainWindow.STATUS_PLAYING
                 self.set_pause_icon()
@@ -742,7 +881,7 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
             ret, frame = self.playCapture.read()
             if ret:
                 # convert total seconds to timedelta format, not total frames to timedelta
-                play_elapse = self.playCapture.get(cv2.CAP_PROP_POS_FRAMES) / self.playCapture.get(cv2.CAP_PROP_FPS)
+                play_elapse = frame_time(self.playCapture, self.frameIndex)
                 # update slider position and label
                 self.vidProgressBar.setSliderPosition(int(play_elapse))
                 self.vidPosLabel.setText(f"{str(timedelta(seconds=play_elapse)).split('.')[0]}")
@@ -809,28 +948,31 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
 
     def set_vid_progressbar(self, vid_prop):
 
+        # capture time of a live recording, otherwise total frames/fps, same time base as seek_time()
+        duration = position_time(vid_prop.length, vid_prop.fps, self.frameIndex)
+
         self.vidPosLabel.setText('0:00:00')
-        self.vidLenLabel.setText(f'{str(vid_prop.duration).split(".")[0]}')
-        # total SECONDS ( total frames/fps) use numeric, not timedelta format for range
-        self.vidProgressBar.setRange(0, int(vid_prop.length / vid_prop.fps))
+        self.vidLenLabel.setText(f'{str(timedelta(seconds=duration)).split(".")[0]}')
+        # total SECONDS use numeric, not timedelta format for range
+        self.vidProgressBar.setRange(0, int(duration))
         self.vidProgressBar.setValue(0)
 
         self.vidProgressBar.setSingleStep(int(vid_prop.fps) * 5)  # 5 sec
         self.vidProgressBar.setPageStep(int(vid_prop.fps) * 60)  # 60 sec
 
         self.threPosLabel.setText('0:00:00')
-        self.threLenLabel.setText(f'{str(vid_prop.duration).split(".")[0]}')
+        self.threLenLabel.setText(f'{str(timedelta(seconds=duration)).split(".")[0]}')
         # total SECONDS, use numeric, not timedelta format for range
-        self.threProgressBar.setRange(0, int(vid_prop.length / vid_prop.fps))
+        self.threProgressBar.setRange(0, int(duration))
         self.threProgressBar.setValue(0)
 
         self.threProgressBar.setSingleStep(int(vid_prop.fps) * 5)  # 5 sec
         self.threProgressBar.setPageStep(int(vid_prop.fps) * 60)  # 60 sec
 
         self.trackPosLabel.setText('0:00:00')
-        self.trackLenLabel.setText(f'{str(vid_prop.duration).split(".")[0]}')
+        self.trackLenLabel.setText(f'{str(timedelta(seconds=duration)).split(".")[0]}')
         # # use numeric, not timedelta format for range
-        self.trackProgressBar.setRange(0, int(vid_prop.length / vid_prop.fps))
+        self.trackProgressBar.setRange(0, int(duration))
         self.trackProgressBar.setValue(0)
         #
         self.trackProgressBar.setSingleStep(int(vid_prop.fps) * 5)  # 5 sec
@@ -844,6 +986,13 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         play_elapse = self.vidProgressBar.value()
         self.vidPosLabel.setText(f"{str(timedelta(seconds=play_elapse)).split('.')[0]}")
 
+        # show frame under the slider while dragging
+        if self.vidProgressBar.isSliderDown() and self.playCapture.isOpened():
+            seek_time(self.playCapture, play_elapse, self.frameIndex)
+            ret, frame = self.playCapture.read()
+            if ret:
+                self.VBoxLabel.setPixmap(self.convert_frame(self.scale_frame(frame)))
+
     def pause_from_slider(self):
 
         self.videoThread.stop()
@@ -851,14 +1000,119 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         self.set_play_icon()
 
     def resume_from_slider(self):
-        # convert current seconds back to frame number
-        current_frame = self.playCapture.get(cv2.CAP_PROP_FPS) * int(self.vidProgressBar.value())
-        self.playCapture.set(cv2.CAP_PROP_POS_FRAMES, current_frame)
+        # seek index or frame index of a recording converts seconds to exact frame number
+        seek_time(self.playCapture, int(self.vidProgressBar.value()), self.frameIndex)
 
         self.videoThread.start()
         self.status = MainWindow.STATUS_PLAYING
         self.set_pause_icon()
 
+    def load_seek_index(self, file_path):
+
+        if self.playCapture.index_path == file_path:
+            return
+        self.seekIndexThread.request(file_path)
+
+    def set_seek_index(self, file_path, index):
+        '''
+        pass seek index to video players, ignored if another video was selected meanwhile
+        '''
+        if self.video_file is None or self.video_file[0] != file_path:
+            return
+        self.playCapture.set_index(file_path, index)
+        self.threshThread.playCapture.set_index(file_path, index)
+
+    def seek_index_failed(self, file_path, error):
+        # players keep seeking by frame number, scrubbing still works but may be slower
+        if self.video_file is None or self.video_file[0] != file_path:
+            return
+        self.statusbar.showMessage(f'Seek index not available: {error}', 10000)
+
+    def step_frame(self, step):
+        '''
+        show previous or next frame of paused video on load or threshold tab
+        :param step: -1 or 1
+        '''
+        if self.status is not MainWindow.STATUS_PAUSE:
+            return
+
+        if self.tabWidget.currentIndex() == 1 and self.videoThread.is_stopped():
+            capture = self.playCapture
+        elif self.tabWidget.currentIndex() == 3 and not self.threshThread.isRunning():
+            capture = self.threshThread.playCapture
+        else:
+            return
+        if not capture.isOpened():
+            return
+
+        # position of next frame minus one is the frame on display
+        capture.set(cv2.CAP_PROP_POS_FRAMES, max(capture.get(cv2.CAP_PROP_POS_FRAMES) - 1 + step, 0))
+        ret, frame = capture.read()
+        if not ret:
+            return
+        play_elapse = frame_time(capture, self.frameIndex)
+        if capture is self.playCapture:
+            self.VBoxLabel.setPixmap(self.convert_frame(self.scale_frame(frame)))
+            self.vidProgressBar.setSliderPosition(int(play_elapse))
+            self.vidPosLabel.setText(f"{str(timedelta(seconds=play_elapse)).split('.')[0]}")
+        else:
+            self.threshThread.refresh_frame(frame)
+            self.update_thre_slider(play_elapse)
+
+    def set_proxy(self, checked):
+
+        if checked and self.video_file is not None and self.video_file[0]:
+            self.load_proxy(self.video_file[0])
+        elif not checked:
+            self.proxyThread.stop()
+
+    def load_proxy(self, file_path):
+        '''
+        generate proxy of a video larger than display window in background, or reuse a cached one
+        '''
+        self.proxy_file = None
+        if self.proxyThread.isRunning():
+            self.proxyThread.stop()
+            self.proxyThread.wait()
+        if not self.actionProxy.isChecked() or not needs_proxy(self.video_prop.width, self.video_prop.height):
+            return
+
+        self.proxy_file = find_proxy(file_path, self.cache_dir)
+        if self.proxy_file is None:
+            self.proxyThread.video_path = file_path
+            self.proxyThread.start()
+
+    def update_proxy_progress(self, percent):
+        self.statusbar.showMessage(f'Generating preview proxy {percent}%')
+
+    def set_proxy_file(self, file_path, proxy_file):
+        '''
+        used from the next time a preview is opened, ignored if another video was selected meanwhile
+        '''
+        if self.video_file is None or self.video_file[0] != file_path:
+            return
+        self.proxy_file = proxy_file
+        self.statusbar.showMessage('Preview proxy ready', 5000)
+
+    def proxy_failed(self, error):
+
+        self.statusbar.clearMessage()
+        self.warning_msg = QMessageBox()
+        self.warning_msg.setWindowTitle('Error')
+        self.warning_msg.setText('Failed to generate preview proxy.')
+        self.warning_msg.setInformativeText('Preview keeps playing the source video.')
+        self.warning_msg.setIcon(QMessageBox.Warning)
+        self.warning_msg.setDetailedText(error)
+        self.warning_msg.exec()
+
+    def preview_file(self):
+        '''
+        interactive views play the proxy once it is ready, otherwise the source video
+        '''
+        if self.actionProxy.isChecked() and self.proxy_file is not None:
+            return self.proxy_file
+        return self.video_file[0]
+
     #####################################Functions for load camera#############
 
     def read_camera(self):
@@ -900,6 +1154,54 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
             self.error_msg.setDetailedText(error)
             self.error_msg.exec()
 
+    def camera_settings(self):
+        '''
+        edit device, backend and format of live mode camera
+        '''
+        dialog = CameraSettingsDialog(self.camera_config, self)
+        if dialog.exec() != QDialog.Accepted:
+            return
+        dialog.apply()
+
+        if self.threshCamThread.isRunning() or self.trackingCamThread.isRunning():
+            self.info_msg = QMessageBox()
+            self.info_msg.setWindowTitle('TrackingBot')
+            self.info_msg.setText('Camera settings will be applied after the camera is reopened.')
+            self.info_msg.setIcon(QMessageBox.Information)
+            self.info_msg.exec()
+        elif self.tabWidget.isTabEnabled(5):
+            # live mode is open, frame size may have changed
+            self.detect_camera()
+
+    def tracker_settings_dialog(self):
+        '''
+        edit identification settings, applied when next tracking task starts
+        '''
+        dialog = TrackerSettingsDialog(self.tracker_settings, self)
+        if dialog.exec() == QDialog.Accepted:
+            self.tracker_settings = dialog.settings()
+
+    def clear_cache_dialog(self):
+        '''
+        remove detection caches, seek indexes and proxies, files of a running task are kept
+        '''
+        size = sum(entry[1] for entry in cache_entries(self.cache_dir).values())
+        self.question_msg = QMessageBox()
+        self.question_msg.setWindowTitle('TrackingBot')
+        self.question_msg.setIcon(QMessageBox.Question)
+        self.question_msg.setText(f'Clear {size / 1024 ** 2:.1f} MB of cached data?')
+        self.question_msg.setInformativeText('Detections, seek indexes and preview proxies are created again '
+                                             'when a video is opened or tracked.\n' + self.cache_dir)
+        self.question_msg.setStandardButtons(QMessageBox.No | QMessageBox.Yes)
+        if self.question_msg.exec() != QMessageBox.Yes:
+            return
+
+        removed = clear_cache(self.cache_dir)
+        # a removed proxy is generated again next time the video is opened
+        if self.proxy_file is not None and not os.path.isfile(self.proxy_file):
+            self.proxy_file = None
+        self.statusbar.showMessage(f'Cleared {removed / 1024 ** 2:.1f} MB of cached data', 5000)
+
     def read_cam_prop(self, cam):
 
         video_prop = namedtuple('video_prop', ['width', 'height'])
@@ -933,6 +1235,8 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
 
         self.threshCamThread.stop()
         self.trackingCamThread.stop()
+        self.videoExportThread.stop()
+        self.controllerThread.stop()
         self.dataLogThread.stop()
 
         QPixmapCache.clear()
@@ -944,6 +1248,8 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
 
         self.threshCamThread.stop()
         self.trackingCamThread.stop()
+        self.videoExportThread.stop()
+        self.controllerThread.stop()
         self.dataLogThread.stop()
         self.trackingCamThread.frame_count = -1
         self.trackingCamThread.trackingTimeStamp.result_index = -1
@@ -1519,6 +1825,7 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         self.previewToggle.setEnabled(True)
         self.applyThreButton.setEnabled(True)
         self.resetThreButton.setEnabled(True)
+        self.autoTuneButton.setEnabled(True)
 
     def select_cali_tab(self):
         # when enable cali tab, vid been reset, self.playCapture released
@@ -1583,7 +1890,7 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
 
     def play_thresh_vid(self):
 
-        self.threshThread.playCapture.open(self.video_file[0])
+        self.threshThread.playCapture.open(self.preview_file())
         self.threshThread.start()
         self.status = MainWindow.STATUS_PLAYING
         self.set_pause_icon()
@@ -1606,9 +1913,8 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
 
     def resume_thresh_slider(self):
 
-        # convert current seconds back to frame number
-        current_frame = self.threshThread.playCapture.get(cv2.CAP_PROP_FPS) * int(self.threProgressBar.value())
-        self.threshThread.playCapture.set(cv2.CAP_PROP_POS_FRAMES, current_frame)
+        # seek index or frame index of a recording converts seconds to exact frame number
+        seek_time(self.threshThread.playCapture, int(self.threProgressBar.value()), self.frameIndex)
 
         self.threshThread.start()
         self.status = MainWindow.STATUS_PLAYING
@@ -1655,6 +1961,14 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         play_elapse = self.threProgressBar.value()
         self.threPosLabel.setText(f"{str(timedelta(seconds=play_elapse)).split('.')[0]}")
 
+        # threshold frame under the slider while dragging, skipped until thread finished its last frame
+        if self.threProgressBar.isSliderDown() and self.threshThread.playCapture.isOpened() \
+                and not self.threshThread.isRunning():
+            seek_time(self.threshThread.playCapture, play_elapse, self.frameIndex)
+            ret, frame = self.threshThread.playCapture.read()
+            if ret:
+                self.threshThread.refresh_frame(frame)
+
     def apply_object_num(self):
 
         self.object_num = self.objNumBox.value()
@@ -1673,6 +1987,7 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         self.blockSizeSpin.setValue(block_size)
         # pass value to thread
         self.threshThread.block_size = block_size
+        self.schedule_thresh_refresh()
 
     def set_blocksize_spin(self):
 
@@ -1685,42 +2000,130 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         self.blockSizeSlider.setValue(block_size)
         # pass value to thread
         self.threshThread.block_size = block_size
+        self.schedule_thresh_refresh()
 
     def set_offset_slider(self):
 
         offset = self.offsetSlider.value()
         self.offsetSpin.setValue(offset)
         self.threshThread.offset = offset
+        self.schedule_thresh_refresh()
 
     def set_offset_spin(self):
 
         offset = self.offsetSpin.value()
         self.offsetSlider.setValue(offset)
         self.threshThread.offset = offset
+        self.schedule_thresh_refresh()
 
     def set_min_cnt_slider(self):
 
         min_cnt = self.cntMinSlider.value()
         self.cntMinSpin.setValue(min_cnt)
         self.threshThread.min_contour = min_cnt
+        self.schedule_thresh_refresh()
 
     def set_min_cnt_spin(self):
 
         min_cnt = self.cntMinSpin.value()
         self.cntMinSlider.setValue(min_cnt)
         self.threshThread.min_contour = min_cnt
+        self.schedule_thresh_refresh()
 
     def set_max_cnt_slider(self):
 
         max_cnt = self.cntMaxSlider.value()
         self.cntMaxSpin.setValue(max_cnt)
         self.threshThread.max_contour = max_cnt
+        self.schedule_thresh_refresh()
 
     def set_max_cnt_spin(self):
 
         max_cnt = self.cntMaxSpin.value()
         self.cntMaxSlider.setValue(max_cnt)
         self.threshThread.max_contour = max_cnt
+        self.schedule_thresh_refresh()
+
+    def schedule_thresh_refresh(self):
+        '''
+        restart debounce timer when a threshold setting changes on paused video,
+        playing video picks up new settings from next decoded frame anyway
+        '''
+        if self.status is MainWindow.STATUS_PAUSE and self.threshThread.is_stopped():
+            self.threshRefreshTimer.start()
+
+    def refresh_thresh_frame(self):
+
+        if self.status is not MainWindow.STATUS_PAUSE:
+            return
+        if self.threshThread.isRunning():
+            # wait for the frame being processed when paused to finish
+            self.threshRefreshTimer.start()
+            return
+        self.threshThread.refresh_frame()
+
+    def auto_tune_threshold(self):
+        '''
+        rank threshold settings on frames sampled across the video in background
+        '''
+        if self.autoTuneThread.isRunning():
+            return
+        self.autoTuneThread.video_path = self.video_file[0]
+        self.autoTuneThread.obj_num = self.objNumBox.value()
+        self.autoTuneThread.invert_contrast = self.threshThread.invert_contrast
+        if self.apply_roi_flag or self.apply_mask_flag:
+            self.autoTuneThread.valid_mask = self.threshThread.final_mask
+        else:
+            self.autoTuneThread.valid_mask = None
+        self.autoTuneButton.setEnabled(False)
+        self.autoTuneButton.setText('Sampling frames...')
+        self.autoTuneThread.start()
+
+    def update_auto_tune_progress(self, finished):
+        self.autoTuneButton.setText(f'Evaluating {finished}/{self.autoTuneThread.sample_count} frames')
+
+    def apply_auto_tune(self, result):
+        '''
+        show recommended settings and apply them to threshold controls when accepted
+        '''
+        self.autoTuneButton.setText('Auto-tune')
+        self.autoTuneButton.setEnabled(True)
+        if not len(result):
+            self.auto_tune_failed('No subject detected with any setting.')
+            return
+
+        best = result.iloc[0]
+        self.question_msg = QMessageBox()
+        self.question_msg.setWindowTitle('TrackingBot')
+        self.question_msg.setIcon(QMessageBox.Question)
+        self.question_msg.setText('Recommended threshold settings')
+        self.question_msg.setInformativeText(f'Block size: {int(best.block_size)}\n'
+                                             f'Offset: {int(best.offset)}\n'
+                                             f'Min contour: {int(best.min_contour)}\n'
+                                             f'Max contour: {int(best.max_contour)}\n\n'
+                                             f'{best.exact_ratio:.0%} of sampled frames detect exactly '
+                                             f'{self.autoTuneThread.obj_num} subjects.\n'
+                                             'Apply these settings?')
+        self.question_msg.setDetailedText(result.head(10).round(3).to_string(index=False))
+        self.question_msg.setStandardButtons(QMessageBox.No | QMessageBox.Yes)
+        if self.question_msg.exec() != QMessageBox.Yes:
+            return
+
+        # spin boxes pass values to threshold thread
+        self.blockSizeSpin.setValue(int(best.block_size))
+        self.offsetSpin.setValue(int(best.offset))
+        self.cntMaxSpin.setValue(min(int(best.max_contour), self.cntMaxSpin.maximum()))
+        self.cntMinSpin.setValue(min(int(best.min_contour), self.cntMinSpin.maximum()))
+
+    def auto_tune_failed(self, error):
+        self.autoTuneButton.setText('Auto-tune')
+        self.autoTuneButton.setEnabled(True)
+        self.error_msg = QMessageBox()
+        self.error_msg.setWindowTitle('Error')
+        self.error_msg.setText('Failed to recommend threshold settings.')
+        self.error_msg.setIcon(QMessageBox.Warning)
+        self.error_msg.setDetailedText(error)
+        self.error_msg.exec()
 
     def set_pause_icon(self):
 
@@ -1751,6 +2154,7 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
             self.threshThread.invert_contrast = True
         else:
             self.threshThread.invert_contrast = False
+        self.schedule_thresh_refresh()
 
     def apply_thre_setting(self):
         '''
@@ -1790,6 +2194,7 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
             self.previewToggle.setEnabled(False)
             self.previewToggle.setChecked(False)
             self.invertContrastToggle.setEnabled(False)
+            self.autoTuneButton.setEnabled(False)
 
             self.trackTabLinkButton.setEnabled(True)
 
@@ -1821,6 +2226,7 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
 
         self.previewToggle.setEnabled(True)
         self.invertContrastToggle.setEnabled(True)
+        self.autoTuneButton.setEnabled(True)
 
         self.trackTabLinkButton.setEnabled(False)
 
@@ -1968,7 +2374,29 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         self.dataLogThread.tracked_object = None
         self.dataLogThread.tracked_index = None
         self.dataLogThread.tracked_elapse = None
+        self.dataLogThread.mapAccumulator.reset(self.video_prop.width, self.video_prop.height, self.video_prop.fps,
+                                                self.heatmapBinBox.currentData())
+
+        # detections are cached so tracker settings can be changed without decoding the video again
+        self.trackingThread.detectionCache = None
+        try:
+            key, params = cache_key(self.video_file[0], self.block_size, self.offset, self.min_contour,
+                                    self.max_contour, self.invert_contrast_state,
+                                    self.trackingThread.valid_mask if self.apply_roi_flag or self.apply_mask_flag
+                                    else None)
+            detectionCache = DetectionCache.find(self.cache_dir, key)
+            if detectionCache is not None and self.ask_retrack():
+                self.start_retrack(detectionCache)
+                return
+            self.trackingThread.detectionCache = DetectionCacheWriter(self.cache_dir, key, params)
+        except OSError as e:
+            # tracking works without cache
+            self.detection_cache_failed(str(e))
+
         self.trackingThread.playCapture.open(self.video_file[0])
+        # exact timestamps if the video is a TrackingBot recording
+        self.trackingThread.frameIndex = self.frameIndex
+        self.trackingThread.reset_tracker(self.object_num, self.tracker_settings)
         self.trackingThread.start()
         self.start_tic = time.perf_counter()
         self.status = MainWindow.STATUS_PLAYING
@@ -1976,12 +2404,50 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         self.trackStartButton.setIcon(self.style().standardIcon(QStyle.SP_MediaStop))
         self.leaveTrackButton.setEnabled(False)
 
+    def detection_cache_failed(self, error):
+        # tracking goes on, only re-tracking this video without decoding is unavailable
+        self.statusbar.showMessage(f'Detection cache disabled: {error}', 10000)
+
+    def ask_retrack(self):
+        '''
+        :return: True if user chooses to track from cached detections
+        '''
+        self.question_msg = QMessageBox()
+        self.question_msg.setWindowTitle('TrackingBot')
+        self.question_msg.setIcon(QMessageBox.Question)
+        self.question_msg.setText('This video was tracked before with the same threshold settings.')
+        self.question_msg.setInformativeText('Re-track from cached detections?\n'
+                                             'Video is not played, tracking finishes within seconds.')
+        self.question_msg.setStandardButtons(QMessageBox.No | QMessageBox.Yes)
+        self.question_msg.setDefaultButton(QMessageBox.Yes)
+        return self.question_msg.exec() == QMessageBox.Yes
+
+    def start_retrack(self, detectionCache):
+        '''
+        run identification on cached detections with current tracker settings
+        '''
+        self.retrackThread.reset(self.object_num, self.tracker_settings)
+        self.retrackThread.detectionCache = detectionCache
+        self.retrackThread.dataLogThread = self.dataLogThread
+        self.retrackThread.min_contour = self.min_contour
+        self.retrackThread.max_contour = self.max_contour
+        self.retrackThread.fps = self.video_prop.fps
+        self.retrackThread.frameIndex = self.frameIndex
+        self.retrackThread.start()
+        self.start_tic = time.perf_counter()
+        self.status = MainWindow.STATUS_PLAYING
+
+        self.trackStartButton.setIcon(self.style().standardIcon(QStyle.SP_MediaStop))
+        self.leaveTrackButton.setEnabled(False)
+
     def stop_tracking(self):
         '''
         cancel and reset tracking progress when stop clicked during ongoing task
         :return:
         '''
         try:
+            self.retrackThread.stop()
+            self.retrackThread.wait()
             self.trackingThread.stop()
             self.dataLogThread.stop()
             self.trackingThread.playCapture.release()
@@ -2021,6 +2487,7 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         '''
 
         try:
+            self.retrackThread.stop()
             self.trackingThread.stop()
             self.dataLogThread.stop()
             self.trackingThread.playCapture.release()
@@ -2161,12 +2628,17 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         if self.folder_path == '':
             return
         else:
+            bin_width = self.select_bin_width()
+            if bin_width is None:
+                return
             try:
                 # pass path
                 self.dataProcessDialog.data_save_path = self.folder_path
                 self.dataProcessDialog.video_fps = self.video_prop.fps
                 self.dataProcessDialog.object_num = self.object_num
                 self.dataProcessDialog.pixel_per_metric = self.pixel_per_metric
+                self.dataProcessDialog.bin_width = bin_width
+                self.dataProcessDialog.zone_mask = self.create_zone_mask()
                 # point thread
                 self.dataProcessDialog.dataLogThread = self.dataLogThread
                 # start processing data and show progress bar
@@ -2181,6 +2653,40 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
                 self.error_msg.setIcon(QMessageBox.Warning)
                 self.error_msg.exec()
 
+    def select_bin_width(self):
+        '''
+        ask for the time bin width of the binned result sheet
+        :return: bin width in seconds, None if cancelled
+        '''
+        bin_options = ['100 ms', '1 s', '1 min', 'Custom']
+        bin_widths = {'100 ms': 0.1, '1 s': 1, '1 min': 60}
+
+        selected_bin, ok = QInputDialog.getItem(self, 'TrackingBot', 'Time bin of result data:',
+                                                bin_options, bin_options.index('1 s'), False)
+        if not ok:
+            return None
+        if selected_bin != 'Custom':
+            self.bin_width = bin_widths[selected_bin]
+            return self.bin_width
+
+        custom_bin, ok = QInputDialog.getDouble(self, 'TrackingBot', 'Time bin (s):',
+                                                self.bin_width, 0.01, 86400, 2)
+        if not ok:
+            return None
+        self.bin_width = custom_bin
+        return self.bin_width
+
+    def create_zone_mask(self):
+        '''
+        scale the ROI canvas to raw video frame size so the zone
+        can be looked up directly with tracked coordinates
+        '''
+        if not self.apply_roi_flag:
+            return None
+
+        return cv2.resize(self.threshThread.roi_canvas, (int(self.video_prop.width), int(self.video_prop.height)),
+                          interpolation=cv2.INTER_NEAREST)
+
     def export_data_success(self):
 
         self.export_data_fin = True
@@ -2281,6 +2787,7 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
 
             if self.heat_map is None:
                 # make it a true/flase flag
+                    self.update_heatmap_subjects()
                     self.graphProcessDialog.dataLogThread = self.dataLogThread
                     self.graphProcessDialog.video_prop = self.video_prop
                     # start processing and show progress bar
@@ -2294,17 +2801,57 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
             self.verticalLayoutWidget.lower()
             self.set_complete_frame()
 
+    def select_heatmap_mode(self):
+        self.graphProcessDialog.graphExportThread.density_mode = self.heatmapModeBox.currentData()
+        # regenerate heatmap if it is on display
+        self.heat_map = None
+        if self.heatmapToggle.isChecked():
+            self.generate_heatmap()
+
+    def select_export_window(self):
+        self.traceProcessDialog.traceExportThread.window = self.exportWindowBox.currentData()
+        self.graphProcessDialog.graphExportThread.window = self.exportWindowBox.currentData()
+        # regenerate trace map or heatmap if it is on display
+        self.trace_map = None
+        self.heat_map = None
+        if self.traceToggle.isChecked():
+            self.generate_trace()
+        elif self.heatmapToggle.isChecked():
+            self.generate_heatmap()
+
+    def select_heatmap_subject(self):
+        self.graphProcessDialog.graphExportThread.subject = self.heatmapSubjectBox.currentData()
+        self.heat_map = None
+        if self.heatmapToggle.isChecked():
+            self.generate_heatmap()
+
+    def select_heatmap_bin_size(self):
+        # histograms accumulated with another grid are rebuilt from the position log
+        self.graphProcessDialog.graphExportThread.bin_size = self.heatmapBinBox.currentData()
+        self.heat_map = None
+        if self.heatmapToggle.isChecked():
+            self.generate_heatmap()
+
+    def update_heatmap_subjects(self):
+        '''
+        list subjects tracked in this session, keep current selection if it is still there
+        '''
+        selected = self.heatmapSubjectBox.currentData()
+        self.heatmapSubjectBox.blockSignals(True)
+        self.heatmapSubjectBox.clear()
+        self.heatmapSubjectBox.addItem('All', None)
+        for subject_id in self.dataLogThread.mapAccumulator.subject_ids():
+            self.heatmapSubjectBox.addItem(f'Subject {int(subject_id)}', subject_id)
+        index = self.heatmapSubjectBox.findData(selected)
+        self.heatmapSubjectBox.setCurrentIndex(max(index, 0))
+        self.heatmapSubjectBox.blockSignals(False)
+        self.graphProcessDialog.graphExportThread.subject = self.heatmapSubjectBox.currentData()
+
     def display_heatmap(self,heat_map):
+        # heat map is a color mapped BGR image in video frame size
         self.heat_map = heat_map
-        # init matplotlib fig
-        self.figure.clear()
-        ax = self.figure.add_subplot(111)
-        ax.imshow(self.heat_map, origin='lower', extent=None, cmap=cm.jet)
-        ax.invert_yaxis()
-        ax.axis('off')
-
-        self.canvas.draw()
-        self.verticalLayoutWidget.raise_()
+        scaled_heat_map = self.scale_frame(self.heat_map)
+        self.trackingBoxLabel.setPixmap(self.convert_frame(scaled_heat_map))
 
     def export_heatmap(self):
 
@@ -2316,7 +2863,7 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
             try:
                 now = datetime.now()
                 full_path = self.folder_path + '/TrackingBot export heatmap' + now.strftime('%Y-%m-%d-%H%M') + '.png'
-                self.figure.savefig(full_path, dpi=300, bbox_inches=None)
+                cv2.imwrite(full_path, self.heat_map)
                 self.export_heatmap_success()
 
             except Exception as e:
@@ -2567,12 +3114,30 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         self.resetCamThreButton.setEnabled(False)
         self.closeCamButton.setEnabled(False)
         self.trackingCamThread.obj_num = self.cam_object_num
-        self.trackingCamThread.trackingMethod.obj_num= self.cam_object_num
+        self.trackingCamThread.reset_tracker(self.cam_object_num, self.tracker_settings)
         self.trackingCamThread.block_size = self.cam_block_size
         self.trackingCamThread.offset = self.cam_offset
         self.trackingCamThread.min_contour = self.cam_min_contour
         self.trackingCamThread.max_contour = self.cam_max_contour
         self.trackingCamThread.invert_contrast = self.cam_invert_contrast
+        self.dataLogThread.obj_num = self.cam_object_num
+        self.dataLogThread.mapAccumulator.reset(self.camera_prop.width, self.camera_prop.height,
+                                                self.trackingCamThread.fps, self.heatmapBinBox.currentData())
+
+        # record camera stream in background
+        self.videoExportThread.cam_prop = self.camera_prop
+        self.videoExportThread.fps = self.trackingCamThread.fps
+        self.trackingCamThread.videoExportThread = self.videoExportThread
+        self.videoExportThread.reset()
+        self.videoExportThread.start()
+        self.latencyMonitor.reset()
+        # controller worker runs until camera closed
+        self.controllerThread.clear_queue()
+        self.hardwareWizard.serialChannel.clear_queue()
+        self.controllerThread.zone_events.clear()
+        if self.controllerThread.zoneEngine is not None:
+            self.controllerThread.zoneEngine.reset()
+        self.controllerThread.start()
 
         time.sleep(1)
         self.trackingCamThread.start()
@@ -2621,10 +3186,73 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
             self.info_msg.setWindowTitle('TrackingBot')
             self.info_msg.setIcon(QMessageBox.Information)
             self.info_msg.setText('Tracking finished.')
+            if self.videoExportThread.file_path is not None:
+                self.info_msg.setInformativeText(f'Recording saved to {self.videoExportThread.file_path}\n'
+                                                 f'Frames dropped by recorder: {self.videoExportThread.frames_dropped}')
+                self.info_msg.setDetailedText(self.export_latency())
             self.info_msg.exec()
             # allow export data when tracking finished
             self.exportCamData.setEnabled(True)
 
+    def recording_failed(self, error):
+
+        self.warning_msg = QMessageBox()
+        self.warning_msg.setWindowTitle('Error')
+        self.warning_msg.setText('Failed to record camera stream.')
+        self.warning_msg.setInformativeText('Tracking continues without recording.\n'
+                                            'Please check the codec and the output folder.')
+        self.warning_msg.setIcon(QMessageBox.Warning)
+        self.warning_msg.setDetailedText(error)
+        self.warning_msg.exec()
+
+    def set_latency_overlay(self, checked):
+        self.trackingCamThread.latency_overlay = checked
+
+    def set_profiler(self, checked):
+        '''
+        start recording stage timeline of all threads, save it as Chrome trace when unchecked
+        '''
+        if checked:
+            profiler.start()
+            return
+
+        profiler.stop()
+        save_path, _ = QFileDialog.getSaveFileName(self, 'Save performance timeline',
+                                                   'TrackingBot timeline ' + datetime.now().strftime('%Y-%m-%d-%H%M'),
+                                                   'Chrome trace (*.json)')
+        if not save_path:
+            return
+        try:
+            span_count = profiler.export(save_path)
+            self.info_msg = QMessageBox()
+            self.info_msg.setWindowTitle('TrackingBot')
+            self.info_msg.setIcon(QMessageBox.Information)
+            self.info_msg.setText('Performance timeline saved.')
+            self.info_msg.setInformativeText(f'{span_count} spans saved to {save_path}\n'
+                                             'Open with chrome://tracing or ui.perfetto.dev')
+            self.info_msg.setDetailedText(profiler.summary().round(3).to_string(index=False))
+            self.info_msg.exec()
+        except Exception as e:
+            error = str(e)
+            self.warning_msg = QMessageBox()
+            self.warning_msg.setWindowTitle('Error')
+            self.warning_msg.setText('Failed to save performance timeline.')
+            self.warning_msg.setIcon(QMessageBox.Warning)
+            self.warning_msg.setDetailedText(error)
+            self.warning_msg.exec()
+
+    def export_latency(self):
+        '''
+        save latency of live tracking session next to the recording
+        :return: summary text
+        '''
+        try:
+            save_path = self.videoExportThread.file_path.rsplit('.', 1)[0] + ' latency.csv'
+            summary = self.latencyMonitor.export(save_path, frame_period=1 / self.trackingCamThread.fps)
+            return f'Latency since frame capture (ms)\n{summary.round(2).to_string(index=False)}\n\nSaved to {save_path}'
+        except Exception as e:
+            return f'Failed to export latency: {e}'
+
     def cam_exceed_index_alarm(self):
         '''
         cancel and reset tracking progress when object out of index at first frame
@@ -2793,6 +3421,7 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
                      pass
 
             self.controllerThread.ROIs = self.camROICanvas.scene.ROIs
+            self.controllerThread.cam_prop = self.camera_prop
             self.controllerThread.create_roi()
             # self.apply_roi_flag
 
@@ -2818,7 +3447,7 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         try:
             self.camROICanvas.scene.erase()
             self.controllerThread.ROIs = None
-            self.controllerThread.ROI_zones.clear()
+            self.controllerThread.zoneEngine = None
         except Exception as e:
             print(e)
         finally:
@@ -2838,14 +3467,13 @@ class MainWindow(QtWidgets.QMainWindow, gui.Ui_MainWindow):
             self.hardwareWizard.circCamROIButton.setStyle(self.hardwareWizard.circCamROIButton.style())
 
     def activate_controller_log(self, tracked_objects,expired_id_list,tracked_index,tracked_elapse):
-
+        '''
+        queue positions of current frame to the running controller thread
+        '''
         self.controllerThread.track_results(tracked_objects,
                                             expired_id_list,
                                             tracked_index,
                                             tracked_elapse)
-        self.controllerThread.start()
-        self.controllerThread.active_device = self.hardwareWizard.active_device
-
 
     #############################################################################################
     # Functions for other operations
@@ -3341,6 +3969,8 @@ class DataProcessDialog(QDialog):
         self.pixel_per_metric = None
         self.data_save_path = None
         self.graph_save_path = None
+        self.bin_width = 1
+        self.zone_mask = None
         # self.dataExportThread.timesignal.progressStart.connect(self.setStart) # 0%
         self.dataExportThread.timesignal.data_process_fin.connect(self.setFinish) #100%
 
@@ -3368,6 +3998,8 @@ class DataProcessDialog(QDialog):
         self.dataExportThread.video_fps = self.video_fps
         self.dataExportThread.object_num = self.object_num
         self.dataExportThread.pixel_per_metric = self.pixel_per_metric
+        self.dataExportThread.bin_width = self.bin_width
+        self.dataExportThread.zone_mask = self.zone_mask
         self.progress_bar.setRange(0, 0)
         self.progress_bar.setValue(0)
         # start process data
@@ -3468,6 +4100,7 @@ class TraceProcessDialog(QDialog):
         self.setModal(True)
         self.show()
         self.traceExportThread.dataLogThread = self.dataLogThread
+        self.traceExportThread.mapAccumulator = self.dataLogThread.mapAccumulator
         self.traceExportThread.trace_frame = self.trace_frame
         self.traceExportThread.video_prop = self.video_prop
         self.progress_bar.setRange(0, 0)
@@ -3522,6 +4155,7 @@ class GraphProcessDialog(QDialog):
         self.setModal(True)
         self.show()
         self.graphExportThread.dataLogThread = self.dataLogThread
+        self.graphExportThread.mapAccumulator = self.dataLogThread.mapAccumulator
         self.graphExportThread.video_prop = self.video_prop
 
         self.progress_bar.setRange(0, 0)
@@ -3540,6 +4174,157 @@ class GraphProcessDialog(QDialog):
         self.timesignal.heat_map.emit(heat_map)
 
 
+class CameraSettingsDialog(QDialog):
+    '''
+    edit a CameraConfig, values are written back by apply()
+    '''
+
+    def __init__(self, config, parent=None):
+        QDialog.__init__(self, parent)
+        self.config = config
+        self.init_UI()
+
+    def init_UI(self):
+        self.setWindowTitle('Camera settings')
+        self.layout = QFormLayout()
+
+        self.deviceEdit = QLineEdit(str(self.config.device))
+        self.deviceEdit.setToolTip('Device index, device path or stream url')
+        self.backendBox = QComboBox()
+        self.backendBox.addItems(list(BACKENDS))
+        self.backendBox.setCurrentText(self.config.backend)
+        # 0 leaves the driver default
+        self.widthSpin = self.optional_spin(self.config.width, 8192)
+        self.heightSpin = self.optional_spin(self.config.height, 8192)
+        self.fpsSpin = self.optional_spin(self.config.fps, 1000)
+        self.fourccBox = QComboBox()
+        self.fourccBox.setEditable(True)
+        self.fourccBox.addItems(['Default', 'MJPG', 'YUYV', 'H264'])
+        self.fourccBox.setCurrentText(self.config.fourcc or 'Default')
+        self.bufferSpin = self.optional_spin(self.config.buffer_size, 32)
+
+        self.layout.addRow('Device', self.deviceEdit)
+        self.layout.addRow('Backend', self.backendBox)
+        self.layout.addRow('Width', self.widthSpin)
+        self.layout.addRow('Height', self.heightSpin)
+        self.layout.addRow('Frame rate', self.fpsSpin)
+        self.layout.addRow('Pixel format', self.fourccBox)
+        self.layout.addRow('Driver buffer', self.bufferSpin)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        self.layout.addRow(buttons)
+        self.setLayout(self.layout)
+
+    def optional_spin(self, value, maximum):
+        spin = QSpinBox()
+        spin.setRange(0, maximum)
+        spin.setSpecialValueText('Default')
+        spin.setValue(int(value or 0))
+        return spin
+
+    def apply(self):
+        device = self.deviceEdit.text().strip()
+        self.config.device = int(device) if device.isdigit() else device
+        self.config.backend = self.backendBox.currentText()
+        self.config.width = self.widthSpin.value() or None
+        self.config.height = self.heightSpin.value() or None
+        self.config.fps = self.fpsSpin.value() or None
+        fourcc = self.fourccBox.currentText().strip()
+        self.config.fourcc = fourcc if len(fourcc) == 4 else None
+        self.config.buffer_size = self.bufferSpin.value() or None
+
+
+class TrackerSettingsDialog(QDialog):
+    '''
+    edit identification settings of TrackingMethod, load or save them as json,
+    e.g. the best settings found by sweep.py --settings
+    '''
+
+    def __init__(self, settings, parent=None):
+        QDialog.__init__(self, parent)
+        self.init_UI()
+        self.set_settings(settings)
+
+    def init_UI(self):
+        self.setWindowTitle('Tracker settings')
+        self.layout = QFormLayout()
+
+        self.distThreshSpin = QDoubleSpinBox()
+        self.distThreshSpin.setRange(1, 1000)
+        self.distThreshSpin.setToolTip('Maximum distance in pixels between prediction and detection of a subject')
+        self.maxLostSpin = QSpinBox()
+        self.maxLostSpin.setRange(1, 100000)
+        self.maxLostSpin.setToolTip('Frames a subject may be undetected before its identity expires')
+        self.maxTraceSpin = QSpinBox()
+        self.maxTraceSpin.setRange(1, 100000)
+        self.stdAccSpin = QDoubleSpinBox()
+        self.stdAccSpin.setDecimals(3)
+        self.stdAccSpin.setRange(0.001, 1000)
+        self.stdAccSpin.setToolTip('Kalman filter process noise')
+        self.stdMeasSpin = QDoubleSpinBox()
+        self.stdMeasSpin.setDecimals(3)
+        self.stdMeasSpin.setRange(0.001, 1000)
+        self.stdMeasSpin.setToolTip('Kalman filter measurement noise')
+
+        self.layout.addRow('Distance threshold', self.distThreshSpin)
+        self.layout.addRow('Max lost frames', self.maxLostSpin)
+        self.layout.addRow('Trace length', self.maxTraceSpin)
+        self.layout.addRow('Process noise', self.stdAccSpin)
+        self.layout.addRow('Measurement noise', self.stdMeasSpin)
+
+        fileButtons = QHBoxLayout()
+        for text, slot in (('Load...', self.load), ('Save...', self.save), ('Defaults', self.set_defaults)):
+            button = QPushButton(text)
+            button.clicked.connect(slot)
+            fileButtons.addWidget(button)
+        self.layout.addRow(fileButtons)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        self.layout.addRow(buttons)
+        self.setLayout(self.layout)
+
+    def set_settings(self, settings):
+        self.distThreshSpin.setValue(settings['dist_thresh'])
+        self.maxLostSpin.setValue(int(settings['max_lost_frames']))
+        self.maxTraceSpin.setValue(int(settings['max_trace_len']))
+        self.stdAccSpin.setValue(settings['std_acc'])
+        self.stdMeasSpin.setValue(settings['std_meas'])
+
+    def set_defaults(self):
+        self.set_settings(DEFAULT_SETTINGS)
+
+    def settings(self):
+        return {'dist_thresh': self.distThreshSpin.value(),
+                'max_lost_frames': self.maxLostSpin.value(),
+                'max_trace_len': self.maxTraceSpin.value(),
+                'std_acc': self.stdAccSpin.value(),
+                'std_meas': self.stdMeasSpin.value()}
+
+    def load(self):
+        settings_path, _ = QFileDialog.getOpenFileName(self, 'Load tracker settings', '', 'Settings (*.json)')
+        if not settings_path:
+            return
+        try:
+            self.set_settings(load_settings(settings_path))
+        except (OSError, ValueError) as e:
+            self.error_msg = QMessageBox()
+            self.error_msg.setWindowTitle('Error')
+            self.error_msg.setText('Failed to load tracker settings.')
+            self.error_msg.setIcon(QMessageBox.Warning)
+            self.error_msg.setDetailedText(str(e))
+            self.error_msg.exec()
+
+    def save(self):
+        settings_path, _ = QFileDialog.getSaveFileName(self, 'Save tracker settings', 'tracker settings.json',
+                                                       'Settings (*.json)')
+        if settings_path:
+            save_settings(settings_path, self.settings())
+
+
 class Communicate(QObject):
     # cam_signal = pyqtSignal(QImage)
     data_export_finish = pyqtSignal(str)
@@ -3551,11 +4336,15 @@ class Communicate(QObject):
 
 
 class HardwareWizard(QtWidgets.QMainWindow,Ui_HardwireWizardWindow):
-    def __init__(self):
+    def __init__(self, fake_arduino=False):
         super(HardwareWizard,self).__init__()
         self.setupUi(self)
         self.disconnectPort.setEnabled(False)
         self.active_device = None
+        # show LOOPBACK_PORT in port list
+        self.fake_arduino = fake_arduino
+        # writer thread of all commands sent to device
+        self.serialChannel = SerialChannel()
         self.comboBox.installEventFilter(self)
         self.comboBox.currentIndexChanged.connect(self.change_port)
         self.connectPort.clicked.connect(self.connect_port)
@@ -3582,6 +4371,9 @@ class HardwareWizard(QtWidgets.QMainWindow,Ui_HardwireWizardWindow):
             available_ports.append([p.description, p.device])
             # print(str(p.description)) # device name + port name
             # print(str(p.device)) # port name
+        # emulated T-maze firmware for testing without hardware
+        if self.fake_arduino:
+            available_ports.append(['Loopback (fake Arduino)', LOOPBACK_PORT])
 
         for info in available_ports:
             self.comboBox.addItem(info[0])
@@ -3602,10 +4394,13 @@ class HardwareWizard(QtWidgets.QMainWindow,Ui_HardwireWizardWindow):
         if available_ports and selected_port_index != -1:
             try:
                 # portOpen = True
-                self.active_device = serial.Serial(available_ports[selected_port_index][1], 19200, timeout=1)
+                # non-blocking read, ACK are polled by serial channel
+                self.active_device = open_transport(available_ports[selected_port_index][1], 19200, timeout=0)
                 # print(f'Connected to port {available_ports[selected_port_index][1]}!')
                 time.sleep(0.5)
                 # thread start
+                self.serialChannel.device = self.active_device
+                self.serialChannel.start()
                 print(self.active_device.isOpen())
                 self.comboBox.setEnabled(False)
                 self.connectPort.setEnabled(False)
@@ -3639,6 +4434,10 @@ class HardwareWizard(QtWidgets.QMainWindow,Ui_HardwireWizardWindow):
 
     def disconnect_port(self):
         try:
+            # thread stop
+            self.serialChannel.stop()
+            self.serialChannel.wait()
+            self.serialChannel.device = None
             self.active_device.close()
 
         except Exception as e:
@@ -3671,54 +4470,69 @@ class HardwareWizard(QtWidgets.QMainWindow,Ui_HardwireWizardWindow):
         return False
 
     def gate_open(self):
-        self.active_device.write(f'61'.encode())
+        self.serialChannel.send([(GATE_CHANNEL, 1)])
 
     def gate_close(self):
-        self.active_device.write(f'60'.encode())
+        self.serialChannel.send([(GATE_CHANNEL, 0)])
 
 
 class ControllerThread(QThread):
+    '''
+    persistent worker of closed-loop control
+    position snapshots of each frame are queued by MainWindow and processed in order,
+    commands of each frame are sent as one packet through the serial channel,
+    so commands are emitted in frame order without starting a thread per frame
+    '''
 
     def __init__(self):
         QThread.__init__(self)
         self.stopped = False
-        self.active_device = None
+        # SerialChannel of connected device
+        self.serialChannel = None
         self.mutex = QMutex()
         self.ROIs = None
-        self.ROI_zones = []
+        self.cam_prop = None
+        # zone membership of subjects, None if no ROI applied
+        self.zoneEngine = None
+        # (tracked index, tracked elapse, subject id, zone index, True for enter / False for exit)
+        self.zone_events = []
         self.tracked_object = None
         self.expired_id_list = None
         self.tracked_index = None
         self.tracked_elapse = None
 
+        # (tracked index, tracked elapse, [(candidate id, pos_x, pos_y), ...]) of each frame
+        self.snapshot_queue = queue.Queue()
+
     def run(self):
 
         with QMutexLocker(self.mutex):
             self.stopped = False
 
-        if self.stopped:
-            return
+        while not self.stopped:
+            try:
+                snapshot = self.snapshot_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
 
-        else:
-            tic = time.perf_counter()
-
-            if self.ROI_zones:
-                # tracked coords on frame, roi coords on canvas, need convert
-
-                for i in range(len(self.tracked_object)):
-                    for j in range(len(self.ROI_zones)):
-                        condition = self.ROI_zones[j].rect.contains(self.tracked_object[i].pos_prediction[0][0]/1.875,
-                                                 self.tracked_object[i].pos_prediction[1][0]/1.875)
-                        if condition and self.ROI_zones[j].state is False: # if condition and state is false
-                            self.active_device.write(f'{j}1'.encode())
-                            self.ROI_zones[j].state = True # change state
-                        else:
-                            pass
-            else:
-                # print('No zone')
-                pass
+            self.process_snapshot(*snapshot)
+
+    @profiler.traced(category='controller')
+    def process_snapshot(self, tracked_index, tracked_elapse, positions):
+        '''
+        update zone state of all subjects and send the commands of this frame
+        '''
+        self.tracked_index = tracked_index
+        self.tracked_elapse = tracked_elapse
 
-            toc = time.perf_counter()
+        if self.zoneEngine is not None and positions:
+            subject_ids, pos_x, pos_y = zip(*positions)
+            events, commands = self.zoneEngine.update(subject_ids, pos_x, pos_y)
+            for subject_id, zone, enter in events:
+                self.zone_events.append((tracked_index, tracked_elapse, subject_id, zone, enter))
+            # switch on when first subject enters a zone, off when last subject leaves
+            if commands and self.serialChannel is not None:
+                self.serialChannel.send([(zone, int(on)) for zone, on in commands], tracked_index)
 
     def stop(self):
         with QMutexLocker(self.mutex):
@@ -3735,29 +4549,44 @@ class ControllerThread(QThread):
         receive the index of timestamp;
         video time elapsed when time stamp is true
         passed from tracking thread
+
+        positions are copied because tracking thread keeps updating the registered objects,
+        lost objects are passed as NaN so zones keep their state instead of following the prediction
         '''
         self.tracked_object = tracked_object
         self.expired_id_list = expired_id_list
-        self.tracked_index = tracked_index
-        self.tracked_elapse = tracked_elapse
+        positions = []
+        for candidate in tracked_object:
+            if candidate.lost_sample is None or candidate.lost_sample:
+                positions.append((candidate.candidate_id, np.nan, np.nan))
+            else:
+                positions.append((candidate.candidate_id,
+                                  float(candidate.pos_prediction[0][0]),
+                                  float(candidate.pos_prediction[1][0])))
+        self.snapshot_queue.put((tracked_index, tracked_elapse, positions))
 
-    def create_roi(self):
+    def clear_queue(self):
         '''
-        extract QGraphicItem from ROI objects
-        to read its coordinates
+        discard snapshots not processed yet
         '''
-        for i in range(len(self.ROIs)):
-            roi_zone = Indicator(self.ROIs[i].ROI.rect(),False)
-            self.ROI_zones.append(roi_zone)
-
+        while True:
+            try:
+                self.snapshot_queue.get_nowait()
+            except queue.Empty:
+                break
 
-class Indicator(object):
-    '''
-    Define the ROI object and its properties
-    '''
-    def __init__(self, rect, state):
-        self.rect = rect
-        self.state = state
+    def create_roi(self):
+        '''
+        build zones in camera frame coordinates from ROI objects drawn on canvas
+        '''
+        # canvas shows camera frame in 768x576 (4:3) or 1024x576 (16:9)
+        if self.cam_prop.height / self.cam_prop.width == 0.75:
+            display_width = 768
+        else:
+            display_width = 1024
+        self.zoneEngine = ZoneEngine(self.cam_prop.width, self.cam_prop.height)
+        self.zoneEngine.add_rois(self.ROIs, self.cam_prop.width / display_width, self.cam_prop.height / 576)
+        self.zoneEngine.build()
 
 
 if __name__ == "__main__":
@@ -3788,7 +4617,29 @@ if __name__ == "__main__":
 
     sys.excepthook = exception_hook
 
-    app = QtWidgets.QApplication(sys.argv)
+    import argparse
+    parser = argparse.ArgumentParser(description='TrackingBot')
+    parser.add_argument('--profile', metavar='TRACE_JSON',
+                        help='record stage timeline of all threads and save it as Chrome trace on exit')
+    parser.add_argument('--virtual-camera', nargs='?', const='', metavar='VIDEO',
+                        help='replace the live mode camera with a replayed video, moving spots if no video given')
+    parser.add_argument('--virtual-fps', type=float, default=25, help='frame rate of virtual camera')
+    parser.add_argument('--virtual-jitter', type=float, default=0,
+                        help='standard deviation of extra frame delay of virtual camera in seconds')
+    parser.add_argument('--virtual-drop-rate', type=float, default=0,
+                        help='probability of each virtual camera frame being dropped')
+    parser.add_argument('--fake-arduino', action='store_true',
+                        help='list an emulated T-maze Arduino in the port list, for testing without hardware')
+    args, qt_args = parser.parse_known_args()
+    if args.profile:
+        profiler.start()
+
+    camera_source = None
+    if args.virtual_camera is not None:
+        camera_source = VirtualCameraSource(args.virtual_camera or None, fps=args.virtual_fps,
+                                            jitter=args.virtual_jitter, drop_rate=args.virtual_drop_rate)
+
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
     # show launching screen
     splash_pix = QPixmap('icon/splash_screen.png')
     splash = QSplashScreen(splash_pix, Qt.WindowStaysOnTopHint)
@@ -3797,9 +4648,12 @@ if __name__ == "__main__":
 
     time.sleep(2)
     # connect subclass with parent class
-    window = MainWindow()
+    window = MainWindow(camera_source, args.fake_arduino)
     app.setStyleSheet((open('stylesheet.qss').read()))
     app.processEvents()
     window.show()
     splash.finish(window)
-    sys.exit(app.exec_())
+    exit_code = app.exec_()
+    if args.profile:
+        profiler.export(args.profile)
+    sys.exit(exit_code)
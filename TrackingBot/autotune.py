@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import cv2
+from PyQt5.QtCore import pyqtSignal, QThread, QObject, QMutex, QMutexLocker
+from tracking import Detection
+
+DEFAULT_BLOCK_SIZES = [11, 15, 21, 31, 41, 51, 71, 101, 151]
+DEFAULT_OFFSETS = [3, 5, 7, 9, 11, 15, 20, 25, 30]
+
+
+def sample_frames(video_path, sample_count=12):
+    '''
+    read frames spread evenly across the video
+    :return: list of BGR frames
+    '''
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f'Cannot open video {video_path}')
+    length = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frames = []
+    # skip first and last frame, often black or incomplete
+    for position in np.linspace(1, max(length - 2, 1), sample_count).astype(int):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(position))
+        ret, frame = cap.read()
+        if ret:
+            frames.append(frame)
+    cap.release()
+    return frames
+
+
+class SampleFrame(object):
+    '''
+    one sampled frame prepared once for every threshold setting:
+    blurred gray frame and integral image of its replicate padded border,
+    so the local mean of any block size is four lookups per pixel
+    '''
+
+    def __init__(self, frame, max_block_size, invert_contrast=False, valid_mask=None):
+        if invert_contrast:
+            frame = cv2.bitwise_not(frame)
+        # masked before thresholding like TrackingThread, the mask border is removed by Detection.find_contours()
+        if valid_mask is not None:
+            frame = cv2.bitwise_and(frame, frame, mask=valid_mask)
+        # same preprocessing as Detection.thresh_video()
+        frame = cv2.GaussianBlur(frame, (5, 5), 1)
+        self.gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        self.pad = max_block_size // 2
+        padded = cv2.copyMakeBorder(self.gray, self.pad, self.pad, self.pad, self.pad, cv2.BORDER_REPLICATE)
+        self.integral = cv2.integral(padded, sdepth=cv2.CV_64F)
+        self.kernel = np.ones((5, 5), np.uint8)
+
+    def local_mean(self, block_size):
+        '''
+        mean of block_size x block_size neighbourhood, rounded like cv2.adaptiveThreshold
+        '''
+        radius = block_size // 2
+        height, width = self.gray.shape
+        top = self.pad - radius
+        left = self.pad - radius
+        bottom = top + height
+        right = left + width
+        integral = self.integral
+        box = (integral[top + block_size:bottom + block_size, left + block_size:right + block_size]
+               - integral[top:bottom, left + block_size:right + block_size]
+               - integral[top + block_size:bottom + block_size, left:right]
+               + integral[top:bottom, left:right])
+        return np.rint(box / (block_size * block_size))
+
+    def blob_areas(self, mean, offset):
+        '''
+        contour area of every foreground blob, foreground as cv2.THRESH_BINARY_INV of Detection.thresh_video()
+        '''
+        thresh = np.where(self.gray - mean <= -offset, 255, 0).astype(np.uint8)
+        thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, self.kernel)
+        # same contour filtering as Detection.detect_contours()
+        _, areas = Detection.find_contours(thresh)
+        return np.array(areas)
+
+
+def evaluate_sample(sample, block_sizes, offsets):
+    '''
+    :return: dict of (block size, offset): blob areas of this sample
+    '''
+    areas = {}
+    for block_size in block_sizes:
+        mean = sample.local_mean(block_size)
+        for offset in offsets:
+            areas[(block_size, offset)] = sample.blob_areas(mean, offset)
+    return areas
+
+
+def score_setting(sample_areas, obj_num, min_ratio=0.4, max_ratio=2.5):
+    '''
+    subject area is the median of the obj_num largest blobs of each sample,
+    contour range is set around it and blobs in range are counted
+    :return: dict of contour range, count error, exact count ratio, area variation and score, lower score is better
+    '''
+    largest = np.concatenate([np.sort(areas)[-obj_num:] for areas in sample_areas if len(areas)] or [np.empty(0)])
+    largest = largest[largest > 0]
+    if not len(largest):
+        return None
+    subject_area = float(np.median(largest))
+    min_contour = max(int(subject_area * min_ratio), 1)
+    max_contour = max(int(np.ceil(subject_area * max_ratio)), min_contour + 1)
+
+    counts = []
+    accepted = []
+    for areas in sample_areas:
+        selected = areas[(areas >= min_contour) & (areas <= max_contour)]
+        counts.append(len(selected))
+        accepted.append(selected)
+    counts = np.array(counts)
+    accepted = np.concatenate(accepted)
+
+    count_error = float(np.mean(np.abs(counts - obj_num)) / obj_num)
+    exact_ratio = float(np.mean(counts == obj_num))
+    area_cv = float(accepted.std() / accepted.mean()) if len(accepted) > 1 else 1.0
+    return {'min_contour': min_contour,
+            'max_contour': max_contour,
+            'subject_area': subject_area,
+            'mean_count': float(counts.mean()),
+            'exact_ratio': exact_ratio,
+            'count_error': count_error,
+            'area_cv': area_cv,
+            'score': (1 - exact_ratio) + count_error + 0.25 * area_cv}
+
+
+def auto_tune(frames, obj_num, block_sizes=None, offsets=None, invert_contrast=False, valid_mask=None,
+              workers=None, progress=None):
+    '''
+    evaluate a grid of threshold settings on sampled frames
+    :param frames: frames from sample_frames()
+    :param progress: callable receiving the number of finished samples
+    :return: DataFrame of settings ranked by score, best first
+    '''
+    height, width = frames[0].shape[:2]
+    block_sizes = [b for b in (block_sizes or DEFAULT_BLOCK_SIZES) if b % 2 == 1 and 3 <= b < min(width, height)]
+    offsets = offsets or DEFAULT_OFFSETS
+
+    def run(frame):
+        # OpenCV and numpy release the GIL, samples are evaluated in parallel threads
+        sample = SampleFrame(frame, max(block_sizes), invert_contrast, valid_mask)
+        return evaluate_sample(sample, block_sizes, offsets)
+
+    results = []
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for finished, areas in enumerate(executor.map(run, frames), 1):
+            results.append(areas)
+            if progress is not None:
+                progress(finished)
+
+    rows = []
+    for block_size in block_sizes:
+        for offset in offsets:
+            scored = score_setting([areas[(block_size, offset)] for areas in results], obj_num)
+            if scored is not None:
+                rows.append(dict(block_size=block_size, offset=offset, **scored))
+    columns = ['block_size', 'offset', 'min_contour', 'max_contour', 'subject_area', 'mean_count',
+               'exact_ratio', 'count_error', 'area_cv', 'score']
+    return pd.DataFrame(rows, columns=columns).sort_values(['score', 'area_cv', 'block_size'], ignore_index=True)
+
+
+class AutoTuneThread(QThread):
+    '''
+    sample frames of the video and rank threshold settings in background
+    '''
+
+    def __init__(self):
+        QThread.__init__(self)
+        self.mutex = QMutex()
+        self.timeSignal = Communicate()
+        self.video_path = None
+        self.obj_num = 1
+        self.sample_count = 12
+        self.invert_contrast = False
+        self.valid_mask = None
+        self.result = None
+
+    def run(self):
+        try:
+            frames = sample_frames(self.video_path, self.sample_count)
+            if not frames:
+                raise IOError(f'No frame read from {self.video_path}')
+            self.result = auto_tune(frames, self.obj_num, invert_contrast=self.invert_contrast,
+                                    valid_mask=self.valid_mask,
+                                    progress=self.timeSignal.tune_progress.emit)
+            self.timeSignal.tune_finished.emit(self.result)
+        except Exception as e:
+            self.timeSignal.tune_failed.emit(str(e))
+
+
+class Communicate(QObject):
+    tune_progress = pyqtSignal(int)
+    tune_finished = pyqtSignal(object)
+    tune_failed = pyqtSignal(str)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recommend threshold settings from frames sampled across a video')
+    parser.add_argument('video')
+    parser.add_argument('--subjects', type=int, default=1, help='number of subjects')
+    parser.add_argument('--samples', type=int, default=12, help='frames sampled across the video')
+    parser.add_argument('--invert', action='store_true', help='bright subjects on dark background')
+    parser.add_argument('--block-sizes', help='comma separated odd values')
+    parser.add_argument('--offsets', help='comma separated values')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--top', type=int, default=5)
+    parser.add_argument('--output', help='save recommended settings as json')
+    args = parser.parse_args()
+
+    frames = sample_frames(args.video, args.samples)
+    result = auto_tune(frames, args.subjects,
+                       [int(v) for v in args.block_sizes.split(',')] if args.block_sizes else None,
+                       [int(v) for v in args.offsets.split(',')] if args.offsets else None,
+                       args.invert, workers=args.workers)
+    print(result.head(args.top).round(3).to_string(index=False))
+
+    if args.output:
+        best = result.iloc[0]
+        settings = {'block_size': int(best['block_size']), 'offset': int(best['offset']),
+                    'min_contour': int(best['min_contour']), 'max_contour': int(best['max_contour']),
+                    'invert_contrast': args.invert, 'obj_num': args.subjects}
+        with open(args.output, 'w') as f:
+            json.dump(settings, f, indent=2)
+        print(f'Saved settings to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
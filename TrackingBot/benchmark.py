@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import importlib.util
+from collections import namedtuple
+from datetime import datetime
+import numpy as np
+import cv2
+from PyQt5.QtWidgets import QApplication
+from synthetic import SyntheticArena
+from tracking import Detection, TrackingThread
+from tracker import TrackingMethod
+from datalog import DataLogThread, DataExportThread, TraceExportThread, GraphExportThread
+from profiler import profiler
+
+# per frame stages in pipeline order, then exporters timed once per session
+FRAME_STAGES = ('decode', 'thresh_video', 'detect_contours', 'identify', 'visualize', 'display', 'logging')
+EXPORT_STAGES = ('export_data', 'export_trace', 'export_heatmap')
+
+video_prop = namedtuple('video_prop', ['width', 'height', 'fps'])
+
+
+def summarize(samples):
+    '''
+    :param samples: durations in seconds
+    :return: dict of ms/frame statistics and frames/sec
+    '''
+    samples = np.asarray(samples, dtype=float) * 1000
+    if not len(samples):
+        return {'count': 0}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    mean = samples.mean()
+    return {'count': int(len(samples)),
+            'mean_ms': round(float(mean), 4),
+            'p50_ms': round(float(p50), 4),
+            'p95_ms': round(float(p95), 4),
+            'p99_ms': round(float(p99), 4),
+            'fps': round(float(1000 / mean), 2) if mean > 0 else None}
+
+
+class PipelineBenchmark(object):
+    '''
+    time each stage of the offline tracking pipeline on a synthetic video
+    '''
+
+    def __init__(self, width, height, subjects, frames=200, fps=25, workdir=None, seed=0):
+        self.width = width
+        self.height = height
+        self.subjects = subjects
+        self.frames = frames
+        self.fps = fps
+        # temporary folder is removed by cleanup(), a given workdir is kept
+        self.tempdir = tempfile.TemporaryDirectory(prefix='trackingbot-benchmark-') if workdir is None else None
+        self.workdir = self.tempdir.name if workdir is None else workdir
+        self.seed = seed
+        self.samples = {stage: [] for stage in FRAME_STAGES + EXPORT_STAGES}
+        self.errors = {}
+
+        # subject size and speed scale with resolution
+        self.radius = max(int(height / 90), 4)
+        area = np.pi * self.radius ** 2
+        self.min_contour = int(area * 0.3)
+        self.max_contour = int(area * 3)
+        # window of adaptive threshold must be larger than a subject to keep it filled
+        self.block_size = 4 * self.radius + 1
+        self.offset = 11
+
+    def cleanup(self):
+        if self.tempdir is not None:
+            self.tempdir.cleanup()
+
+    def make_video(self):
+        arena = SyntheticArena(self.subjects, self.radius, speed=self.width / 10, width=self.width,
+                               height=self.height, fps=self.fps, duration=self.frames / self.fps, seed=self.seed)
+        video_path = os.path.join(self.workdir, f'arena {self.width}x{self.height} {self.subjects}.avi')
+        arena.write(video_path)
+        return video_path
+
+    def run(self):
+        video_path = self.make_video()
+        cap = cv2.VideoCapture(video_path)
+
+        detection = Detection()
+        trackingMethod = TrackingMethod(self.subjects, 15, 60, 600)
+        trackingThread = TrackingThread()
+        aspect = 'classic' if self.height / self.width == 0.75 else 'widescreen'
+        interpolation = cv2.INTER_AREA if self.width > 1024 else cv2.INTER_LINEAR
+        dataLogThread = DataLogThread()
+        dataLogThread.obj_num = self.subjects
+        dataLogThread.mapAccumulator.reset(self.width, self.height, self.fps)
+
+        frame_index = 0
+        last_frame = None
+        while True:
+            tic = time.perf_counter()
+            ret, frame = cap.read()
+            toc = time.perf_counter()
+            if not ret:
+                break
+            self.samples['decode'].append(toc - tic)
+
+            tic = time.perf_counter()
+            thresh_frame = detection.thresh_video(frame, self.block_size, self.offset)
+            toc = time.perf_counter()
+            self.samples['thresh_video'].append(toc - tic)
+
+            tic = time.perf_counter()
+            contour_frame, entrant_detected = detection.detect_contours(frame, thresh_frame,
+                                                                        self.min_contour, self.max_contour)
+            toc = time.perf_counter()
+            self.samples['detect_contours'].append(toc - tic)
+
+            tic = time.perf_counter()
+            trackingMethod.identify(entrant_detected, self.min_contour, self.max_contour)
+            toc = time.perf_counter()
+            self.samples['identify'].append(toc - tic)
+
+            tic = time.perf_counter()
+            trackingMethod.visualize(contour_frame, is_centroid=True, is_mark=True, is_trajectory=True)
+            toc = time.perf_counter()
+            self.samples['visualize'].append(toc - tic)
+
+            tic = time.perf_counter()
+            trackingThread.convert_frame(trackingThread.scale_frame(contour_frame, interpolation, aspect))
+            toc = time.perf_counter()
+            self.samples['display'].append(toc - tic)
+
+            tic = time.perf_counter()
+            elapse = f'{frame_index / self.fps:.3f}'
+            # logger appends expired subjects to the list it receives
+            dataLogThread.track_results(list(trackingMethod.candidate_list), list(trackingMethod.expired_id),
+                                        frame_index, elapse)
+            dataLogThread.run()
+            toc = time.perf_counter()
+            self.samples['logging'].append(toc - tic)
+
+            last_frame = frame
+            frame_index += 1
+
+        cap.release()
+        dataLogThread.stop()
+        self.run_exporters(dataLogThread, last_frame)
+        return self.results()
+
+    def run_exporters(self, dataLogThread, last_frame):
+        prop = video_prop(self.width, self.height, self.fps)
+
+        dataExportThread = DataExportThread()
+        dataExportThread.dataLogThread = dataLogThread
+        dataExportThread.video_fps = self.fps
+        dataExportThread.pixel_per_metric = 1
+        dataExportThread.data_save_path = self.workdir
+        # result sheets are written with the optional excel writer
+        if importlib.util.find_spec('xlsxwriter') is None:
+            self.errors['export_data'] = 'skipped, xlsxwriter is not installed'
+        else:
+            self.time_exporter('export_data', dataExportThread.convert_data)
+
+        traceExportThread = TraceExportThread()
+        traceExportThread.dataLogThread = dataLogThread
+        traceExportThread.mapAccumulator = dataLogThread.mapAccumulator
+        traceExportThread.trace_frame = last_frame
+        traceExportThread.video_prop = prop
+        self.time_exporter('export_trace', traceExportThread.generate_trace)
+
+        graphExportThread = GraphExportThread()
+        graphExportThread.dataLogThread = dataLogThread
+        graphExportThread.mapAccumulator = dataLogThread.mapAccumulator
+        graphExportThread.video_prop = prop
+        self.time_exporter('export_heatmap', graphExportThread.generate_plot)
+
+    def time_exporter(self, stage, export):
+        try:
+            tic = time.perf_counter()
+            export()
+            self.samples[stage].append(time.perf_counter() - tic)
+        except Exception as e:
+            # a failed exporter is reported in its row, other stages are still timed
+            self.errors[stage] = str(e)
+
+    def results(self):
+        rows = []
+        for stage, samples in self.samples.items():
+            row = {'resolution': f'{self.width}x{self.height}', 'subjects': self.subjects, 'stage': stage}
+            row.update(summarize(samples))
+            if stage in self.errors:
+                row['error'] = self.errors[stage]
+            rows.append(row)
+
+        # whole per frame pipeline
+        total = np.sum([self.samples[stage] for stage in FRAME_STAGES], axis=0)
+        row = {'resolution': f'{self.width}x{self.height}', 'subjects': self.subjects, 'stage': 'pipeline'}
+        row.update(summarize(total))
+        rows.append(row)
+        return rows
+
+
+def run_matrix(resolutions, subject_counts, frames, fps=25, seed=0):
+    '''
+    :param resolutions: list of (width, height)
+    :param subject_counts: list of subject counts
+    :return: result document, ready for json
+    '''
+    results = []
+    for width, height in resolutions:
+        for subjects in subject_counts:
+            benchmark = PipelineBenchmark(width, height, subjects, frames, fps, seed=seed)
+            try:
+                results.extend(benchmark.run())
+            finally:
+                benchmark.cleanup()
+
+    return {'created': datetime.now().isoformat(timespec='seconds'),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'frames': frames,
+            'results': results}
+
+
+def compare(current, baseline, stat='p50_ms'):
+    '''
+    :return: list of (resolution, subjects, stage, baseline, current, ratio), ratio > 1 is slower
+    '''
+    reference = {(row['resolution'], row['subjects'], row['stage']): row for row in baseline['results']}
+    rows = []
+    for row in current['results']:
+        key = (row['resolution'], row['subjects'], row['stage'])
+        if key in reference and reference[key].get(stat) and row.get(stat):
+            rows.append(key + (reference[key][stat], row[stat], row[stat] / reference[key][stat]))
+    return rows
+
+
+def print_results(document, stat='p50_ms'):
+    print(f'{"resolution":>10} {"subjects":>8} {"stage":>16} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"fps":>9}')
+    for row in document['results']:
+        if not row.get('count'):
+            print(f'{row["resolution"]:>10} {row["subjects"]:>8} {row["stage"]:>16} {row.get("error", "-")}')
+            continue
+        print(f'{row["resolution"]:>10} {row["subjects"]:>8} {row["stage"]:>16} {row["p50_ms"]:>9.3f} '
+              f'{row["p95_ms"]:>9.3f} {row["p99_ms"]:>9.3f} {row["fps"]:>9.1f}')
+
+
+def parse_resolution(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark each stage of the TrackingBot pipeline')
+    parser.add_argument('--resolutions', default='640x480,1280x720,1920x1080',
+                        help='comma separated list, e.g. 640x480,1920x1080')
+    parser.add_argument('--subjects', default='1,5,10', help='comma separated subject counts')
+    parser.add_argument('--frames', type=int, default=200, help='frames per case')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='save results as json')
+    parser.add_argument('--compare', help='json results of a previous run to compare with')
+    parser.add_argument('--trace', help='also save stage timeline as Chrome trace json')
+    args = parser.parse_args()
+
+    # display conversion needs a QApplication, no window is shown
+    if 'QT_QPA_PLATFORM' not in os.environ and not os.environ.get('DISPLAY') and sys.platform.startswith('linux'):
+        os.environ['QT_QPA_PLATFORM'] = 'offscreen'
+    app = QApplication.instance() or QApplication(sys.argv)
+    if args.trace:
+        profiler.start()
+
+    document = run_matrix([parse_resolution(text) for text in args.resolutions.split(',')],
+                          [int(text) for text in args.subjects.split(',')], args.frames, seed=args.seed)
+    print_results(document)
+
+    if args.trace:
+        profiler.stop()
+        print(f'Saved {profiler.export(args.trace)} spans to {args.trace}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f'Saved results to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f'\nCompared with {args.compare} ({baseline.get("created")}), p50 ratio > 1 is slower')
+        for resolution, subjects, stage, before, after, ratio in compare(document, baseline):
+            print(f'{resolution:>10} {subjects:>8} {stage:>16} {before:>9.3f} -> {after:>9.3f}  x{ratio:.2f}')
+
+
+if __name__ == '__main__':
+    main()
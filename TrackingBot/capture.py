@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import time
+from collections import deque
+import numpy as np
+import cv2
+from PyQt5.QtCore import QThread, QMutex, QMutexLocker, QWaitCondition
+from profiler import profiler
+
+# name of capture backend: OpenCV api preference
+BACKENDS = {'auto': cv2.CAP_ANY,
+            'dshow': cv2.CAP_DSHOW,
+            'msmf': cv2.CAP_MSMF,
+            'v4l2': cv2.CAP_V4L2,
+            'avfoundation': cv2.CAP_AVFOUNDATION,
+            'gstreamer': cv2.CAP_GSTREAMER,
+            'ffmpeg': cv2.CAP_FFMPEG}
+
+
+def default_backend():
+    '''
+    native camera backend of current platform
+    '''
+    if sys.platform.startswith('win'):
+        return 'dshow'
+    elif sys.platform.startswith('linux'):
+        return 'v4l2'
+    elif sys.platform == 'darwin':
+        return 'avfoundation'
+    return 'auto'
+
+
+class CameraConfig(object):
+    '''
+    settings of one camera, None leaves the driver default
+    '''
+
+    def __init__(self, device=0, backend=None, width=None, height=None, fps=None, fourcc=None, buffer_size=1):
+        '''
+        :param device: device index, or device path / stream url / gstreamer pipeline string
+        :param backend: key of BACKENDS, None for native backend of current platform
+        :param width: requested frame width
+        :param height: requested frame height
+        :param fps: requested frame rate
+        :param fourcc: requested pixel format, e.g. 'MJPG' or 'YUYV'
+        :param buffer_size: number of frames buffered by the driver
+        '''
+        self.device = device
+        self.backend = default_backend() if backend is None else backend
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.fourcc = fourcc
+        self.buffer_size = buffer_size
+
+    def __repr__(self):
+        return f'CameraConfig(device={self.device!r}, backend={self.backend!r})'
+
+
+class CameraSource(object):
+    '''
+    open a camera with the given config
+    '''
+
+    def __init__(self, config=None):
+        self.config = CameraConfig() if config is None else config
+
+    def open(self):
+        '''
+        :return: opened cv2.VideoCapture, check isOpened() before use
+        '''
+        config = self.config
+        if config.backend not in BACKENDS:
+            raise ValueError(f'Unknown camera backend {config.backend}, '
+                             f'available backends: {", ".join(BACKENDS)}')
+        cap = cv2.VideoCapture(config.device, BACKENDS[config.backend])
+
+        # pixel format must be set before frame size on some drivers
+        if config.fourcc is not None:
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*config.fourcc))
+        if config.width is not None:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, config.width)
+        if config.height is not None:
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, config.height)
+        if config.fps is not None:
+            cap.set(cv2.CAP_PROP_FPS, config.fps)
+        if config.buffer_size is not None:
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, config.buffer_size)
+
+        return cap
+
+
+class VirtualCapture(object):
+    '''
+    cv2.VideoCapture like camera that replays a video file or generated frames in real time
+    '''
+
+    def __init__(self, path=None, generator=None, width=640, height=480, fps=25,
+                 jitter=0, drop_rate=0, loop=True, seed=None):
+        self.fps = fps
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.loop = loop
+        self.rng = np.random.default_rng(seed)
+        self.generator = generator
+        self.cap = None
+
+        if path is not None:
+            self.cap = cv2.VideoCapture(path)
+            self.width = self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+            self.height = self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        else:
+            self.width = width
+            self.height = height
+            if self.generator is None:
+                self.generator = self.moving_spots
+
+        self.frame_index = 0
+        self.frames_dropped = 0
+        self.start_time = None
+        self.opened = self.cap is None or self.cap.isOpened()
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        '''
+        wait until the frame is due, then return it
+        :return: ret, frame like cv2.VideoCapture.read()
+        '''
+        if not self.opened:
+            return False, None
+        if self.start_time is None:
+            self.start_time = time.perf_counter()
+
+        # skip frames to simulate drops in camera or driver
+        while self.drop_rate > 0 and self.rng.random() < self.drop_rate:
+            if not self.next_frame()[0]:
+                return False, None
+            self.frames_dropped += 1
+
+        due = self.start_time + self.frame_index / self.fps
+        if self.jitter > 0:
+            due += abs(self.rng.normal(0, self.jitter))
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+        return self.next_frame()
+
+    def next_frame(self):
+        self.frame_index += 1
+        if self.cap is None:
+            return True, self.generator(self.frame_index - 1, int(self.width), int(self.height))
+
+        ret, frame = self.cap.read()
+        if not ret and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read()
+        return ret, frame
+
+    def moving_spots(self, frame_index, width, height):
+        '''
+        default generator: dark spots circling on a bright background
+        '''
+        frame = np.full((height, width, 3), 200, dtype=np.uint8)
+        radius = min(width, height) / 3
+        for i in range(3):
+            angle = 2 * np.pi * (frame_index / (self.fps * (4 + i)) + i / 3)
+            center = (int(width / 2 + radius * np.cos(angle)), int(height / 2 + radius * np.sin(angle)))
+            cv2.circle(frame, center, max(min(width, height) // 40, 2), (30, 30, 30), -1)
+        return frame
+
+    def get(self, prop_id):
+        if prop_id == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.width
+        elif prop_id == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.height
+        elif prop_id == cv2.CAP_PROP_FPS:
+            return self.fps
+        return 0
+
+    def set(self, prop_id, value):
+        return False
+
+    def release(self):
+        self.opened = False
+        if self.cap is not None:
+            self.cap.release()
+
+
+class VirtualCameraSource(object):
+    '''
+    drop-in replacement of CameraSource without a physical camera,
+    replays a video file or a frame generator at the configured frame rate
+    '''
+
+    def __init__(self, path=None, generator=None, width=640, height=480, fps=25,
+                 jitter=0, drop_rate=0, loop=True, seed=None):
+        '''
+        :param path: video file to replay, None to use generator
+        :param generator: function(frame index, width, height) returning a BGR frame,
+                          moving spots if None
+        :param width: frame width of generated frames
+        :param height: frame height of generated frames
+        :param fps: frames delivered per second
+        :param jitter: standard deviation of extra delay of each frame in seconds
+        :param drop_rate: probability of each frame being dropped
+        :param loop: replay video file from start when finished
+        :param seed: seed of random jitter and drops, for reproducible runs
+        '''
+        self.path = path
+        self.generator = generator
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.loop = loop
+        self.seed = seed
+
+    def open(self):
+        return VirtualCapture(self.path, self.generator, self.width, self.height, self.fps,
+                              self.jitter, self.drop_rate, self.loop, self.seed)
+
+
+class CaptureThread(QThread):
+    '''
+    grab camera frames continuously into a small ring buffer,
+    so slow processing of one frame does not fill the driver buffer
+
+    consumers call read() in one of two modes:
+    'latest': return the newest frame, older unread frames are skipped, bounded latency
+    'every': return unread frames in order, frames are only lost if the ring buffer overflows
+    a recorder receives every grabbed frame regardless of the mode
+    '''
+
+    def __init__(self, source=None, buffer_size=4, mode='latest'):
+        '''
+        :param source: CameraSource or VirtualCameraSource, default camera if None
+        :param buffer_size: number of frames kept in ring buffer
+        :param mode: 'latest' or 'every'
+        '''
+        QThread.__init__(self)
+        self.mutex = QMutex()
+        self.frame_ready = QWaitCondition()
+        self.stopped = False
+        self.source = CameraSource() if source is None else source
+        self.mode = mode
+        self.cap = None
+        # VideoExportThread fed with every grabbed frame, None for no recording
+        self.recorder = None
+
+        # (frame number, capture time, wall time, frame)
+        self.ring = deque(maxlen=max(int(buffer_size), 1))
+        self.failed = False
+        # True until the source is opened, read() does not time out meanwhile
+        self.opening = False
+
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        # stamp of last frame returned by read()
+        self.frame_number = -1
+        self.capture_time = None
+        self.wall_time = None
+
+    def start(self, *args):
+        '''
+        reset state before the thread runs, so stop() and read() issued right after start()
+        see the new session instead of the previous one
+        '''
+        with QMutexLocker(self.mutex):
+            self.stopped = False
+            self.failed = False
+            self.opening = True
+            self.ring.clear()
+            self.frames_captured = 0
+            self.frames_dropped = 0
+            self.frame_number = -1
+            self.capture_time = None
+            self.wall_time = None
+        QThread.start(self, *args)
+
+    def run(self):
+        try:
+            if not self.stopped:
+                self.cap = self.source.open()
+        finally:
+            with QMutexLocker(self.mutex):
+                self.opening = False
+                if self.cap is None or not self.cap.isOpened():
+                    self.failed = True
+                self.frame_ready.wakeAll()
+
+        while not self.stopped and not self.failed:
+            with profiler.span('grab'):
+                ret, frame = self.cap.read()
+            capture_time = time.perf_counter()
+            wall_time = time.time()
+
+            with QMutexLocker(self.mutex):
+                if not ret:
+                    self.failed = True
+                    self.frame_ready.wakeAll()
+                    break
+                frame_number = self.frames_captured
+                self.ring.append((frame_number, capture_time, wall_time, frame))
+                self.frames_captured += 1
+                self.frame_ready.wakeAll()
+
+            # recording keeps frames skipped by 'latest' mode, camera_frame() never blocks
+            if self.recorder is not None:
+                self.recorder.camera_frame(frame, frame_number, capture_time, wall_time)
+
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    def stop(self):
+        with QMutexLocker(self.mutex):
+            self.stopped = True
+            self.ring.clear()
+            self.frame_ready.wakeAll()
+
+    def read(self, timeout=2000):
+        '''
+        wait for a frame not returned before
+        :param timeout: max waiting time in milliseconds after the camera is opened,
+                        opening a camera may take longer
+        :return: ret, frame like cv2.VideoCapture.read()
+        '''
+        with QMutexLocker(self.mutex):
+            while not self.has_unread():
+                if self.failed or self.stopped:
+                    return False, None
+                if not self.frame_ready.wait(self.mutex, timeout) and not self.opening:
+                    return False, None
+
+            if self.mode == 'latest':
+                entry = self.ring[-1]
+            else:
+                entry = next(entry for entry in self.ring if entry[0] > self.frame_number)
+
+            # frames captured but never returned
+            self.frames_dropped += entry[0] - self.frame_number - 1
+            self.frame_number, self.capture_time, self.wall_time, frame = entry
+
+        return True, frame
+
+    def has_unread(self):
+        return len(self.ring) > 0 and self.ring[-1][0] > self.frame_number
@@ -20,6 +20,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import os
+import queue
+from collections import deque
 import numpy as np
 import pandas as pd
 import cv2
@@ -28,7 +31,20 @@ from datetime import datetime, timedelta
 from PyQt5.QtGui import QImage, QPixmap
 from PyQt5.QtCore import Qt, pyqtSignal, QThread, QObject, QMutex, QMutexLocker
 from scipy.spatial import cKDTree
-from scipy.ndimage.filters import gaussian_filter
+from heatmap import HeatmapEngine
+from frame_index import FrameIndexWriter, sidecar_path
+from profiler import profiler
+
+# color of each subject trace, BGR
+TRACE_COLORS = [(86, 94, 219), (86, 194, 219), (86, 219, 145), (127, 219, 86),
+                (219, 211, 86), (219, 111, 86), (219, 86, 160), (178, 86, 219)]
+
+
+def trace_color(subject_id):
+    '''
+    the same subject has the same color in every trace map
+    '''
+    return TRACE_COLORS[(int(subject_id) - 1) % len(TRACE_COLORS)]
 
 
 class DataLogThread(QThread):
@@ -49,9 +65,11 @@ class DataLogThread(QThread):
         self.expired_id_list = None
         self.tracked_index = None
         self.tracked_elapse = None
+        # trace map and heatmap updated as data arrives
+        self.mapAccumulator = MapAccumulator()
 
     def run(self):
-        tic = time.perf_counter()
+        log_span = profiler.begin('log', 'logger')
         with QMutexLocker(self.mutex):
             self.stopped = False
         if self.stopped:
@@ -94,11 +112,30 @@ class DataLogThread(QThread):
                                             'NaN',
                                             'NaN'])
 
+            self.accumulate_maps()
+
             if len(self.df) >= 100:
                 self.df_archive.extend(self.df.copy())
                 del self.df[:]
 
-        toc = time.perf_counter()
+        profiler.end(log_span, frame=self.tracked_index)
+
+    def accumulate_maps(self):
+        '''
+        pass latest position of each subject to the map accumulator
+        '''
+        positions = []
+        for i in range(min(len(self.tracked_object), self.obj_num)):
+            if self.tracked_object[i].lost_sample is None:
+                continue
+            elif self.tracked_object[i].lost_sample:
+                positions.append((self.tracked_object[i].candidate_id, np.nan, np.nan))
+            else:
+                positions.append((self.tracked_object[i].candidate_id,
+                                  self.tracked_object[i].pos_prediction[0][0],
+                                  self.tracked_object[i].pos_prediction[1][0]))
+
+        self.mapAccumulator.update(self.tracked_index, positions)
 
     def track_results(self,tracked_object,expired_id_list,tracked_index,tracked_elapse):
         '''
@@ -134,13 +171,19 @@ class DataExportThread(QThread):
         self.pixel_per_metric = None
         self.data_save_path = None
         self.graph_save_path = None
+        # width of each time bin in seconds
+        self.bin_width = 1
+        # minimum velocity (mm/s) to count a sample as moving
+        self.moving_thresh = 0
+        # label image in frame coordinates, non-zero pixels belong to the zone
+        self.zone_mask = None
 
     def run(self):
         self.convert_data()
 
     def convert_data(self):
         # pay attention to dtype
-        tic = time.perf_counter()
+        convert_span = profiler.begin('convert_data', 'export')
         df = pd.DataFrame(np.array(self.dataLogThread.df_archive),
                                       columns=['Result(Frame)', 'Video elapse', 'Subject', 'pos_x', 'pos_y'])
 
@@ -168,55 +211,14 @@ class DataExportThread(QThread):
         # concatenate all sub-dataframes and maintain index order
         result = pd.concat(df_list, sort=False).sort_index()
 
-        # for 1 second binned dataframe
-        last_frame = result['Result(Frame)'].iloc[-1]
-        # if last time bin is less than 1 sec
-        if last_frame % self.video_fps != 0:
-            # create 1 sec binned dataframe
-            df_bin = result.copy().loc[result['Result(Frame)'] % self.video_fps == 0]
-            df_bin = df_bin.fillna(0)
-            df_bin.drop(columns=['Distance moved (mm)'], inplace=True)
-            # last frame from last less than 1sec time bin
-            df_last_bin = result.copy().loc[result['Result(Frame)'] == last_frame]
-            df_last_bin.drop(columns=['Distance moved (mm)'], inplace=True)
-
-            df_sec = df_bin.append(df_last_bin)
-
-            # # Splitting dataframe into multiple dataframes of each detected subject
-            # df_sec_list = [d for _, d in df_sec.groupby(['Subject'])]
-            # for i in df_sec_list:
-            #     i['Distance moved (mm)'] = i['Accumulate Distance moved (mm)'] - i['Accumulate Distance moved (mm)'].shift(1)
-            #     i['Distance moved (mm)'] = i['Distance moved (mm)'].astype(float)
-            #
-            # result_sec = pd.concat(df_sec_list, sort=False).sort_index()
-            # re-order columns
-            result_sec = df_sec[['Result(Frame)', 'Video elapse', 'Subject', 'pos_x', 'pos_y',
-                                     'Accumulate Distance moved (mm)']]
-        else:
-            # create 1 sec binned dataframe
-            df_bin = result.copy().loc[result['Result(Frame)'] % self.video_fps == 0]
-            df_bin = df_bin.fillna(0)
-            df_bin.drop(columns=['Distance moved (mm)'], inplace=True)
-
-            df_sec = df_bin
-
-            # # Splitting dataframe into multiple dataframes of each detected subject
-            # df_sec_list = [d for _, d in df_sec.groupby(['Subject'])]
-            # for i in df_sec_list:
-            #     i['Distance moved (mm)'] = i['Accumulate Distance moved (mm)'] - i[
-            #         'Accumulate Distance moved (mm)'].shift(1)
-            #     i['Distance moved (mm)'] = i['Distance moved (mm)'].astype(float)
-            #
-            # result_sec = pd.concat(df_sec_list, sort=False).sort_index()
-            # re-order columns
-
-            result_sec = df_sec[['Result(Frame)', 'Video elapse', 'Subject', 'pos_x', 'pos_y',
-                                     'Accumulate Distance moved (mm)']]
-
-        toc = time.perf_counter()
-        # print(f'Time Elapsed for data converting {toc - tic:.5f}')
-        self.save_data(result,result_sec)
+        # aggregate each subject into time bins of the selected width
+        dataBinning = DataBinning(self.bin_width, self.video_fps, self.moving_thresh, self.zone_mask)
+        result_bin = dataBinning.bin_data(result)
+
+        profiler.end(convert_span, rows=len(result))
+        self.save_data(result,result_bin)
 
+    @profiler.traced(category='export')
     def save_data(self,df_raw, df_bin):
         now = datetime.now()
         full_path = self.data_save_path + '/TrackingBot export ' + now.strftime('%Y-%m-%d-%H%M') + '.xlsx'
@@ -229,6 +231,91 @@ class DataExportThread(QThread):
         self.timesignal.data_process_fin.emit('1')
 
 
+class DataBinning(object):
+    '''
+    Aggregate tracking results of each subject into time bins of arbitrary width
+    e.g. 0.1 s, 1 s, 60 s or any custom value
+    '''
+
+    def __init__(self, bin_width=1, video_fps=25, moving_thresh=0, zone_mask=None):
+        '''
+        :param bin_width: width of each time bin in seconds
+        :param video_fps: frame rate of the tracked video, can be non-integer
+        :param moving_thresh: minimum velocity (mm/s) for a sample to count as moving
+        :param zone_mask: label image in frame coordinates, non-zero pixels are inside the zone
+        '''
+        self.bin_width = bin_width
+        self.video_fps = video_fps
+        self.moving_thresh = moving_thresh
+        self.zone_mask = zone_mask
+
+    def bin_index(self, frame_index):
+        '''
+        map frame index to time bin index
+        time of frame n is n/fps, so bins stay correct for non-integer fps
+        '''
+        frames_per_bin = self.video_fps * self.bin_width
+        # small epsilon absorbs float error exactly at the bin edges
+        return np.floor(np.asarray(frame_index, dtype=float) / frames_per_bin + 1e-9).astype(int)
+
+    def in_zone(self, pos_x, pos_y):
+        '''
+        look up zone membership of every sample in the zone mask at once
+        lost samples (NaN) are never in the zone
+        '''
+        pos_x = np.asarray(pos_x, dtype=float)
+        pos_y = np.asarray(pos_y, dtype=float)
+        inside = np.zeros(len(pos_x), dtype=bool)
+        if self.zone_mask is None:
+            return inside
+
+        height, width = self.zone_mask.shape[:2]
+        valid = ~(np.isnan(pos_x) | np.isnan(pos_y))
+        col = np.clip(pos_x[valid].astype(int), 0, width - 1)
+        row = np.clip(pos_y[valid].astype(int), 0, height - 1)
+        inside[valid] = self.zone_mask[row, col] > 0
+        return inside
+
+    def bin_data(self, result):
+        '''
+        reduce per frame results to per bin summary of each subject in a single groupby
+        :param result: dataframe of per frame results with distance and velocity columns
+        :return: dataframe with one row per subject and time bin
+        '''
+        frame_time = 1 / self.video_fps
+        velocity = result['Velocity (mm/s)'].to_numpy(dtype=float)
+
+        df = pd.DataFrame({'Subject': result['Subject'].to_numpy(),
+                           'Time bin': self.bin_index(result['Result(Frame)']),
+                           'distance': result['Distance moved (mm)'].to_numpy(dtype=float),
+                           'accumulate': result['Accumulate Distance moved (mm)'].to_numpy(dtype=float),
+                           'velocity': velocity,
+                           # NaN compares False, so lost samples are never moving
+                           'moving': (velocity > self.moving_thresh) * frame_time,
+                           'zone': self.in_zone(result['pos_x'], result['pos_y']) * frame_time})
+
+        df_bin = df.groupby(['Subject', 'Time bin'], sort=True).agg(
+            distance=('distance', 'sum'),
+            accumulate=('accumulate', 'max'),
+            velocity=('velocity', 'mean'),
+            moving=('moving', 'sum'),
+            zone=('zone', 'sum')).reset_index()
+
+        df_bin['Bin start (s)'] = np.round(df_bin['Time bin'] * self.bin_width, 6)
+        df_bin['Bin end (s)'] = np.round((df_bin['Time bin'] + 1) * self.bin_width, 6)
+        df_bin = df_bin.rename(columns={'distance': 'Distance moved (mm)',
+                                        'accumulate': 'Accumulate Distance moved (mm)',
+                                        'velocity': 'Mean velocity (mm/s)',
+                                        'moving': 'Time moving (s)',
+                                        'zone': 'Time in zone (s)'})
+        # order by time first so subjects of the same bin stay together, same as raw data
+        df_bin = df_bin.sort_values(['Time bin', 'Subject'], kind='stable')
+
+        return df_bin[['Time bin', 'Bin start (s)', 'Bin end (s)', 'Subject',
+                       'Distance moved (mm)', 'Accumulate Distance moved (mm)', 'Mean velocity (mm/s)',
+                       'Time moving (s)', 'Time in zone (s)']]
+
+
 class CamDataExportThread(QThread):
 
     def __init__(self):
@@ -242,6 +329,7 @@ class CamDataExportThread(QThread):
     def run(self):
         self.convert_data()
 
+    @profiler.traced(category='export')
     def convert_data(self):
         # pay attention to dtype!!!
         # otherwise can not perform calculation betwteen different datatype
@@ -275,6 +363,7 @@ class CamDataExportThread(QThread):
 
         self.save_data(result)
 
+    @profiler.traced(category='export')
     def save_data(self,df_raw):
         now = datetime.now()
         full_path = self.data_save_path + '/TrackingBot export ' + now.strftime('%Y-%m-%d-%H%M') + '.xlsx'
@@ -294,13 +383,25 @@ class TraceExportThread(QThread):
         self.dataLogThread = None
         self.trace_frame = None
         self.video_prop = None
-        self.trace_colors = [[86, 94, 219], [86, 194, 219], [86, 219, 145], [127, 219, 86],
-                 [219, 211, 86], [219, 111, 86], [219, 86, 160], [178, 86, 219]]
+        self.traceRenderer = TraceRenderer()
+        self.mapAccumulator = None
+        # length of time window in seconds, None for full session
+        self.window = None
 
     def run(self):
         self.generate_trace()
 
+    @profiler.traced(category='export')
     def generate_trace(self):
+        # traces accumulated during tracking are available instantly
+        # full session traces are drawn on the canvas even after old positions were dropped
+        if self.mapAccumulator is not None and self.mapAccumulator.sample_count() and \
+                (self.window is None or self.mapAccumulator.covers(self.window)):
+            trace_map = self.mapAccumulator.trace_map(self.trace_frame, self.window)
+            self.convert_trace(trace_map)
+            self.timesignal.trace_map_raw.emit(trace_map)
+            return
+
         trace_map = self.trace_frame.copy()
         df = pd.DataFrame(np.array(self.dataLogThread.df_archive),
                           columns=['Result(Frame)', 'Video elapse', 'Subject', 'pos_x', 'pos_y'])
@@ -308,33 +409,19 @@ class TraceExportThread(QThread):
         # convert data type for each parameter
         df['Result(Frame)'] = df['Result(Frame)'].astype(int)
         df['Video elapse'] = df['Video elapse'].astype(str)
-        df['Subject'] = 'Subject ' + df['Subject'].astype(str)
+        df['Subject'] = df['Subject'].astype(int)
         df['pos_x'] = df['pos_x'].astype(float)
         df['pos_y'] = df['pos_y'].astype(float)
 
-        # Splitting dataframe into multiple dataframes of each detected subject
-        df_list = [d for _, d in df.groupby(['Subject'])]
+        if self.window is not None and len(df):
+            df = df[df['Result(Frame)'] > df['Result(Frame)'].max() - self.window * self.video_prop.fps]
 
-        for i in range(len(df_list)):
-            df_list[i] = df_list[i][['pos_x','pos_y']].copy()
-            df_list[i]['coord'] = df_list[i].values.tolist()
-            # list of [xn,yn] for each individual object
-            coord_list = df_list[i]['coord'].tolist()
-            # coord_1min = coord[:1800] # for part trace
-            for j in range(len(coord_list) - 1): # number of elements = range -1
-
-                x = coord_list[j][0]
-                y = coord_list[j][1]
-                x1 = coord_list[j+1][0]
-                y1 = coord_list[j+1][1]
-
-                if pd.isnull(x) or pd.isnull(y) or pd.isnull(x1) or pd.isnull(y1):
-                    pass
-                else:
-                    cv2.line(trace_map, (int(x), int(y)), (int(x1), int(y1)),
-                             (self.trace_colors[i % len(df_list) % 8][0],
-                              self.trace_colors[i % len(df_list) % 8][1],
-                              self.trace_colors[i % len(df_list) % 8][2]), 1)
+        # Splitting dataframe into multiple dataframes of each detected subject
+        for subject_id, df_subject in df.groupby('Subject'):
+            self.traceRenderer.draw(trace_map,
+                                    df_subject['pos_x'].to_numpy(),
+                                    df_subject['pos_y'].to_numpy(),
+                                    trace_color(subject_id))
 
         self.convert_trace(trace_map)
         self.timesignal.trace_map_raw.emit(trace_map)
@@ -357,6 +444,226 @@ class TraceExportThread(QThread):
         self.timesignal.trace_map.emit(trace_map_display) # TraceProcessDialog.display
 
 
+class TraceRenderer(object):
+    '''
+    draw trajectories with array operations instead of one cv2.line per pair of points
+    '''
+
+    def split_runs(self, pos_x, pos_y):
+        '''
+        split a trajectory into continuous runs at lost samples (NaN)
+        :param pos_x: array of x coordinates, NaN when sample lost
+        :param pos_y: array of y coordinates, NaN when sample lost
+        :return: list of (n,2) int32 arrays, each with at least 2 points
+        '''
+        pos = np.column_stack((np.asarray(pos_x, dtype=float), np.asarray(pos_y, dtype=float)))
+        valid = ~np.isnan(pos).any(axis=1)
+
+        # truncate to pixel like int() so the map is identical to the line by line version
+        points = np.zeros(pos.shape, dtype=np.int32)
+        points[valid] = pos[valid].astype(np.int32)
+
+        # rising and falling edges of the valid flag mark start and end of each run
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], valid.astype(np.int8), [0]))))
+        starts = edges[::2]
+        ends = edges[1::2]
+
+        return [points[start:end] for start, end in zip(starts, ends) if end - start > 1]
+
+    def draw(self, canvas, pos_x, pos_y, color, thickness=1):
+        '''
+        draw all continuous runs of one trajectory on canvas with a single cv2.polylines call
+        '''
+        runs = self.split_runs(pos_x, pos_y)
+        if runs:
+            cv2.polylines(canvas, runs, False, color, thickness)
+        return canvas
+
+
+class MapAccumulator(object):
+    '''
+    Accumulate trace canvas and occupancy histogram frame by frame during tracking
+    and keep recent positions, so trace map and heatmap of the full session or of a sliding time window
+    can be queried at any time without re-scanning df_archive.
+    positions older than max_window seconds are dropped, window queries they would be needed for
+    fall back to df_archive, full session queries are served by the canvas and the histograms
+    '''
+
+    def __init__(self, max_window=3600):
+        self.mutex = QMutex()
+        self.traceRenderer = TraceRenderer()
+
+        self.width = 0
+        self.height = 0
+        self.fps = 25
+        self.max_window = max_window
+        self.trace_canvas = None  # full session traces on black background
+        self.trace_mask = None  # pixels drawn on trace canvas
+        self.last_pos = {}  # last valid position of each subject id
+
+        # full session occupancy of each subject id on a grid of bin_size pixels
+        self.bin_size = 4
+        self.cols = 0
+        self.rows = 0
+        self.histograms = {}
+
+        # position log for time window queries
+        # columns: frame index, subject id, x, y
+        self.log = np.zeros((0, 4), dtype=np.float32)
+        self.log_len = 0
+        # False once old positions have been dropped from the log
+        self.complete = True
+
+    def reset(self, width, height, fps, bin_size=4):
+        '''
+        clear all accumulated data and prepare canvas for a new session
+        :param width: frame width of the tracked source
+        :param height: frame height of the tracked source
+        :param fps: frame rate, used to convert window length in seconds to frames
+        :param bin_size: grid cell size in pixels of the occupancy histograms, same as HeatmapEngine
+        '''
+        with QMutexLocker(self.mutex):
+            self.width = int(width)
+            self.height = int(height)
+            self.fps = fps
+            self.trace_canvas = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+            self.trace_mask = np.zeros((self.height, self.width), dtype=np.uint8)
+            self.last_pos = {}
+            self.bin_size = max(int(bin_size), 1)
+            self.cols = -(-self.width // self.bin_size)  # ceil division
+            self.rows = -(-self.height // self.bin_size)
+            self.histograms = {}
+            self.log = np.zeros((4096, 4), dtype=np.float32)
+            self.log_len = 0
+            self.complete = True
+
+    def update(self, frame_index, positions):
+        '''
+        add latest positions of all subjects
+        :param frame_index: index of current frame
+        :param positions: list of (subject id, x, y), x and y are NaN if sample lost
+        '''
+        if self.trace_canvas is None or not positions:
+            return
+
+        with QMutexLocker(self.mutex):
+            if self.log_len + len(positions) > len(self.log):
+                self.make_room(frame_index, len(positions))
+
+            for subject_id, x, y in positions:
+                self.log[self.log_len] = (frame_index, subject_id, x, y)
+                self.log_len += 1
+
+                if np.isnan(x) or np.isnan(y):
+                    # break the trace at lost samples
+                    self.last_pos.pop(subject_id, None)
+                    continue
+
+                # same binning as HeatmapEngine.histogram
+                if subject_id not in self.histograms:
+                    self.histograms[subject_id] = np.zeros((self.rows, self.cols), dtype=np.int32)
+                col = min(max(int(x) // self.bin_size, 0), self.cols - 1)
+                row = min(max(int(y) // self.bin_size, 0), self.rows - 1)
+                self.histograms[subject_id][row, col] += 1
+
+                if subject_id in self.last_pos:
+                    cv2.line(self.trace_canvas, self.last_pos[subject_id], (int(x), int(y)),
+                             trace_color(subject_id), 1)
+                    cv2.line(self.trace_mask, self.last_pos[subject_id], (int(x), int(y)), 255, 1)
+                self.last_pos[subject_id] = (int(x), int(y))
+
+    def make_room(self, frame_index, count):
+        '''
+        drop positions older than max_window seconds, grow log by doubling if that is not enough,
+        so appending stays amortized O(1) and memory is bounded by the window
+        '''
+        first_index = frame_index - self.max_window * self.fps
+        start = np.searchsorted(self.log[:self.log_len, 0], first_index, side='right')
+        if start:
+            self.log[:self.log_len - start] = self.log[start:self.log_len]
+            self.log_len -= start
+            self.complete = False
+        if self.log_len + count > len(self.log) // 2:
+            self.log = np.concatenate((self.log, np.zeros_like(self.log)))
+
+    def sample_count(self):
+        with QMutexLocker(self.mutex):
+            return self.log_len
+
+    def covers(self, window=None):
+        '''
+        :param window: window length in seconds, None for full session
+        :return: True if the log holds every position needed for the window
+        '''
+        with QMutexLocker(self.mutex):
+            if not self.log_len:
+                return False
+            if window is None:
+                return self.complete
+            return self.complete or window <= self.max_window
+
+    def subject_ids(self):
+        '''
+        ids of all subjects with at least one valid position in this session
+        '''
+        with QMutexLocker(self.mutex):
+            return sorted(self.histograms)
+
+    def histogram(self, subject=None):
+        '''
+        full session occupancy, same grid as HeatmapEngine.histogram with bin_size of this session
+        :param subject: subject id, None for all subjects
+        :return: (rows, cols) float32 array, row = y
+        '''
+        with QMutexLocker(self.mutex):
+            hist = np.zeros((self.rows, self.cols), dtype=np.float32)
+            for subject_id, counts in self.histograms.items():
+                if subject is None or subject_id == subject:
+                    hist += counts
+            return hist
+
+    def positions(self, window=None):
+        '''
+        copy of the position log, columns: frame index, subject id, x, y
+        :param window: window length in seconds, None for full session
+        '''
+        with QMutexLocker(self.mutex):
+            return self.window_log(window).copy()
+
+    def window_log(self, window=None):
+        '''
+        positions logged within the last window seconds
+        :param window: window length in seconds, None for full session
+        '''
+        log = self.log[:self.log_len]
+        if window is None or not len(log):
+            return log
+        first_index = log[-1, 0] - window * self.fps
+        # log is ordered by frame index, so the window is a slice
+        start = np.searchsorted(log[:, 0], first_index, side='right')
+        return log[start:]
+
+    def trace_map(self, background, window=None):
+        '''
+        trace map drawn over background frame
+        :param background: BGR frame with same size as tracked source
+        :param window: window length in seconds, None for full session
+        '''
+        trace_map = background.copy()
+        with QMutexLocker(self.mutex):
+            if window is None:
+                drawn = self.trace_mask > 0
+                trace_map[drawn] = self.trace_canvas[drawn]
+                return trace_map
+
+            log = self.window_log(window)
+            for subject_id in np.unique(log[:, 1]):
+                subject_log = log[log[:, 1] == subject_id]
+                self.traceRenderer.draw(trace_map, subject_log[:, 2], subject_log[:, 3],
+                                        trace_color(subject_id))
+            return trace_map
+
+
 class GraphExportThread(QThread):
 
     def __init__(self):
@@ -367,70 +674,283 @@ class GraphExportThread(QThread):
         self.video_prop = None
         self.neighbours = 16
         self.resolution = 500
+        # blur in pixels and heatmap grid cell size in pixels
         self.sigma = 6
+        self.bin_size = 4
         self.data_save_path = None
         self.graph_save_path = None
+        self.mapAccumulator = None
+        # length of time window in seconds, None for full session
+        self.window = None
+        # subject id of single subject heatmap, None for all subjects
+        self.subject = None
+        # 'histogram' or 'knn'
+        self.density_mode = 'histogram'
+        # grid points queried at once in knn mode
+        self.chunk_size = 65536
+        # knn tree of current session, rebuilt only when samples change
+        self.tree = None
+        self.tree_weights = None
+        self.tree_key = None
 
     def run(self):
         self.generate_plot()
 
+    @profiler.traced(category='export')
     def generate_plot(self):
-        df = pd.DataFrame(np.array(self.dataLogThread.df_archive),
-                          columns=['Result(Frame)', 'Video elapse', 'Subject', 'pos_x', 'pos_y'])
-        df_x = df['pos_x'].astype(float)
-        df_y = df['pos_y'].astype(float)
+        heatmapEngine = HeatmapEngine(self.video_prop.width, self.video_prop.height, self.bin_size, self.sigma)
+
+        # full session histogram accumulated during tracking is complete even after old positions were dropped
+        if self.density_mode == 'histogram' and self.window is None and self.mapAccumulator is not None \
+                and self.mapAccumulator.sample_count() and self.mapAccumulator.bin_size == heatmapEngine.bin_size:
+            heat_map = heatmapEngine.blur(self.mapAccumulator.histogram(self.subject))
+            self.emit_plot(heatmapEngine.colorize(heat_map))
+            return
+
+        frame_index, subject_ids, pos_x, pos_y = self.read_positions()
 
-        heat_map, _, _ = np.histogram2d(df_x, df_y, bins=[np.arange(0, self.video_prop.width, 1),
-                                                           np.arange(0, self.video_prop.height, 1)])
-        # extent = [xedges[0], xedges[-1], yedges[0], yedges[-1]]
-        heat_map = gaussian_filter(heat_map, sigma=self.sigma)
-        heat_map = heat_map.T
+        # single subject map if selected
+        if self.subject is not None:
+            selected = subject_ids == self.subject
+            pos_x = pos_x[selected]
+            pos_y = pos_y[selected]
+
+        if self.density_mode == 'knn':
+            heat_map = self.kNN2DDens(pos_x, pos_y, self.resolution, self.neighbours)
+        else:
+            heat_map = heatmapEngine.heat_map(pos_x, pos_y)
+        # color mapped BGR image in frame size, ready for display and export
+        self.emit_plot(heatmapEngine.colorize(heat_map))
 
+    def emit_plot(self, heat_map):
         self.timesignal.graph_process_fin.emit('1')  # GraphProcessDialog.setFinish
         self.timesignal.heat_map.emit(heat_map)  # GraphProcessDialog.display
 
+    def read_positions(self):
+        '''
+        read frame index, subject id and position of all samples in the selected time window
+        :return: tuple of 4 arrays
+        '''
+        # positions accumulated during tracking are available instantly
+        if self.mapAccumulator is not None and self.mapAccumulator.covers(self.window):
+            log = self.mapAccumulator.positions(self.window)
+            return log[:, 0], log[:, 1], log[:, 2], log[:, 3]
+
+        df = pd.DataFrame(np.array(self.dataLogThread.df_archive),
+                          columns=['Result(Frame)', 'Video elapse', 'Subject', 'pos_x', 'pos_y'])
+        frame_index = df['Result(Frame)'].astype(int).to_numpy()
+        subject_ids = df['Subject'].astype(float).to_numpy()
+        pos_x = df['pos_x'].astype(float).to_numpy()
+        pos_y = df['pos_y'].astype(float).to_numpy()
+
+        if self.window is not None and len(frame_index):
+            selected = frame_index > frame_index.max() - self.window * self.video_prop.fps
+            return frame_index[selected], subject_ids[selected], pos_x[selected], pos_y[selected]
+
+        return frame_index, subject_ids, pos_x, pos_y
+
     def data_coord2view_coord(self, pos,resolution, pos_min, pos_max):
         dp = pos_max - pos_min
         dv = (pos - pos_min) / dp * resolution
         return dv
 
-    def kNN2DDens(self,xv, yv, resolution, neighbours, dim=2):
-        # Create the tree
-        tree = cKDTree(np.array([xv, yv]).T)
-        # Find the closest nnmax-1 neighbors (first entry is the point itself)
-        grid = np.mgrid[0:resolution, 0:resolution].T.reshape(resolution ** 2, dim)
-        dists = tree.query(grid, neighbours)
-        # Inverse of the sum of distances to each grid point.
-        inv_sum_dists = 1. / dists[0].sum(1)
+    def kNN2DDens(self, xv, yv, resolution, neighbours, dim=2):
+        '''
+        k nearest neighbour density on a grid of resolution columns,
+        rows follow the aspect ratio of video frame
+        density of each grid point = samples within k nearest neighbours / area of circle
+        :param xv: x position of samples in pixels
+        :param yv: y position of samples in pixels
+        :return: (rows, resolution) float32 array, row = y
+        '''
+        tree, weights = self.density_tree(xv, yv)
+        if tree is None:
+            return np.zeros((1, 1), dtype=np.float32)
+
+        width = self.video_prop.width
+        height = self.video_prop.height
+        cols = max(int(resolution), 1)
+        rows = max(int(round(cols * height / width)), 1)
+        # sample the center of each grid cell in pixel coordinates
+        grid_x = (np.arange(cols) + 0.5) * width / cols
+        grid_y = (np.arange(rows) + 0.5) * height / rows
+        grid = np.stack(np.meshgrid(grid_x, grid_y), axis=-1).reshape(-1, dim)
+
+        k = min(int(neighbours), tree.n)
+        # avoid zero area when a grid point falls on a sample
+        min_radius = 0.5 * self.bin_size
+        density = np.empty(len(grid), dtype=np.float32)
+        # query in chunks to bound memory, each chunk uses all cores
+        for start in range(0, len(grid), self.chunk_size):
+            dists, index = tree.query(grid[start:start + self.chunk_size], k, workers=-1)
+            dists = dists.reshape(len(dists), -1)
+            index = index.reshape(len(index), -1)
+            radius = np.maximum(dists[:, -1], min_radius)
+            density[start:start + len(dists)] = weights[index].sum(1) / (np.pi * radius ** 2)
+
+        return density.reshape(rows, cols)
+
+    def density_tree(self, xv, yv):
+        '''
+        merge samples in the same heatmap grid cell into one weighted point and build the tree,
+        tree is reused until the samples change so resolution and neighbours can be adjusted freely
+        :return: cKDTree of occupied cells and number of samples in each cell
+        '''
+        xv = np.asarray(xv, dtype=float)
+        yv = np.asarray(yv, dtype=float)
+        valid = ~(np.isnan(xv) | np.isnan(yv))
+        xv = xv[valid]
+        yv = yv[valid]
+
+        key = (self.bin_size, len(xv), float(xv.sum()), float(yv.sum()))
+        if key == self.tree_key:
+            return self.tree, self.tree_weights
+
+        if len(xv):
+            cells = np.stack([xv.astype(np.int64) // self.bin_size,
+                              yv.astype(np.int64) // self.bin_size], axis=1)
+            cells, counts = np.unique(cells, axis=0, return_counts=True)
+            self.tree = cKDTree((cells + 0.5) * self.bin_size)
+            self.tree_weights = counts.astype(np.float32)
+        else:
+            self.tree = None
+            self.tree_weights = None
+        self.tree_key = key
 
-        # Reshape
-        im = inv_sum_dists.reshape(resolution, resolution)
-        return im
+        return self.tree, self.tree_weights
 
 
 class VideoExportThread(QThread):
     '''
     This class is used to store and export live tracking video
+    frames are passed through a bounded queue and encoded in background,
+    so encoding time does not block the capture and tracking loop
+    capture time of every frame is stored in a frame index next to the video
     '''
 
     def __init__(self):
         QThread.__init__(self)
         self.mutex = QMutex()
+        self.timesignal = Communicate()
         self.stopped = False
         self.cam_prop = None
         self.cam_frame = None # frame to be write
-        self.codec = 'H264'
+        self.fps = 25
+        self.codec = 'mp4v'
+        self.container = 'mp4'
+        self.output_dir = self.default_output_dir()
+        self.file_path = None
+
+        # frames waiting to be encoded
+        self.queue_size = 64
+        self.frame_queue = queue.Queue(maxsize=self.queue_size)
+        # when queue is full, 'oldest' discards the oldest queued frame, 'newest' discards the incoming frame
+        self.drop_policy = 'oldest'
+        self.frames_written = 0
+        self.frames_dropped = 0
+        # (frame number, monotonic, wall) of dropped frames, recorded in frame index by writer
+        self.dropped_stamps = deque()
+        self.frame_number = -1
+        # True when the video file could not be created, incoming frames are ignored
+        self.failed = False
 
     def run(self):
         with QMutexLocker(self.mutex):
             self.stopped = False
 
+        now = datetime.now()
+        self.file_path = os.path.join(self.output_dir, 'TrackingBot recording '
+                                      + now.strftime('%Y-%m-%d-%H%M') + '.' + self.container)
+        fourcc = cv2.VideoWriter_fourcc(*self.codec)
+        frame_size = (int(self.cam_prop.width), int(self.cam_prop.height))
+        export = cv2.VideoWriter(self.file_path, fourcc, self.fps, frame_size, True)
+        if not export.isOpened():
+            # unsupported codec/container or folder not writable, no frame index without a video
+            self.failed = True
+            error = f'cv2.VideoWriter failed to open {self.file_path} with codec {self.codec}'
+            self.file_path = None
+            self.timesignal.record_failed.emit(error)
+            return
+        frameIndex = FrameIndexWriter(sidecar_path(self.file_path))
+
+        while True:
+            try:
+                frame, stamp = self.frame_queue.get(timeout=0.1)
+            except queue.Empty:
+                # write remaining frames before exit
+                if self.stopped:
+                    break
+                continue
+            self.write_dropped(frameIndex, stamp[0])
+            with profiler.span('encode', 'recorder', queued=self.frame_queue.qsize()):
+                export.write(frame)
+            frameIndex.write(*stamp)
+            self.frames_written += 1
+
+        self.write_dropped(frameIndex)
+        frameIndex.close()
+        export.release()
+
     def stop(self):
         with QMutexLocker(self.mutex):
             self.stopped = True
 
-    def camera_frame(self, cam_frame):
+    def reset(self):
+        '''
+        clear queue and counters before a new recording
+        '''
+        self.frame_queue = queue.Queue(maxsize=self.queue_size)
+        self.dropped_stamps.clear()
+        self.frame_number = -1
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.failed = False
+
+    def camera_frame(self, cam_frame, frame_number=None, capture_time=None, wall_time=None):
+        '''
+        queue a frame for encoding without blocking the caller
+        :param frame_number: index of captured frame, count from 0 if not given
+        :param capture_time: time.perf_counter() when the frame was captured
+        :param wall_time: time.time() when the frame was captured
+        '''
+        if self.failed:
+            return
         self.cam_frame = cam_frame
+        self.frame_number = self.frame_number + 1 if frame_number is None else frame_number
+        stamp = (self.frame_number,
+                 time.perf_counter() if capture_time is None else capture_time,
+                 time.time() if wall_time is None else wall_time)
+        try:
+            self.frame_queue.put_nowait((cam_frame, stamp))
+        except queue.Full:
+            self.frames_dropped += 1
+            if self.drop_policy == 'oldest':
+                try:
+                    self.dropped_stamps.append(self.frame_queue.get_nowait()[1])
+                except queue.Empty:
+                    pass
+                try:
+                    self.frame_queue.put_nowait((cam_frame, stamp))
+                except queue.Full:
+                    self.dropped_stamps.append(stamp)
+            else:
+                self.dropped_stamps.append(stamp)
+
+    def write_dropped(self, frameIndex, before=None):
+        '''
+        record dropped frames captured before the given frame number, all if None
+        '''
+        while self.dropped_stamps and (before is None or self.dropped_stamps[0][0] < before):
+            frameIndex.write(*self.dropped_stamps.popleft(), dropped=True)
+
+    def default_output_dir(self):
+        '''
+        public video folder on Windows, otherwise video folder or home folder of current user
+        '''
+        for folder in ['C:/Users/Public/Videos', os.path.expanduser('~/Videos')]:
+            if os.path.isdir(folder):
+                return folder
+        return os.path.expanduser('~')
 
 
 class Communicate(QObject):
@@ -441,6 +961,7 @@ class Communicate(QObject):
     trace_map_raw = pyqtSignal(object)
     graph_process_fin = pyqtSignal(int)
     heat_map = pyqtSignal(object)
+    record_failed = pyqtSignal(str)
 
 
 class ExpiredCandidate(object):
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import struct
+import hashlib
+import numpy as np
+
+# file header: magic, format version, size of each record in bytes
+HEADER = struct.Struct('<4sHH')
+MAGIC = b'TBDC'
+VERSION = 1
+# one record per frame: first detection, number of detections, video position (ms) used as elapse
+FRAME_DTYPE = np.dtype([('first', '<i8'), ('count', '<i4'), ('elapse', '<f8')])
+# one record per detected contour: centroid and contour area
+DETECTION_DTYPE = np.dtype([('x', '<f8'), ('y', '<f8'), ('area', '<f8')])
+# bytes hashed at start and end of video
+SAMPLE_SIZE = 16 * 1024 * 1024
+# disk space of detection caches, seek indexes and proxies, least recently used entries are removed beyond it
+DISK_BUDGET = 8 * 1024 * 1024 * 1024
+# temporary files modified within this many seconds belong to a running task
+PART_TIMEOUT = 3600
+
+
+def default_cache_dir():
+    '''
+    public documents folder on Windows, otherwise cache folder of current user
+    '''
+    for folder in ['C:/Users/Public/Documents']:
+        if os.path.isdir(folder):
+            return os.path.join(folder, 'TrackingBot cache')
+    return os.path.join(os.path.expanduser('~'), '.cache', 'trackingbot')
+
+
+def cache_entries(cache_dir):
+    '''
+    files of the cache folder grouped by entry, all files of a detection cache key
+    or of a video (seek index and proxy) share the name before the first dot
+    :return: dict of entry name: (last use time, size in bytes, list of paths, True if still being written)
+    '''
+    entries = {}
+    if not os.path.isdir(cache_dir):
+        return entries
+    now = time.time()
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            if not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+        except OSError:
+            continue
+        used, size, paths, busy = entries.get(name.split('.', 1)[0], (0, 0, [], False))
+        busy = busy or name.endswith('.part') and now - stat.st_mtime < PART_TIMEOUT
+        entries[name.split('.', 1)[0]] = (max(used, stat.st_mtime), size + stat.st_size, paths + [path], busy)
+    return entries
+
+
+def touch_entry(path):
+    '''
+    mark a cache file as used, entries are removed least recently used first
+    '''
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def remove_entry(paths):
+    '''
+    :return: bytes removed
+    '''
+    removed = 0
+    for path in paths:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            removed += size
+        except OSError:
+            # e.g. file still opened by a player on Windows, removed next time
+            pass
+    return removed
+
+
+def trim_cache(cache_dir, budget=DISK_BUDGET, keep=()):
+    '''
+    remove least recently used entries until the cache folder fits the budget,
+    entries still being written are never removed
+    :param keep: entry names not removed, e.g. the entry just written
+    :return: bytes removed
+    '''
+    entries = cache_entries(cache_dir)
+    excess = sum(size for _, size, _, _ in entries.values()) - budget
+    removed = 0
+    for entry, (_, _, paths, busy) in sorted(entries.items(), key=lambda item: item[1][0]):
+        if removed >= excess:
+            break
+        if not busy and entry not in keep:
+            removed += remove_entry(paths)
+    return removed
+
+
+def clear_cache(cache_dir):
+    '''
+    remove all entries except those still being written
+    :return: bytes removed
+    '''
+    return sum(remove_entry(paths) for _, _, paths, busy in cache_entries(cache_dir).values() if not busy)
+
+
+def video_hash(video_path):
+    '''
+    hash of file size, first and last bytes of the video,
+    identifies the video without reading a whole recording
+    '''
+    digest = hashlib.sha1()
+    size = os.path.getsize(video_path)
+    digest.update(str(size).encode())
+    with open(video_path, 'rb') as f:
+        digest.update(f.read(SAMPLE_SIZE))
+        if size > SAMPLE_SIZE:
+            f.seek(max(size - SAMPLE_SIZE, SAMPLE_SIZE))
+            digest.update(f.read(SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def cache_key(video_path, block_size, offset, min_contour, max_contour, invert_contrast=False, valid_mask=None):
+    '''
+    detections are only reused for the same video, ROI/mask and threshold settings
+    :param valid_mask: mask applied before thresholding, None if no ROI or mask
+    :return: key and the settings it was built from
+    '''
+    params = {'video': video_hash(video_path),
+              'block_size': int(block_size),
+              'offset': int(offset),
+              'min_contour': float(min_contour),
+              'max_contour': float(max_contour),
+              'invert_contrast': bool(invert_contrast),
+              'mask': None if valid_mask is None else hashlib.sha1(
+                  np.ascontiguousarray(valid_mask).tobytes() + str(valid_mask.shape).encode()).hexdigest()}
+    key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    return key, params
+
+
+def cache_paths(cache_dir, key):
+    '''
+    :return: paths of frame table, detection table and settings
+    '''
+    base = os.path.join(cache_dir, key)
+    return base + '.frm', base + '.det', base + '.json'
+
+
+class DetectionCacheWriter(object):
+    '''
+    store detections of each frame while a video is tracked
+    files are written under temporary names and only become a cache entry when closed,
+    so a cancelled tracking task never leaves an incomplete cache
+    '''
+
+    def __init__(self, cache_dir, key, params):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.key = key
+        self.paths = cache_paths(cache_dir, key)
+        self.params = params
+        self.frame_file = open(self.paths[0] + '.part', 'wb')
+        self.detection_file = open(self.paths[1] + '.part', 'wb')
+        for f, dtype in ((self.frame_file, FRAME_DTYPE), (self.detection_file, DETECTION_DTYPE)):
+            f.write(HEADER.pack(MAGIC, VERSION, dtype.itemsize))
+        self.frame_count = 0
+        self.detection_count = 0
+
+    def write(self, elapse, entrants):
+        '''
+        :param elapse: video position in milliseconds passed to TrackingTimeStamp
+        :param entrants: list of EntrantProperty returned by Detection.detect_contours()
+        '''
+        detections = np.empty(len(entrants), dtype=DETECTION_DTYPE)
+        for i, entrant in enumerate(entrants):
+            detections[i] = (entrant.pos_detected[0][0], entrant.pos_detected[1][0], entrant.cnt_area)
+        frame = np.array([(self.detection_count, len(entrants), elapse)], dtype=FRAME_DTYPE)
+        self.detection_file.write(detections.tobytes())
+        self.frame_file.write(frame.tobytes())
+        self.detection_count += len(entrants)
+        self.frame_count += 1
+
+    def close(self):
+        '''
+        complete the cache entry
+        '''
+        self.frame_file.close()
+        self.detection_file.close()
+        os.replace(self.paths[0] + '.part', self.paths[0])
+        os.replace(self.paths[1] + '.part', self.paths[1])
+        # settings are written last and mark the entry as complete
+        with open(self.paths[2], 'w') as f:
+            json.dump(dict(self.params, frames=self.frame_count, detections=self.detection_count), f, indent=2)
+        trim_cache(self.cache_dir, keep=[self.key])
+
+    def discard(self):
+        self.frame_file.close()
+        self.detection_file.close()
+        for path in self.paths[:2]:
+            if os.path.isfile(path + '.part'):
+                os.remove(path + '.part')
+
+
+class DetectionCache(object):
+    '''
+    memory mapped detections of a tracked video
+    '''
+
+    def __init__(self, cache_dir, key):
+        frame_path, detection_path, params_path = cache_paths(cache_dir, key)
+        with open(params_path) as f:
+            self.params = json.load(f)
+        self.frames = self.open_table(frame_path, FRAME_DTYPE)
+        self.detections = self.open_table(detection_path, DETECTION_DTYPE)
+        if len(self.frames) != self.params['frames'] or len(self.detections) != self.params['detections']:
+            raise ValueError(f'{frame_path} does not match its settings')
+
+    @staticmethod
+    def open_table(path, dtype):
+        with open(path, 'rb') as f:
+            magic, version, record_size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or record_size != dtype.itemsize:
+            raise ValueError(f'{path} is not a TrackingBot detection cache')
+        if os.path.getsize(path) == HEADER.size:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', offset=HEADER.size)
+
+    @classmethod
+    def find(cls, cache_dir, key):
+        '''
+        :return: cache of given key, None if not cached or unreadable
+        '''
+        if not os.path.isfile(cache_paths(cache_dir, key)[2]):
+            return None
+        try:
+            detectionCache = cls(cache_dir, key)
+        except (OSError, ValueError, KeyError):
+            return None
+        touch_entry(cache_paths(cache_dir, key)[2])
+        return detectionCache
+
+    def __len__(self):
+        return len(self.frames)
+
+    def elapse(self, frame_index):
+        return float(self.frames['elapse'][frame_index])
+
+    def frame_detections(self, frame_index):
+        '''
+        :return: (n, 3) array of x, y and area of detections in the frame
+        '''
+        first, count = int(self.frames['first'][frame_index]), int(self.frames['count'][frame_index])
+        detections = self.detections[first:first + count]
+        return np.column_stack([detections['x'], detections['y'], detections['area']])
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import argparse
+import importlib
+import tempfile
+import numpy as np
+import pandas as pd
+import cv2
+from scipy.optimize import linear_sum_assignment
+from tracking import Detection
+from tracker import TrackingMethod, DEFAULT_SETTINGS, load_settings
+from synthetic import SyntheticArena
+
+
+def load_ground_truth(truth_path):
+    '''
+    annotated trajectories, one row per subject per frame
+    columns Frame, Subject, pos_x and pos_y, optional Visible (default all visible),
+    e.g. the ground truth csv written by SyntheticArena
+    :return: DataFrame of visible samples
+    '''
+    truth = pd.read_csv(truth_path)
+    if 'Visible' in truth:
+        truth = truth[truth['Visible'].astype(bool)]
+    truth = truth.dropna(subset=['pos_x', 'pos_y'])
+    return truth[['Frame', 'Subject', 'pos_x', 'pos_y']].reset_index(drop=True)
+
+
+def load_engine(spec):
+    '''
+    :param spec: 'module:callable' accepting the arguments of TrackingMethod,
+                 the engine must provide identify() and candidate_list like TrackingMethod
+    '''
+    module_name, attr = spec.split(':')
+    return getattr(importlib.import_module(module_name), attr)
+
+
+class TrackingEvaluation(object):
+    '''
+    run detection and identification offline on a video with known trajectories,
+    report CLEAR MOT (MOTA, MOTP), identity (IDF1, ID switches, fragmentation) and speed
+    '''
+
+    def __init__(self, video_path, truth, obj_num, block_size=11, offset=11, min_contour=1, max_contour=100,
+                 match_dist=15, engine=TrackingMethod, tracker_settings=None):
+        '''
+        :param truth: DataFrame from load_ground_truth()
+        :param obj_num: number of subjects passed to tracking engine
+        :param match_dist: maximum distance in pixels between a tracked and a true position to count as a match
+        :param engine: tracking engine class or factory, TrackingMethod by default
+        :param tracker_settings: dict like tracker.DEFAULT_SETTINGS, defaults if None
+        '''
+        self.video_path = video_path
+        self.truth = truth
+        self.obj_num = obj_num
+        self.block_size = block_size
+        self.offset = offset
+        self.min_contour = min_contour
+        self.max_contour = max_contour
+        self.match_dist = match_dist
+        self.engine = engine
+        settings = dict(DEFAULT_SETTINGS, **(tracker_settings or {}))
+        # same arguments as TrackingMethod.from_settings
+        self.engine_args = (obj_num, settings['dist_thresh'], settings['max_lost_frames'], settings['max_trace_len'])
+        self.engine_kwargs = {'std_acc': settings['std_acc'],
+                              'x_std_meas': settings['std_meas'], 'y_std_meas': settings['std_meas']}
+        self.hypotheses = None
+        self.timing = {}
+
+    def track(self, max_frames=None):
+        '''
+        track every frame, positions are collected the same way DataLogThread logs them
+        :return: DataFrame of Frame, Track, pos_x, pos_y
+        '''
+        cap = cv2.VideoCapture(self.video_path)
+        if not cap.isOpened():
+            raise IOError(f'Cannot open video {self.video_path}')
+        detection = Detection()
+        trackingMethod = self.engine(*self.engine_args, **self.engine_kwargs)
+
+        rows = []
+        frame_index = 0
+        detect_time = 0
+        identify_time = 0
+        start = time.perf_counter()
+        while max_frames is None or frame_index < max_frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+
+            tic = time.perf_counter()
+            thresh_frame = detection.thresh_video(frame, self.block_size, self.offset)
+            _, entrant_detected = detection.detect_contours(frame, thresh_frame, self.min_contour, self.max_contour)
+            toc = time.perf_counter()
+            trackingMethod.identify(entrant_detected, self.min_contour, self.max_contour)
+            detect_time += toc - tic
+            identify_time += time.perf_counter() - toc
+
+            for candidate in trackingMethod.candidate_list[:self.obj_num]:
+                if candidate.lost_sample is None or candidate.lost_sample:
+                    continue
+                rows.append((frame_index, candidate.candidate_id,
+                             float(candidate.pos_prediction[0][0]), float(candidate.pos_prediction[1][0])))
+            frame_index += 1
+
+        total_time = time.perf_counter() - start
+        cap.release()
+
+        self.timing = {'frames': frame_index,
+                       'fps': frame_index / total_time if total_time else None,
+                       'detection_ms': detect_time / max(frame_index, 1) * 1000,
+                       'identify_ms': identify_time / max(frame_index, 1) * 1000}
+        self.hypotheses = pd.DataFrame(rows, columns=['Frame', 'Track', 'pos_x', 'pos_y'])
+        return self.hypotheses
+
+    def evaluate(self):
+        '''
+        :return: dict of accuracy metrics and timing
+        '''
+        if self.hypotheses is None:
+            self.track()
+        # only frames that were tracked are scored
+        truth = self.truth[self.truth['Frame'] < self.timing['frames']]
+        metrics = clear_mot(truth, self.hypotheses, self.match_dist)
+        metrics.update(identity_metrics(truth, self.hypotheses, self.match_dist))
+        metrics.update(self.timing)
+        return metrics
+
+
+def frame_groups(df, id_column):
+    '''
+    :return: dict of frame: (ids, (n, 2) positions)
+    '''
+    groups = {}
+    for frame, group in df.groupby('Frame', sort=True):
+        groups[frame] = (group[id_column].to_numpy(), group[['pos_x', 'pos_y']].to_numpy(dtype=float))
+    return groups
+
+
+def clear_mot(truth, hypotheses, match_dist):
+    '''
+    CLEAR MOT matching frame by frame
+    a match of previous frame is kept while it stays within match_dist,
+    remaining subjects are matched by hungarian assignment on distance
+    :return: dict of MOTA, MOTP, false negatives/positives, ID switches, fragmentation,
+             mostly tracked and mostly lost subjects
+    '''
+    truth_frames = frame_groups(truth, 'Subject')
+    hyp_frames = frame_groups(hypotheses, 'Track')
+
+    last_match = {}  # subject: track of most recent match
+    matched_frames = {}  # subject: list of matched flags of frames the subject is visible
+    false_negative = false_positive = id_switch = 0
+    distance_sum = 0
+    match_count = 0
+
+    for frame in sorted(set(truth_frames) | set(hyp_frames)):
+        subjects, truth_pos = truth_frames.get(frame, (np.empty(0), np.empty((0, 2))))
+        tracks, hyp_pos = hyp_frames.get(frame, (np.empty(0), np.empty((0, 2))))
+        dist = np.linalg.norm(truth_pos[:, None, :] - hyp_pos[None, :, :], axis=2)
+
+        pairs = {}
+        # keep correspondences of previous frame
+        track_column = {track: j for j, track in enumerate(tracks)}
+        for i, subject in enumerate(subjects):
+            j = track_column.get(last_match.get(subject))
+            if j is not None and j not in pairs.values() and dist[i, j] <= match_dist:
+                pairs[i] = j
+
+        free_rows = [i for i in range(len(subjects)) if i not in pairs]
+        free_cols = [j for j in range(len(tracks)) if j not in pairs.values()]
+        if free_rows and free_cols:
+            cost = dist[np.ix_(free_rows, free_cols)]
+            # distances beyond gate can not be matched
+            cost = np.where(cost <= match_dist, cost, 1e9)
+            rows, cols = linear_sum_assignment(cost)
+            for r, c in zip(rows, cols):
+                if cost[r, c] <= match_dist:
+                    pairs[free_rows[r]] = free_cols[c]
+
+        for i, subject in enumerate(subjects):
+            matched_frames.setdefault(subject, []).append(i in pairs)
+            if i not in pairs:
+                continue
+            track = tracks[pairs[i]]
+            if subject in last_match and last_match[subject] != track:
+                id_switch += 1
+            last_match[subject] = track
+            distance_sum += dist[i, pairs[i]]
+            match_count += 1
+
+        false_negative += len(subjects) - len(pairs)
+        false_positive += len(tracks) - len(pairs)
+
+    fragmentation = 0
+    mostly_tracked = mostly_lost = 0
+    for flags in matched_frames.values():
+        flags = np.asarray(flags)
+        # tracked again after being lost
+        first = np.argmax(flags) if flags.any() else len(flags)
+        fragmentation += int(np.count_nonzero(flags[first + 1:] & ~flags[first:-1]))
+        ratio = flags.mean()
+        mostly_tracked += ratio >= 0.8
+        mostly_lost += ratio < 0.2
+
+    truth_count = len(truth)
+    return {'MOTA': 1 - (false_negative + false_positive + id_switch) / truth_count if truth_count else None,
+            'MOTP': distance_sum / match_count if match_count else None,
+            'false_negatives': int(false_negative),
+            'false_positives': int(false_positive),
+            'id_switches': int(id_switch),
+            'fragmentation': fragmentation,
+            'mostly_tracked': int(mostly_tracked),
+            'mostly_lost': int(mostly_lost),
+            'subjects': len(matched_frames)}
+
+
+def identity_metrics(truth, hypotheses, match_dist):
+    '''
+    IDF1: one to one assignment between subjects and tracks over the whole sequence
+    that maximises the number of frames where the pair is within match_dist
+    :return: dict of IDF1, IDP and IDR
+    '''
+    if not len(truth) or not len(hypotheses):
+        return {'IDF1': 0.0, 'IDP': 0.0, 'IDR': 0.0}
+
+    merged = truth.merge(hypotheses, on='Frame', suffixes=('_truth', '_hyp'))
+    close = np.hypot(merged['pos_x_truth'] - merged['pos_x_hyp'],
+                     merged['pos_y_truth'] - merged['pos_y_hyp']) <= match_dist
+    overlap = merged[close].groupby(['Subject', 'Track']).size()
+
+    subjects = truth['Subject'].unique()
+    tracks = hypotheses['Track'].unique()
+    subject_row = {subject: i for i, subject in enumerate(subjects)}
+    track_column = {track: j for j, track in enumerate(tracks)}
+    counts = np.zeros((len(subjects), len(tracks)))
+    for (subject, track), count in overlap.items():
+        counts[subject_row[subject], track_column[track]] = count
+
+    rows, cols = linear_sum_assignment(counts, maximize=True)
+    id_true_positive = counts[rows, cols].sum()
+    return {'IDF1': 2 * id_true_positive / (len(truth) + len(hypotheses)),
+            'IDP': id_true_positive / len(hypotheses),
+            'IDR': id_true_positive / len(truth)}
+
+
+def synthetic_case(workdir, subjects, width, height, duration, occlusions, seed):
+    '''
+    write a synthetic arena video and its ground truth
+    :return: video path, truth path and detection parameters suited to subject size
+    '''
+    radius = max(int(height / 90), 4)
+    arena = SyntheticArena(subjects, radius, speed=width / 10, occlusions=occlusions, width=width, height=height,
+                           duration=duration, seed=seed)
+    video_path = os.path.join(workdir, f'arena {width}x{height} {subjects}.avi')
+    truth_path = arena.write(video_path)
+    area = np.pi * radius ** 2
+    params = {'block_size': 4 * radius + 1, 'min_contour': int(area * 0.3), 'max_contour': int(area * 3),
+              'match_dist': 2 * radius}
+    return video_path, truth_path, params
+
+
+def print_report(metrics):
+    for key in ('MOTA', 'MOTP', 'IDF1', 'IDP', 'IDR', 'id_switches', 'fragmentation', 'false_negatives',
+                'false_positives', 'mostly_tracked', 'mostly_lost', 'subjects', 'frames', 'fps',
+                'detection_ms', 'identify_ms'):
+        value = metrics.get(key)
+        if isinstance(value, float):
+            value = f'{value:.4f}'
+        print(f'{key:>16}: {value}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate tracking accuracy and speed against ground truth')
+    parser.add_argument('video', nargs='?', help='video to track, omit to generate a synthetic arena')
+    parser.add_argument('--truth', help='ground truth csv, default is "<video> ground truth.csv"')
+    parser.add_argument('--subjects', type=int, default=5, help='subject number of tracking or synthetic arena')
+    parser.add_argument('--block-size', type=int, help='adaptive threshold block size')
+    parser.add_argument('--offset', type=int, default=11, help='adaptive threshold offset')
+    parser.add_argument('--min-contour', type=int)
+    parser.add_argument('--max-contour', type=int)
+    parser.add_argument('--match-dist', type=float, help='pixels between tracked and true position for a match')
+    parser.add_argument('--engine', help='alternative tracking engine as module:callable')
+    parser.add_argument('--settings', help='tracker settings json, e.g. written by sweep.py --settings')
+    parser.add_argument('--dist-thresh', type=float, help='tracker distance threshold in pixels')
+    parser.add_argument('--max-lost-frames', type=int, help='frames before a lost subject is dropped')
+    parser.add_argument('--std-acc', type=float, help='kalman filter process noise')
+    parser.add_argument('--std-meas', type=float, help='kalman filter measurement noise')
+    parser.add_argument('--frames', type=int, help='evaluate first frames only')
+    parser.add_argument('--resolution', default='1280x720', help='synthetic arena size')
+    parser.add_argument('--duration', type=float, default=20, help='synthetic arena length in seconds')
+    parser.add_argument('--occlusions', type=int, default=0, help='synthetic arena occluders')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', help='folder to keep the synthetic arena, a temporary folder is used otherwise')
+    parser.add_argument('--output', help='save metrics as json')
+    args = parser.parse_args()
+
+    params = {'block_size': 11, 'min_contour': 1, 'max_contour': 100, 'match_dist': 15}
+    # explicit tracker arguments override the settings file
+    tracker_settings = load_settings(args.settings) if args.settings else dict(DEFAULT_SETTINGS)
+    for key in ('dist_thresh', 'max_lost_frames', 'std_acc', 'std_meas'):
+        if getattr(args, key) is not None:
+            tracker_settings[key] = getattr(args, key)
+
+    # synthetic arena is removed afterwards unless written to --workdir
+    with tempfile.TemporaryDirectory(prefix='trackingbot-evaluation-') as tempdir:
+        if args.video is None:
+            width, height = (int(value) for value in args.resolution.lower().split('x'))
+            video_path, truth_path, params = synthetic_case(args.workdir or tempdir, args.subjects, width, height,
+                                                            args.duration, args.occlusions, args.seed)
+        else:
+            video_path = args.video
+            truth_path = args.truth or video_path.rsplit('.', 1)[0] + ' ground truth.csv'
+
+        # explicit arguments override defaults
+        for key in params:
+            if getattr(args, key) is not None:
+                params[key] = getattr(args, key)
+
+        evaluation = TrackingEvaluation(video_path, load_ground_truth(truth_path), args.subjects,
+                                        offset=args.offset,
+                                        engine=load_engine(args.engine) if args.engine else TrackingMethod,
+                                        tracker_settings=tracker_settings, **params)
+        evaluation.track(args.frames)
+        metrics = evaluation.evaluate()
+
+    metrics.update({'video': video_path, 'truth': truth_path, 'engine': args.engine or 'tracker:TrackingMethod',
+                    'tracker_settings': tracker_settings})
+    print_report(metrics)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(metrics, f, indent=2, default=float)
+        print(f'Saved metrics to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import struct
+import numpy as np
+import cv2
+
+# file header: magic, format version, size of each record in bytes
+HEADER = struct.Struct('<4sHH')
+MAGIC = b'TBFI'
+VERSION = 1
+# one record per captured frame: frame number, monotonic capture time (s), wall clock (s), dropped flag
+RECORD = struct.Struct('<qddB')
+RECORD_DTYPE = np.dtype([('frame', '<i8'), ('monotonic', '<f8'), ('wall', '<f8'), ('dropped', 'u1')])
+
+
+def sidecar_path(video_path):
+    '''
+    path of frame index next to the video file
+    '''
+    return os.path.splitext(video_path)[0] + '.fidx'
+
+
+def seek_time(capture, seconds, frameIndex=None):
+    '''
+    move capture to the frame shown at given time of a slider, inverse of position_time()
+    frames of a live recording are found by their capture time, other videos by nominal frame rate
+    :param capture: cv2.VideoCapture or IndexedCapture
+    :param frameIndex: frame index of the video, None if video has no sidecar
+    '''
+    if frameIndex is not None:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, frameIndex.frame_at(seconds))
+    else:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, int(round(seconds * capture.get(cv2.CAP_PROP_FPS))))
+
+
+def position_time(position, fps, frameIndex=None):
+    '''
+    slider time of a video frame, capture time of a live recording, otherwise position / nominal frame rate
+    :param position: position of frame in the video, first frame start from 0
+    :param frameIndex: frame index of the video, None if video has no sidecar
+    :return: seconds
+    '''
+    if frameIndex is not None:
+        return frameIndex.elapse(position)
+    return max(position, 0) / fps
+
+
+def frame_time(capture, frameIndex=None):
+    '''
+    slider time of the frame last read from capture
+    '''
+    return position_time(capture.get(cv2.CAP_PROP_POS_FRAMES) - 1, capture.get(cv2.CAP_PROP_FPS), frameIndex)
+
+
+class FrameIndexWriter(object):
+    '''
+    write capture time of each frame of a live recording to a binary sidecar file
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+
+    def write(self, frame_number, monotonic, wall, dropped=False):
+        '''
+        :param frame_number: index of captured frame, first frame start from 0
+        :param monotonic: time.perf_counter() when the frame was captured
+        :param wall: time.time() when the frame was captured
+        :param dropped: True if the frame was not written to the video
+        '''
+        self.file.write(RECORD.pack(int(frame_number), monotonic, wall, int(dropped)))
+
+    def close(self):
+        self.file.close()
+
+
+class FrameIndex(object):
+    '''
+    read the frame index of a recording
+    provides exact capture time of each video frame and seek by time
+    '''
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            magic, version, record_size = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or record_size != RECORD.size:
+                raise ValueError(f'{path} is not a TrackingBot frame index')
+            records = np.fromfile(f, dtype=RECORD_DTYPE)
+
+        # records of dropped frames may be written slightly out of order
+        self.records = np.sort(records, order='frame')
+        # only frames not dropped are stored in the video, in capture order
+        self.video_records = self.records[self.records['dropped'] == 0]
+        self.start_time = self.records['monotonic'][0] if len(self.records) else 0
+        # capture time of each video frame relative to first captured frame
+        self.elapse_time = self.video_records['monotonic'] - self.start_time
+
+    @classmethod
+    def load(cls, video_path):
+        '''
+        :return: frame index of the video, None if the video has no sidecar or no frame was recorded
+        '''
+        path = sidecar_path(video_path)
+        if not os.path.isfile(path):
+            return None
+        frameIndex = cls(path)
+        return frameIndex if len(frameIndex) else None
+
+    def __len__(self):
+        return len(self.video_records)
+
+    def dropped_count(self):
+        return int(len(self.records) - len(self.video_records))
+
+    def elapse(self, video_frame):
+        '''
+        :param video_frame: position of frame in the video, first frame start from 0
+        :return: seconds elapsed since capture started
+        '''
+        if not len(self.elapse_time):
+            return 0.0
+        video_frame = min(max(int(video_frame), 0), len(self.elapse_time) - 1)
+        return float(self.elapse_time[video_frame])
+
+    def wall_time(self, video_frame):
+        if not len(self.video_records):
+            return 0.0
+        video_frame = min(max(int(video_frame), 0), len(self.video_records) - 1)
+        return float(self.video_records['wall'][video_frame])
+
+    def frame_at(self, seconds):
+        '''
+        :return: position of the last video frame captured at or before the given elapsed time
+        '''
+        if not len(self.elapse_time):
+            return 0
+        video_frame = int(np.searchsorted(self.elapse_time, seconds, side='right')) - 1
+        return min(max(video_frame, 0), len(self.elapse_time) - 1)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import cv2
+
+
+class HeatmapEngine(object):
+    '''
+    Occupancy heatmap on a coarse grid:
+    integer binning with np.bincount, separable gaussian blur with OpenCV
+    and color mapped uint8 output that can be displayed without matplotlib
+    '''
+
+    def __init__(self, width, height, bin_size=4, sigma=6, colormap=cv2.COLORMAP_JET):
+        '''
+        :param width: frame width of the tracked source
+        :param height: frame height of the tracked source
+        :param bin_size: edge length of each grid cell in pixels, e.g. 2-8
+        :param sigma: standard deviation of gaussian blur in pixels
+        :param colormap: OpenCV colormap used by colorize()
+        '''
+        self.width = int(width)
+        self.height = int(height)
+        self.bin_size = max(int(bin_size), 1)
+        self.sigma = sigma
+        self.colormap = colormap
+
+        self.cols = -(-self.width // self.bin_size)  # ceil division
+        self.rows = -(-self.height // self.bin_size)
+
+    def histogram(self, pos_x, pos_y):
+        '''
+        count samples in each grid cell, lost samples (NaN) are ignored
+        :return: (rows, cols) float32 array, row = y
+        '''
+        pos_x = np.asarray(pos_x, dtype=float)
+        pos_y = np.asarray(pos_y, dtype=float)
+        valid = ~(np.isnan(pos_x) | np.isnan(pos_y))
+
+        col = np.clip(pos_x[valid].astype(np.int64) // self.bin_size, 0, self.cols - 1)
+        row = np.clip(pos_y[valid].astype(np.int64) // self.bin_size, 0, self.rows - 1)
+        counts = np.bincount(row * self.cols + col, minlength=self.rows * self.cols)
+
+        return counts.reshape(self.rows, self.cols).astype(np.float32)
+
+    def blur(self, hist):
+        '''
+        separable gaussian blur, sigma converted from pixels to grid cells
+        '''
+        sigma = self.sigma / self.bin_size
+        if sigma <= 0:
+            return hist
+        # kernel covers +-3 sigma, size must be odd
+        ksize = int(2 * np.ceil(3 * sigma) + 1)
+        kernel = cv2.getGaussianKernel(ksize, sigma, cv2.CV_32F)
+        return cv2.sepFilter2D(hist, cv2.CV_32F, kernel, kernel, borderType=cv2.BORDER_CONSTANT)
+
+    def heat_map(self, pos_x, pos_y):
+        '''
+        blurred occupancy of all samples
+        '''
+        return self.blur(self.histogram(pos_x, pos_y))
+
+    def colorize(self, heat_map, size=None):
+        '''
+        map heat map to a BGR uint8 image
+        :param heat_map: output of heat_map() or blur()
+        :param size: (width, height) of output image, default is frame size
+        '''
+        peak = float(heat_map.max()) if heat_map.size else 0
+        if peak > 0:
+            scaled = cv2.convertScaleAbs(heat_map, alpha=255 / peak)
+        else:
+            scaled = np.zeros(heat_map.shape, dtype=np.uint8)
+
+        if size is None:
+            size = (self.width, self.height)
+        scaled = cv2.resize(scaled, size, interpolation=cv2.INTER_LINEAR)
+
+        return cv2.applyColorMap(scaled, self.colormap)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+from collections import deque
+import numpy as np
+import pandas as pd
+import cv2
+from PyQt5.QtCore import QMutex, QMutexLocker
+
+# stages stamped for each frame, in pipeline order
+STAGES = ('capture', 'detection', 'identify', 'serial')
+# frames kept for live statistics, later stamps of older frames are ignored
+RECENT_FRAMES = 256
+
+
+class LatencyMonitor(object):
+    '''
+    measure closed-loop latency of live tracking
+    each frame is stamped with time.perf_counter() at capture, detection, identify and serial command,
+    latency of each stage is the time elapsed since capture
+    recent frames are kept in a bounded deque for overlay and summary,
+    older frames are moved to a compact log which is only read by export
+    '''
+
+    def __init__(self, recent_frames=RECENT_FRAMES):
+        self.mutex = QMutex()
+        self.enabled = True
+        # (frame index, time of each stage, None if not stamped) of recent frames
+        self.recent = deque(maxlen=recent_frames)
+        # frame index: time of each stage, for frames in recent
+        self.pending = {}
+        # rows of frame index and time of each stage, older frames moved out of recent
+        self.log = np.empty((0, 1 + len(STAGES)))
+        self.log_count = 0
+
+    def reset(self):
+        with QMutexLocker(self.mutex):
+            self.recent.clear()
+            self.pending.clear()
+            self.log = np.empty((0, 1 + len(STAGES)))
+            self.log_count = 0
+
+    def stamp(self, frame_index, stage, stamp_time=None):
+        '''
+        :param frame_index: index of frame shared by all stages
+        :param stage: one of STAGES
+        :param stamp_time: time.perf_counter() of the event, now if None
+        '''
+        if not self.enabled:
+            return
+        if stamp_time is None:
+            stamp_time = time.perf_counter()
+
+        with QMutexLocker(self.mutex):
+            stamps = self.pending.get(frame_index)
+            if stamps is None:
+                # frame is no longer recent, or was never captured
+                if stage != STAGES[0]:
+                    return
+                if len(self.recent) == self.recent.maxlen:
+                    self.move_to_log(*self.recent.popleft())
+                stamps = [None] * len(STAGES)
+                self.recent.append((frame_index, stamps))
+                self.pending[frame_index] = stamps
+            stamps[STAGES.index(stage)] = stamp_time
+
+    def move_to_log(self, frame_index, stamps):
+        del self.pending[frame_index]
+        if self.log_count == len(self.log):
+            self.log = np.concatenate([self.log, np.empty((max(len(self.log), 1024), self.log.shape[1]))])
+        self.log[self.log_count] = [frame_index] + [np.nan if stamp is None else stamp for stamp in stamps]
+        self.log_count += 1
+
+    def latency_array(self, window=None, full=False):
+        '''
+        :param window: number of recent frames, None for all recent frames
+        :param full: all frames since reset, only used by export
+        :return: frame index and (frames, stages after capture) array of latency in seconds
+        '''
+        with QMutexLocker(self.mutex):
+            items = list(self.recent)
+            log = self.log[:self.log_count].copy() if full else None
+        if window is not None:
+            items = items[-window:]
+
+        rows = np.array([[item[0]] + [np.nan if stamp is None else stamp for stamp in item[1]] for item in items],
+                        dtype=float).reshape(len(items), 1 + len(STAGES))
+        if log is not None:
+            rows = np.concatenate([log, rows])
+        frame_index = rows[:, 0].astype(np.int64)
+        stamps = rows[:, 1:]
+        return frame_index, stamps[:, 1:] - stamps[:, :1]
+
+    def latency(self, full=False):
+        '''
+        :param full: all frames since reset instead of recent frames
+        :return: DataFrame of latency in milliseconds, one row per frame
+        '''
+        frame_index, latency = self.latency_array(full=full)
+        df = pd.DataFrame(latency * 1000, columns=[f'{stage} (ms)' for stage in STAGES[1:]])
+        df.insert(0, 'Frame', frame_index)
+        return df
+
+    def summary(self, frame_period=None, full=False):
+        '''
+        percentiles of latency of each stage in milliseconds
+        :param frame_period: frame period in seconds, adds the share of frames within one period
+        :param full: all frames since reset instead of recent frames
+        :return: DataFrame, one row per stage
+        '''
+        return self.summarize(self.latency(full), frame_period)
+
+    @staticmethod
+    def summarize(df, frame_period=None):
+        rows = []
+        for column in df.columns[1:]:
+            values = df[column].dropna().to_numpy()
+            row = {'Stage': column.split(' ')[0], 'Count': len(values)}
+            if len(values):
+                p50, p95, p99 = np.percentile(values, [50, 95, 99])
+                row.update({'p50 (ms)': p50, 'p95 (ms)': p95, 'p99 (ms)': p99, 'Max (ms)': values.max()})
+                if frame_period is not None:
+                    row['Within frame period (%)'] = 100 * np.mean(values <= frame_period * 1000)
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def histogram(self, stage='serial', bin_width=1):
+        '''
+        :param bin_width: bin width in milliseconds
+        :return: counts and bin edges of recent frames like np.histogram
+        '''
+        values = self.latency()[f'{stage} (ms)'].dropna().to_numpy()
+        if not len(values):
+            return np.zeros(0, dtype=int), np.zeros(1)
+        edges = np.arange(0, values.max() + bin_width, bin_width)
+        if len(edges) < 2:
+            edges = np.array([0, bin_width])
+        return np.histogram(values, bins=edges)
+
+    def export(self, save_path, frame_period=None):
+        '''
+        save latency of every frame since reset and summary as csv
+        :return: summary DataFrame
+        '''
+        latency = self.latency(full=True)
+        summary = self.summarize(latency, frame_period)
+        latency.to_csv(save_path, index=False)
+        summary.to_csv(save_path.replace('.csv', ' summary.csv'), index=False)
+        return summary
+
+    def overlay(self, frame, window=100):
+        '''
+        draw p50/p95/p99 of recent frames on the frame
+        :param window: number of recent frames
+        '''
+        _, recent = self.latency_array(window)
+        if not len(recent):
+            return frame
+
+        for i, stage in enumerate(STAGES[1:]):
+            values = recent[:, i][~np.isnan(recent[:, i])]
+            if not len(values):
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+            cv2.putText(frame, f'{stage} p50 {p50:.1f} p95 {p95:.1f} p99 {p99:.1f} ms',
+                        (10, 25 + 25 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+        return frame
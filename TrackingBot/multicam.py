@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import csv
+import time
+import queue
+import argparse
+import multiprocessing
+import cv2
+from capture import BACKENDS, CameraConfig, CameraSource
+from tracking import Detection
+from tracker import TrackingMethod, load_settings
+
+
+def track_camera(name, source, output_path, obj_num, block_size, offset, min_contour, max_contour,
+                 invert_contrast, tracker_settings, stop_event, status_queue):
+    '''
+    detect and identify subjects of one camera until stop_event is set, runs in its own process
+    positions are written as Frame, Time, Subject, pos_x, pos_y rows, lost subjects are not written
+    :param tracker_settings: dict like tracker.DEFAULT_SETTINGS, defaults if None
+    :param status_queue: receives (name, frames tracked, error message or None) when finished
+    '''
+    cap = source.open()
+    if not cap.isOpened():
+        status_queue.put((name, 0, f'cannot open camera {name}'))
+        return
+
+    detection = Detection()
+    trackingMethod = TrackingMethod.from_settings(obj_num, tracker_settings)
+    frame_count = 0
+    error = None
+    start = time.perf_counter()
+    try:
+        with open(output_path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['Frame', 'Time', 'Subject', 'pos_x', 'pos_y'])
+            while not stop_event.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    error = f'camera {name} stopped sending frames'
+                    break
+                elapse = time.perf_counter() - start
+
+                thresh_source = cv2.bitwise_not(frame) if invert_contrast else frame
+                thresh_frame = detection.thresh_video(thresh_source, block_size, offset)
+                _, entrant_detected = detection.detect_contours(frame, thresh_frame, min_contour, max_contour)
+                trackingMethod.identify(entrant_detected, min_contour, max_contour)
+
+                for candidate in trackingMethod.candidate_list[:obj_num]:
+                    if candidate.lost_sample is None or candidate.lost_sample:
+                        continue
+                    writer.writerow([frame_count, round(elapse, 4), candidate.candidate_id,
+                                     float(candidate.pos_prediction[0][0]),
+                                     float(candidate.pos_prediction[1][0])])
+                frame_count += 1
+    finally:
+        cap.release()
+        status_queue.put((name, frame_count, error))
+
+
+class CameraManager(object):
+    '''
+    track several cameras at the same time without display,
+    each camera is grabbed, detected and identified in its own process so pipelines run on separate cores
+    '''
+
+    def __init__(self):
+        # (name, source, output path)
+        self.cameras = []
+        self.processes = []
+        self.stop_event = multiprocessing.Event()
+        self.status_queue = multiprocessing.Queue()
+
+    def add_camera(self, name, source, output_path):
+        '''
+        :param source: CameraSource or VirtualCameraSource, must be picklable
+        :param output_path: csv file of tracked positions
+        '''
+        self.cameras.append((name, source, output_path))
+
+    def start_all(self, obj_num, block_size=11, offset=11, min_contour=1, max_contour=100,
+                  invert_contrast=False, tracker_settings=None):
+        self.stop_event.clear()
+        for name, source, output_path in self.cameras:
+            process = multiprocessing.Process(target=track_camera, name=f'camera {name}',
+                                              args=(name, source, output_path, obj_num, block_size, offset,
+                                                    min_contour, max_contour, invert_contrast, tracker_settings,
+                                                    self.stop_event, self.status_queue))
+            process.start()
+            self.processes.append(process)
+
+    def stop_all(self, timeout=10):
+        '''
+        :return: list of (name, frames tracked, error message or None) of each camera
+        '''
+        self.stop_event.set()
+        status = []
+        for process in self.processes:
+            process.join(timeout)
+        # a crashed process reports nothing
+        for _ in self.processes:
+            try:
+                status.append(self.status_queue.get(timeout=1))
+            except queue.Empty:
+                break
+        self.processes.clear()
+        return status
+
+
+def parse_device(text):
+    return int(text) if text.isdigit() else text
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Track several cameras at the same time, one process per camera')
+    parser.add_argument('--camera', action='append', required=True, metavar='DEVICE',
+                        help='device index, device path or stream url, repeat for each camera')
+    parser.add_argument('--backend', choices=list(BACKENDS), help='native backend of this platform by default')
+    parser.add_argument('--width', type=int)
+    parser.add_argument('--height', type=int)
+    parser.add_argument('--fps', type=float)
+    parser.add_argument('--fourcc', help='pixel format, e.g. MJPG or YUYV')
+    parser.add_argument('--subjects', type=int, default=1, help='number of subjects in each arena')
+    parser.add_argument('--block-size', type=int, default=11)
+    parser.add_argument('--offset', type=int, default=11)
+    parser.add_argument('--min-contour', type=float, default=1)
+    parser.add_argument('--max-contour', type=float, default=100)
+    parser.add_argument('--invert', action='store_true', help='invert contrast before thresholding')
+    parser.add_argument('--tracker-settings', help='tracker settings json, e.g. written by sweep.py --settings')
+    parser.add_argument('--duration', type=float, help='seconds to track, until Ctrl+C if not given')
+    parser.add_argument('--output', default='.', help='folder of csv files, one per camera')
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    cameraManager = CameraManager()
+    for i, device in enumerate(args.camera):
+        config = CameraConfig(parse_device(device), args.backend, args.width, args.height, args.fps, args.fourcc)
+        cameraManager.add_camera(str(i), CameraSource(config), os.path.join(args.output, f'camera {i}.csv'))
+
+    cameraManager.start_all(args.subjects, args.block_size, args.offset, args.min_contour, args.max_contour,
+                            args.invert, load_settings(args.tracker_settings) if args.tracker_settings else None)
+    print(f'Tracking {len(args.camera)} cameras, press Ctrl+C to stop')
+    try:
+        if args.duration:
+            time.sleep(args.duration)
+        else:
+            while any(process.is_alive() for process in cameraManager.processes):
+                time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+
+    for name, frame_count, error in cameraManager.stop_all():
+        print(f'camera {name}: {frame_count} frames tracked' + (f', {error}' if error else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import threading
+import functools
+from collections import deque
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from PyQt5.QtCore import QThread
+
+
+class NullSpan(object):
+    '''
+    span returned while profiling is disabled, does nothing
+    '''
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span(object):
+    '''
+    time the enclosed block and record it when the block exits
+    '''
+    __slots__ = ('profiler', 'name', 'category', 'args', 'start')
+
+    def __init__(self, profiler, name, category, args):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.record(self.name, self.category, self.start, time.perf_counter(), self.args)
+        return False
+
+
+class Profiler(object):
+    '''
+    per stage timeline of all threads
+    stages are wrapped with span() or begin()/end(), or decorated with traced(),
+    while disabled each call only checks a flag, so instrumentation can stay in place
+    recorded spans are exported as Chrome trace json, open with chrome://tracing or ui.perfetto.dev
+    '''
+
+    def __init__(self, capacity=2000000):
+        '''
+        :param capacity: maximum number of spans kept, oldest spans are discarded
+        '''
+        self.enabled = False
+        self.capacity = capacity
+        # (name, category, thread id, start, end, args)
+        self.events = deque(maxlen=capacity)
+        self.thread_names = {}
+        self.lock = threading.Lock()
+        self.session_start = time.perf_counter()
+        self.session_wall = time.time()
+
+    def start(self):
+        '''
+        clear recorded spans and start a new session
+        '''
+        with self.lock:
+            self.events.clear()
+            self.thread_names.clear()
+            self.session_start = time.perf_counter()
+            self.session_wall = time.time()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def span(self, name, category='stage', **args):
+        '''
+        with profiler.span('thresh_video'):
+            ...
+        :param args: extra values shown with the span in the timeline
+        '''
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, args or None)
+
+    def begin(self, name, category='stage'):
+        '''
+        start a span that is ended by end(), for blocks that do not fit a with statement
+        :return: token passed to end(), None while disabled
+        '''
+        if not self.enabled:
+            return None
+        return name, category, time.perf_counter()
+
+    def end(self, token, **args):
+        if token is None:
+            return
+        name, category, start = token
+        self.record(name, category, start, time.perf_counter(), args or None)
+
+    def traced(self, name=None, category='stage'):
+        '''
+        decorator recording every call of a function as a span
+        '''
+        def decorator(func):
+            span_name = func.__name__ if name is None else name
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(span_name, category, start, time.perf_counter())
+            return wrapper
+        return decorator
+
+    def record(self, name, category, start, end, args=None):
+        thread_id = threading.get_ident()
+        with self.lock:
+            if thread_id not in self.thread_names:
+                self.thread_names[thread_id] = self.thread_name(thread_id)
+            self.events.append((name, category, thread_id, start, end, args))
+
+    def thread_name(self, thread_id):
+        '''
+        name of calling thread, QThread subclasses are named after their class
+        '''
+        thread = threading.current_thread()
+        if not isinstance(thread, threading._DummyThread):
+            name = thread.name
+        else:
+            qthread = QThread.currentThread()
+            name = qthread.objectName() or type(qthread).__name__
+        # several cameras run the same thread class
+        used = set(self.thread_names.values())
+        if name in used:
+            count = 2
+            while f'{name} #{count}' in used:
+                count += 1
+            name = f'{name} #{count}'
+        return name
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.events), dict(self.thread_names)
+
+    def chrome_trace(self):
+        '''
+        :return: dict in Chrome trace event format, times in microseconds since session start
+        '''
+        events, thread_names = self.snapshot()
+        pid = os.getpid()
+        trace = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': 'TrackingBot'}}]
+        for sort_index, (thread_id, name) in enumerate(thread_names.items()):
+            trace.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id, 'args': {'name': name}})
+            trace.append({'name': 'thread_sort_index', 'ph': 'M', 'pid': pid, 'tid': thread_id,
+                          'args': {'sort_index': sort_index}})
+
+        for name, category, thread_id, start, end, args in events:
+            event = {'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': thread_id,
+                     'ts': round((start - self.session_start) * 1e6, 3),
+                     'dur': round((end - start) * 1e6, 3)}
+            if args:
+                event['args'] = args
+            trace.append(event)
+
+        return {'traceEvents': trace,
+                'displayTimeUnit': 'ms',
+                'otherData': {'session start': datetime.fromtimestamp(self.session_wall).isoformat()}}
+
+    def export(self, save_path):
+        '''
+        save timeline as Chrome trace json
+        :return: number of spans saved
+        '''
+        trace = self.chrome_trace()
+        with open(save_path, 'w') as f:
+            json.dump(trace, f)
+        return sum(1 for event in trace['traceEvents'] if event['ph'] == 'X')
+
+    def summary(self):
+        '''
+        duration of each stage in each thread, sorted by total time
+        :return: DataFrame, durations in milliseconds
+        '''
+        events, thread_names = self.snapshot()
+        columns = ['Thread', 'Stage', 'Count', 'Total (ms)', 'Mean (ms)', 'p95 (ms)', 'Max (ms)']
+        if not events:
+            return pd.DataFrame(columns=columns)
+
+        df = pd.DataFrame(events, columns=['Stage', 'Category', 'Thread', 'Start', 'End', 'Args'])
+        df['Thread'] = df['Thread'].map(thread_names)
+        df['Duration'] = (df['End'] - df['Start']) * 1000
+        summary = df.groupby(['Thread', 'Stage'])['Duration'].agg(
+            ['count', 'sum', 'mean', lambda d: np.percentile(d, 95), 'max']).reset_index()
+        summary.columns = columns
+        return summary.sort_values('Total (ms)', ascending=False, ignore_index=True)
+
+
+# shared by all threads of the application
+profiler = Profiler()
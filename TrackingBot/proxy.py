@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import argparse
+import cv2
+from PyQt5.QtCore import pyqtSignal, QThread, QObject, QMutex, QMutexLocker
+from detection_cache import default_cache_dir, video_hash, touch_entry, trim_cache
+
+# proxy has the size of display window, so interactive views show its frames without scaling
+DISPLAY_HEIGHT = 576
+# every frame is a JPEG image, so any frame can be decoded without its neighbours
+PROXY_FOURCC = 'MJPG'
+PROXY_QUALITY = 90
+
+
+def proxy_path(cache_dir, video_path):
+    return os.path.join(cache_dir, video_hash(video_path) + '.proxy.avi')
+
+
+def proxy_size(width, height):
+    '''
+    display window size matching aspect ratio of the video, same rule as scale_frame()
+    :return: width, height
+    '''
+    if height / width == 0.75:
+        return 768, DISPLAY_HEIGHT
+    return 1024, DISPLAY_HEIGHT
+
+
+def needs_proxy(width, height):
+    '''
+    a proxy only pays off when the video is larger than the display window
+    '''
+    return width > proxy_size(width, height)[0]
+
+
+def find_proxy(video_path, cache_dir=None):
+    '''
+    :return: path of a finished proxy of the video, None if not generated yet
+    '''
+    path = proxy_path(cache_dir or default_cache_dir(), video_path)
+    if not os.path.isfile(path):
+        return None
+    touch_entry(path)
+    return path
+
+
+def generate_proxy(video_path, path, progress=None, stopped=None):
+    '''
+    write every frame of the video shrunk to display size, frame count and fps are kept,
+    so frame numbers and timestamps of proxy and source are the same.
+    the proxy is written under a temporary name and only renamed when complete
+    :param progress: called with percentage of frames written
+    :param stopped: called before each frame, generation is cancelled when it returns True
+    :return: False if cancelled
+    '''
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f'Failed to open {video_path}')
+    width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+    height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    length = max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 1)
+    size = proxy_size(width, height)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # extension decides container of cv2.VideoWriter
+    part_path = os.path.splitext(path)[0] + '.part.avi'
+    writer = cv2.VideoWriter(part_path, cv2.VideoWriter_fourcc(*PROXY_FOURCC), fps, size)
+    writer.set(cv2.VIDEOWRITER_PROP_QUALITY, PROXY_QUALITY)
+    if not writer.isOpened():
+        cap.release()
+        raise IOError(f'Failed to create {part_path}')
+
+    frame_count = 0
+    completed = True
+    while True:
+        if stopped is not None and stopped():
+            completed = False
+            break
+        ret, frame = cap.read()
+        if not ret:
+            break
+        writer.write(cv2.resize(frame, size, interpolation=cv2.INTER_AREA))
+        frame_count += 1
+        if progress is not None and frame_count % 100 == 0:
+            progress(min(int(frame_count * 100 / length), 99))
+
+    cap.release()
+    writer.release()
+    if not completed or not frame_count:
+        os.remove(part_path)
+        return False
+    os.replace(part_path, path)
+    trim_cache(os.path.dirname(path), keep=[os.path.basename(path).split('.', 1)[0]])
+    if progress is not None:
+        progress(100)
+    return True
+
+
+class ProxyMap(object):
+    '''
+    map positions and sizes between a source video and a smaller frame of it, e.g. proxy or preview
+    '''
+
+    def __init__(self, source_size, frame_size):
+        '''
+        :param source_size: width, height of source video
+        :param frame_size: width, height of the smaller frame
+        '''
+        self.scale_x = frame_size[0] / source_size[0]
+        self.scale_y = frame_size[1] / source_size[1]
+        # contour area scales with both axes
+        self.area_scale = self.scale_x * self.scale_y
+
+    @classmethod
+    def from_frame(cls, video_prop, frame):
+        return cls((video_prop.width, video_prop.height), (frame.shape[1], frame.shape[0]))
+
+    def is_identity(self):
+        return self.scale_x == 1 and self.scale_y == 1
+
+    def to_source(self, x, y):
+        return x / self.scale_x, y / self.scale_y
+
+    def to_frame(self, x, y):
+        return x * self.scale_x, y * self.scale_y
+
+    def area_to_source(self, area):
+        return None if area is None else round(area / self.area_scale, 1)
+
+    def area_to_frame(self, area):
+        return area * self.area_scale
+
+    def block_size_to_frame(self, block_size):
+        '''
+        neighbourhood of adaptive threshold covering the same region of the scene,
+        block size must stay an odd value
+        '''
+        if self.is_identity():
+            return block_size
+        return max(3, int(block_size * self.area_scale ** 0.5) | 1)
+
+
+class ProxyThread(QThread):
+    '''
+    generate the proxy of a video in background
+    '''
+
+    def __init__(self):
+        QThread.__init__(self)
+        self.mutex = QMutex()
+        self.timeSignal = Communicate()
+        self.video_path = None
+        self.cache_dir = None
+        self.stopped = False
+
+    def run(self):
+        with QMutexLocker(self.mutex):
+            self.stopped = False
+        try:
+            path = proxy_path(self.cache_dir or default_cache_dir(), self.video_path)
+            if not os.path.isfile(path):
+                if not generate_proxy(self.video_path, path,
+                                      progress=self.timeSignal.proxy_progress.emit,
+                                      stopped=self.is_stopped):
+                    return
+            self.timeSignal.proxy_ready.emit(self.video_path, path)
+        except Exception as e:
+            self.timeSignal.proxy_failed.emit(str(e))
+
+    def stop(self):
+        with QMutexLocker(self.mutex):
+            self.stopped = True
+
+    def is_stopped(self):
+        with QMutexLocker(self.mutex):
+            return self.stopped
+
+
+class Communicate(QObject):
+    proxy_progress = pyqtSignal(int)
+    proxy_ready = pyqtSignal(str, str)
+    proxy_failed = pyqtSignal(str)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate low resolution proxy of a video for interactive views')
+    parser.add_argument('video')
+    parser.add_argument('--cache-dir', help='default is TrackingBot cache folder')
+    parser.add_argument('--force', action='store_true', help='generate even if video is not larger than display')
+    args = parser.parse_args()
+
+    cap = cv2.VideoCapture(args.video)
+    width, height = cap.get(cv2.CAP_PROP_FRAME_WIDTH), cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+    cap.release()
+    if not args.force and not needs_proxy(width, height):
+        print(f'{args.video} is {int(width)}x{int(height)}, no proxy needed')
+        return
+
+    path = proxy_path(args.cache_dir or default_cache_dir(), args.video)
+    if os.path.isfile(path):
+        print(f'Proxy exists: {path}')
+        return
+    generate_proxy(args.video, path, progress=lambda p: print(f'\r{p}%', end='', flush=True))
+    print(f'\nProxy saved to {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+from collections import OrderedDict
+import numpy as np
+import cv2
+from PyQt5.QtCore import pyqtSignal, QThread, QObject, QMutex, QMutexLocker
+from detection_cache import default_cache_dir, video_hash, touch_entry, trim_cache
+
+try:
+    import av
+except ImportError:
+    # PyAV is optional, without it no index is built and players seek with cv2.VideoCapture
+    av = None
+
+VERSION = 2
+# memory used by decoded frames kept around the playhead, shared by all players
+CACHE_BUDGET = 512 * 1024 * 1024
+# frames before a seek target kept for stepping back, earlier frames are decoded but not converted
+PREROLL = 32
+
+
+def index_path(cache_dir, video_path):
+    return os.path.join(cache_dir, video_hash(video_path) + '.sidx.npz')
+
+
+class SeekIndex(object):
+    '''
+    presentation time of every frame and position of keyframes of a video,
+    frames are numbered in presentation order starting from 0
+    '''
+
+    def __init__(self, times, keyframes, pts):
+        '''
+        :param times: seconds since first frame of each frame
+        :param keyframes: positions of keyframes
+        :param pts: stream timestamp of each frame used to seek with PyAV
+        '''
+        self.times = np.asarray(times, dtype=np.float64)
+        self.keyframes = np.asarray(keyframes, dtype=np.int64)
+        self.pts = np.asarray(pts, dtype=np.int64)
+
+    @classmethod
+    def build(cls, video_path):
+        '''
+        read packet headers with PyAV, no frame is decoded
+        '''
+        if av is None:
+            raise ImportError('PyAV is required to build a seek index')
+        with av.open(video_path) as container:
+            stream = container.streams.video[0]
+            pts = []
+            key = []
+            for packet in container.demux(stream):
+                # flushing packets carry no timestamp
+                if packet.pts is None:
+                    continue
+                pts.append(packet.pts)
+                key.append(packet.is_keyframe)
+            time_base = float(stream.time_base)
+        # packets are in decoding order
+        order = np.argsort(pts, kind='stable')
+        pts = np.asarray(pts, dtype=np.int64)[order]
+        keyframes = np.flatnonzero(np.asarray(key, dtype=bool)[order])
+        if not len(keyframes) or keyframes[0] != 0:
+            keyframes = np.insert(keyframes, 0, 0)
+        times = (pts - pts[0]) * time_base if len(pts) else np.empty(0)
+        return cls(times, keyframes, pts)
+
+    @classmethod
+    def load(cls, video_path, cache_dir=None):
+        '''
+        load index of the video from cache folder, build and store it when missing
+        '''
+        cache_dir = cache_dir or default_cache_dir()
+        path = index_path(cache_dir, video_path)
+        if os.path.isfile(path):
+            with np.load(path) as data:
+                index = cls(data['times'], data['keyframes'], data['pts']) if int(data['version']) == VERSION \
+                    else None
+            if index is not None:
+                touch_entry(path)
+                return index
+        index = cls.build(video_path)
+        index.save(path)
+        return index
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write under temporary name so an interrupted save never leaves a broken index
+        with open(path + '.part', 'wb') as f:
+            np.savez(f, version=VERSION, times=self.times, keyframes=self.keyframes, pts=self.pts)
+        os.replace(path + '.part', path)
+        trim_cache(os.path.dirname(path), keep=[os.path.basename(path).split('.', 1)[0]])
+
+    def __len__(self):
+        return len(self.times)
+
+    def time_of(self, frame):
+        '''
+        :return: seconds since first frame
+        '''
+        frame = min(max(int(frame), 0), len(self.times) - 1)
+        return float(self.times[frame])
+
+    def frame_at(self, seconds):
+        '''
+        :return: position of the last frame shown at or before the given time
+        '''
+        frame = int(np.searchsorted(self.times, seconds + 1e-6, side='right')) - 1
+        return min(max(frame, 0), len(self.times) - 1)
+
+    def keyframe_before(self, frame):
+        '''
+        :return: position of the keyframe decoding of the given frame must start from
+        '''
+        return int(self.keyframes[np.searchsorted(self.keyframes, frame, side='right') - 1])
+
+    def position_of(self, pts):
+        '''
+        :return: position of frame with given stream timestamp
+        '''
+        return int(np.searchsorted(self.pts, pts))
+
+
+class FrameCache(object):
+    '''
+    least recently used decoded frames of one or more videos, limited by total size of frames,
+    players running in different threads share one cache so the budget is not multiplied
+    '''
+
+    def __init__(self, budget=CACHE_BUDGET):
+        self.mutex = QMutex()
+        self.budget = budget
+        self.size = 0
+        # (video path, position): frame
+        self.frames = OrderedDict()
+
+    def get(self, path, position):
+        with QMutexLocker(self.mutex):
+            frame = self.frames.get((path, position))
+            if frame is not None:
+                self.frames.move_to_end((path, position))
+            return frame
+
+    def put(self, path, position, frame):
+        with QMutexLocker(self.mutex):
+            key = (path, position)
+            if key in self.frames:
+                self.frames.move_to_end(key)
+                return
+            self.frames[key] = frame
+            self.size += frame.nbytes
+            # always keep the newest frame even if it is larger than the budget
+            while self.size > self.budget and len(self.frames) > 1:
+                _, dropped = self.frames.popitem(last=False)
+                self.size -= dropped.nbytes
+
+    def discard(self, path):
+        '''
+        drop frames of one video
+        '''
+        with QMutexLocker(self.mutex):
+            for key in [key for key in self.frames if key[0] == path]:
+                self.size -= self.frames.pop(key).nbytes
+
+    def clear(self):
+        with QMutexLocker(self.mutex):
+            self.frames.clear()
+            self.size = 0
+
+
+class IndexedCapture(object):
+    '''
+    replaces the part of cv2.VideoCapture used by interactive video players.
+    with a seek index and PyAV, seeking decodes from the keyframe before target frame,
+    so the returned frame is exact, frames decoded on the way are cached for scrubbing and stepping back.
+    without an index seeking falls back to cv2.VideoCapture
+    '''
+
+    def __init__(self, frameCache=None):
+        '''
+        :param frameCache: FrameCache shared with other players, a private cache if None
+        '''
+        self.capture = cv2.VideoCapture()
+        self.cache = FrameCache() if frameCache is None else frameCache
+        self.path = None
+        self.index = None
+        # video the index was built for, another file such as a proxy is opened without index
+        self.index_path = None
+        self.video_index = None
+        self.container = None
+        self.decoder = None
+        # next frame returned by read()
+        self.position = 0
+        # next frame returned by decoder
+        self.decode_position = 0
+
+    def open(self, path):
+        self.index = self.video_index if path == self.index_path else None
+        self.close_container()
+        self.path = path
+        self.position = 0
+        self.decode_position = 0
+        return self.capture.open(path)
+
+    def set_index(self, video_path, index):
+        '''
+        index is usually built in SeekIndexThread while the video is already open,
+        it is kept when the same video is opened again
+        '''
+        self.index_path = video_path
+        self.video_index = index
+        if video_path == self.path:
+            self.index = index
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.position
+        if prop == cv2.CAP_PROP_POS_MSEC and self.index is not None:
+            return self.index.time_of(self.position - 1) * 1000
+        return self.capture.get(prop)
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            self.position = max(int(value), 0)
+        elif prop == cv2.CAP_PROP_POS_MSEC:
+            if self.index is not None:
+                self.position = self.index.frame_at(value / 1000)
+            else:
+                self.position = int(value / 1000 * self.capture.get(cv2.CAP_PROP_FPS))
+        else:
+            return self.capture.set(prop, value)
+        return True
+
+    def read(self):
+        frame = self.cache.get(self.path, self.position)
+        if frame is not None:
+            self.position += 1
+            return True, frame
+
+        if self.position != self.decode_position:
+            self.seek(self.position)
+
+        while True:
+            # only frames shortly before the target are converted and cached
+            position, frame = self.decode(convert=self.position - self.decode_position < self.preroll())
+            if position is None:
+                # end of video before the target
+                return False, None
+            if position >= self.position and frame is None:
+                return False, None
+            if frame is not None:
+                self.cache.put(self.path, position, frame)
+            if position >= self.position:
+                break
+
+        self.position = position + 1
+        return True, frame
+
+    def seek(self, position):
+        if self.index is not None and len(self.index):
+            if self.container is None:
+                self.container = av.open(self.path)
+                self.container.streams.video[0].thread_type = 'AUTO'
+            stream = self.container.streams.video[0]
+            keyframe = self.index.keyframe_before(min(position, len(self.index) - 1))
+            self.container.seek(int(self.index.pts[keyframe]), stream=stream, backward=True)
+            self.decoder = self.container.decode(stream)
+            self.decode_position = keyframe
+        else:
+            self.decoder = None
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, position)
+            self.decode_position = position
+
+    def preroll(self):
+        '''
+        :return: number of frames before a seek target to cache, limited by frames fit in the cache
+        '''
+        width = self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)
+        height = self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        return min(PREROLL, int(self.cache.budget // max(width * height * 3, 1)))
+
+    def decode(self, convert=True):
+        '''
+        :param convert: False to skip conversion of a frame decoded only to reach the target
+        :return: position and BGR image of next decoded frame, image is None if not converted,
+                 position is None at end of video
+        '''
+        if self.decoder is not None:
+            frame = next(self.decoder, None)
+            if frame is None:
+                # end of video
+                return None, None
+            position = self.decode_position if frame.pts is None else self.index.position_of(frame.pts)
+            self.decode_position = position + 1
+            return position, frame.to_ndarray(format='bgr24') if convert else None
+
+        ret, frame = self.capture.read()
+        if not ret:
+            return None, None
+        self.decode_position += 1
+        return self.decode_position - 1, frame
+
+    def close_container(self):
+        self.decoder = None
+        if self.container is not None:
+            self.container.close()
+            self.container = None
+
+    def release(self):
+        self.close_container()
+        self.capture.release()
+        self.cache.discard(self.path)
+
+
+class SeekIndexThread(QThread):
+    '''
+    load or build the seek index of a video in background,
+    a video requested while another one is indexed is indexed next, only the latest request is kept.
+    without PyAV no index is built
+    '''
+
+    def __init__(self):
+        QThread.__init__(self)
+        self.timeSignal = Communicate()
+        self.mutex = QMutex()
+        # next video to index, None if no request is waiting
+        self.video_path = None
+        # True from request until run() has no more requests
+        self.busy = False
+        self.cache_dir = None
+
+    def request(self, video_path):
+        if av is None:
+            return
+        with QMutexLocker(self.mutex):
+            self.video_path = video_path
+            if self.busy:
+                return
+            self.busy = True
+        # run() may still be returning from the previous request
+        self.wait()
+        self.start()
+
+    def run(self):
+        while True:
+            with QMutexLocker(self.mutex):
+                video_path = self.video_path
+                self.video_path = None
+                if video_path is None:
+                    self.busy = False
+                    return
+            try:
+                index = SeekIndex.load(video_path, self.cache_dir)
+                self.timeSignal.index_ready.emit(video_path, index)
+            except Exception as e:
+                # players keep seeking with cv2.VideoCapture
+                self.timeSignal.index_failed.emit(video_path, str(e))
+
+
+class Communicate(QObject):
+    index_ready = pyqtSignal(str, object)
+    index_failed = pyqtSignal(str, str)
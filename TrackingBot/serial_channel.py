@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import queue
+from PyQt5.QtCore import QThread, QMutex, QMutexLocker
+from profiler import profiler
+
+# Packet layout, all fields are single bytes:
+# SYNC | LEN | CMD | SEQ | DATA... | CHECKSUM
+# LEN counts SEQ and DATA, CHECKSUM is XOR of LEN, CMD, SEQ and DATA
+SYNC = 0xA5
+# DATA is (channel, value) pairs, all pairs of one frame are sent in one packet
+CMD_SET = 0x01
+# no DATA, only asks for an ACK
+CMD_PING = 0x02
+# reply of firmware is the command with this bit set, echoing SEQ
+ACK_FLAG = 0x80
+# max value of LEN, longer packets are rejected so a stray SYNC byte is skipped quickly
+MAX_LENGTH = 64
+
+# output channel of the gate motor, zones use channel 0-5
+GATE_CHANNEL = 6
+
+
+def checksum(data):
+    value = 0
+    for byte in data:
+        value ^= byte
+    return value
+
+
+def encode_packet(cmd, seq, data=b''):
+    '''
+    :param cmd: command byte
+    :param seq: sequence number 0-255, echoed in ACK
+    :param data: payload bytes
+    :return: packet bytes
+    '''
+    if len(data) + 1 > MAX_LENGTH:
+        raise ValueError(f'Payload of {len(data)} bytes exceeds {MAX_LENGTH - 1} bytes')
+    body = bytes([len(data) + 1, cmd, seq & 0xFF]) + bytes(data)
+    return bytes([SYNC]) + body + bytes([checksum(body)])
+
+
+class PacketParser(object):
+    '''
+    incremental parser of the byte stream, invalid packets are skipped
+    '''
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.errors = 0
+
+    def feed(self, data):
+        '''
+        :param data: bytes received
+        :return: list of (cmd, seq, data) of complete packets
+        '''
+        self.buffer.extend(data)
+        packets = []
+        while True:
+            start = self.buffer.find(SYNC)
+            if start < 0:
+                self.buffer.clear()
+                return packets
+            del self.buffer[:start]
+            if len(self.buffer) < 2:
+                return packets
+            length = self.buffer[1]
+            # SYNC + LEN + CMD + payload + CHECKSUM
+            if 1 <= length <= MAX_LENGTH and len(self.buffer) < length + 4:
+                return packets
+
+            body = bytes(self.buffer[1:length + 3])
+            if 1 <= length <= MAX_LENGTH and checksum(body) == self.buffer[length + 3]:
+                packets.append((body[1], body[2], body[3:]))
+                del self.buffer[:length + 4]
+            else:
+                # not a packet start, search next SYNC
+                self.errors += 1
+                del self.buffer[:1]
+
+
+class SerialChannel(QThread):
+    '''
+    the only thread writing to the serial device
+    commands are queued by any thread and written in order as framed binary packets,
+    optionally waiting for ACK of the firmware to measure round trip time
+    '''
+
+    def __init__(self, device=None, ack=False):
+        '''
+        :param device: opened serial.Serial or any object with write(), read() and in_waiting
+        :param ack: read ACK of each packet and record round trip time
+        '''
+        QThread.__init__(self)
+        self.mutex = QMutex()
+        self.stopped = False
+        self.device = device
+        self.ack = ack
+        # closed-loop latency measurement, None to disable
+        self.latencyMonitor = None
+
+        # (cmd, data, tag) waiting to be written
+        self.packet_queue = queue.Queue()
+        self.parser = PacketParser()
+        self.seq = 0
+        # seq: (write time, tag) of packets waiting for ACK
+        self.pending = {}
+        # (tag, round trip time in seconds) of acknowledged packets
+        self.round_trips = []
+        self.packets_written = 0
+
+    def run(self):
+        with QMutexLocker(self.mutex):
+            self.stopped = False
+
+        while not self.stopped:
+            try:
+                cmd, data, tag = self.packet_queue.get(timeout=0.01)
+            except queue.Empty:
+                self.read_ack()
+                continue
+
+            self.write_packet(cmd, data, tag)
+            self.read_ack()
+
+    def stop(self):
+        with QMutexLocker(self.mutex):
+            self.stopped = True
+
+    def send(self, commands, tag=None):
+        '''
+        queue (channel, value) commands as one packet
+        :param commands: list of (channel, value), e.g. [(0, 1), (2, 0)]
+        :param tag: frame index of the commands, used for latency measurement
+        '''
+        if not commands:
+            return
+        data = bytes(byte for channel, value in commands for byte in (int(channel), int(value)))
+        self.packet_queue.put((CMD_SET, data, tag))
+
+    def ping(self):
+        self.packet_queue.put((CMD_PING, b'', None))
+
+    @profiler.traced()
+    def write_packet(self, cmd, data, tag):
+        if self.device is None:
+            return
+        self.seq = (self.seq + 1) & 0xFF
+        self.device.write(encode_packet(cmd, self.seq, data))
+        write_time = time.perf_counter()
+        self.packets_written += 1
+        if self.latencyMonitor is not None and tag is not None:
+            self.latencyMonitor.stamp(tag, 'serial', write_time)
+        if self.ack:
+            self.pending[self.seq] = (write_time, tag)
+
+    def read_ack(self):
+        '''
+        match ACK of firmware to written packets, received bytes are always drained
+        '''
+        if self.device is None or not self.device.in_waiting:
+            return
+        received = self.device.read(self.device.in_waiting)
+        if not self.ack:
+            return
+        for cmd, seq, data in self.parser.feed(received):
+            if cmd & ACK_FLAG and seq in self.pending:
+                write_time, tag = self.pending.pop(seq)
+                self.round_trips.append((tag, time.perf_counter() - write_time))
+
+    def clear_queue(self):
+        while True:
+            try:
+                self.packet_queue.get_nowait()
+            except queue.Empty:
+                break
+        self.pending.clear()
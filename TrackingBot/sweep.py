@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from detection_cache import DetectionCache, cache_key, default_cache_dir
+from tracker import TrackingMethod, DEFAULT_SETTINGS, save_settings
+from tracking import replay_detections
+
+# tracker settings swept by default
+DEFAULT_GRID = {'dist_thresh': [10, 15, 25, 40],
+                'max_lost_frames': [15, 30, 60, 120],
+                'std_acc': [0.5, 1, 2],
+                'std_meas': [0.05, 0.1, 0.5]}
+
+# cache opened once in each worker process
+worker_cache = None
+
+
+def open_worker_cache(cache_dir, key):
+    global worker_cache
+    worker_cache = DetectionCache(cache_dir, key)
+
+
+def replay(detectionCache, trackingMethod, min_contour, max_contour):
+    '''
+    identify subjects from cached detections and sample positions like DataLogThread
+    :return: (frames, subjects) arrays of x, y (NaN when lost) and subject ids in column order,
+             number of registrations after the first frame
+    '''
+    frame_count = len(detectionCache)
+    obj_num = trackingMethod.obj_num
+    pos_x = np.full((frame_count, obj_num), np.nan)
+    pos_y = np.full((frame_count, obj_num), np.nan)
+    columns = {}
+    registrations = 0
+
+    registered = trackingMethod.candidate_index
+    for frame_index in replay_detections(detectionCache, trackingMethod, min_contour, max_contour):
+        if frame_index > 0:
+            # expired or never seen subjects picked up again, identity may be swapped
+            registrations += max(trackingMethod.candidate_index - registered, 0)
+        registered = trackingMethod.candidate_index
+
+        # samples logged the same way as DataLogThread
+        for candidate in trackingMethod.candidate_list[:obj_num]:
+            if candidate.lost_sample is None or candidate.lost_sample:
+                continue
+            column = columns.setdefault(candidate.candidate_id, len(columns))
+            if column >= obj_num:
+                continue
+            pos_x[frame_index, column] = candidate.pos_prediction[0][0]
+            pos_y[frame_index, column] = candidate.pos_prediction[1][0]
+
+    return pos_x, pos_y, registrations
+
+
+def continuity(pos_x, pos_y, jump_dist):
+    '''
+    heuristics of track quality without ground truth
+    :param jump_dist: displacement in pixels between consecutive samples of a subject treated as a possible swap
+    :return: dict of lost ratio, fragments, mean tracked run length and jumps
+    '''
+    tracked = ~np.isnan(pos_x)
+    frame_count = len(tracked)
+    # tracked again after being lost
+    fragments = int(np.count_nonzero(tracked[1:] & ~tracked[:-1]))
+
+    # length of continuous tracked runs of every subject
+    padded = np.vstack([np.zeros((1, tracked.shape[1]), bool), tracked, np.zeros((1, tracked.shape[1]), bool)])
+    change = np.diff(padded.astype(np.int8), axis=0)
+    starts = np.nonzero(change.T == 1)
+    ends = np.nonzero(change.T == -1)
+    runs = ends[1] - starts[1]
+
+    step = np.hypot(np.diff(pos_x, axis=0), np.diff(pos_y, axis=0))
+    jumps = int(np.count_nonzero(step > jump_dist))
+
+    return {'lost_ratio': 1 - tracked.mean() if tracked.size else 1.0,
+            'fragments': fragments,
+            'mean_run': float(runs.mean()) if len(runs) else 0.0,
+            'mean_run_ratio': float(runs.mean()) / frame_count if len(runs) and frame_count else 0.0,
+            'jumps': jumps}
+
+
+def run_setting(setting):
+    '''
+    worker: replay cached detections with one tracker setting
+    '''
+    obj_num, min_contour, max_contour, jump_dist, params = setting
+    tic = time.perf_counter()
+    trackingMethod = TrackingMethod.from_settings(obj_num, params)
+    pos_x, pos_y, registrations = replay(worker_cache, trackingMethod, min_contour, max_contour)
+    result = dict(params)
+    result.update(continuity(pos_x, pos_y, jump_dist))
+    result['registrations'] = registrations
+    result['fps'] = len(worker_cache) / (time.perf_counter() - tic)
+    return result
+
+
+def rank(results, obj_num, frame_count, switch_weight=1.0, fragment_weight=0.2):
+    '''
+    lower score is better:
+    lost ratio plus rates of probable identity switches (registrations, jumps) and fragments per 100 subject frames
+    '''
+    df = pd.DataFrame(results)
+    samples = max(obj_num * frame_count, 1)
+    df['score'] = (df['lost_ratio']
+                   + switch_weight * (df['registrations'] + df['jumps']) / samples * 100
+                   + fragment_weight * df['fragments'] / samples * 100)
+    return df.sort_values(['score', 'lost_ratio'], ignore_index=True)
+
+
+def sweep(cache_dir, key, obj_num, min_contour, max_contour, grid=None, jump_dist=None, workers=None):
+    '''
+    evaluate every combination of the grid in a process pool
+    :param grid: dict of parameter name: list of values, see DEFAULT_GRID
+    :param jump_dist: default is the largest dist_thresh of the grid
+    :return: DataFrame ranked by score
+    '''
+    grid = dict(DEFAULT_GRID, **(grid or {}))
+    if jump_dist is None:
+        jump_dist = max(grid['dist_thresh'])
+    names = list(grid)
+    settings = [(obj_num, min_contour, max_contour, jump_dist, dict(zip(names, values)))
+                for values in itertools.product(*(grid[name] for name in names))]
+
+    frame_count = len(DetectionCache(cache_dir, key))
+    with ProcessPoolExecutor(max_workers=workers, initializer=open_worker_cache,
+                             initargs=(cache_dir, key)) as executor:
+        results = list(executor.map(run_setting, settings, chunksize=1))
+    return rank(results, obj_num, frame_count)
+
+
+def parse_values(text, cast=float):
+    return [cast(value) for value in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rank tracker settings on cached detections of a tracked video')
+    parser.add_argument('video', nargs='?', help='tracked video, cache is found with the threshold settings below')
+    parser.add_argument('--key', help='cache key, needed when ROI or mask was applied')
+    parser.add_argument('--cache-dir', default=default_cache_dir())
+    parser.add_argument('--block-size', type=int, default=11)
+    parser.add_argument('--offset', type=int, default=11)
+    parser.add_argument('--min-contour', type=float, default=1)
+    parser.add_argument('--max-contour', type=float, default=100)
+    parser.add_argument('--invert', action='store_true', help='contrast was inverted')
+    parser.add_argument('--subjects', type=int, default=1, help='number of subjects')
+    parser.add_argument('--dist-thresh', default=','.join(map(str, DEFAULT_GRID['dist_thresh'])))
+    parser.add_argument('--max-lost-frames', default=','.join(map(str, DEFAULT_GRID['max_lost_frames'])))
+    parser.add_argument('--std-acc', default=','.join(map(str, DEFAULT_GRID['std_acc'])),
+                        help='Kalman process noise')
+    parser.add_argument('--std-meas', default=','.join(map(str, DEFAULT_GRID['std_meas'])),
+                        help='Kalman measurement noise, x and y')
+    parser.add_argument('--jump-dist', type=float, help='pixels between samples counted as a possible swap')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--top', type=int, default=10, help='settings printed')
+    parser.add_argument('--output', help='save all results as csv')
+    parser.add_argument('--settings', help='save best settings as json, load it in Tools > Tracker settings')
+    args = parser.parse_args()
+
+    if args.key:
+        key = args.key
+    elif args.video:
+        key, _ = cache_key(args.video, args.block_size, args.offset, args.min_contour, args.max_contour, args.invert)
+    else:
+        parser.error('video or --key is required')
+    if DetectionCache.find(args.cache_dir, key) is None:
+        parser.error(f'no detection cache {key} in {args.cache_dir}, track the video once with these settings')
+
+    grid = {'dist_thresh': parse_values(args.dist_thresh),
+            'max_lost_frames': parse_values(args.max_lost_frames, int),
+            'std_acc': parse_values(args.std_acc),
+            'std_meas': parse_values(args.std_meas)}
+    tic = time.perf_counter()
+    result = sweep(args.cache_dir, key, args.subjects, args.min_contour, args.max_contour, grid,
+                   args.jump_dist, args.workers)
+    print(f'{len(result)} settings evaluated in {time.perf_counter() - tic:.1f} s with {args.workers} workers')
+    print(result.head(args.top).round(4).to_string(index=False))
+
+    if args.output:
+        result.to_csv(args.output, index=False)
+        print(f'Saved results to {args.output}')
+
+    if args.settings:
+        best = result.iloc[0]
+        settings = dict(DEFAULT_SETTINGS, dist_thresh=float(best['dist_thresh']),
+                        max_lost_frames=int(best['max_lost_frames']), std_acc=float(best['std_acc']),
+                        std_meas=float(best['std_meas']))
+        save_settings(args.settings, settings)
+        print(f'Saved settings to {args.settings}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import numpy as np
+import pandas as pd
+import cv2
+
+
+class SyntheticArena(object):
+    '''
+    render dark subjects moving on a bright arena with known trajectories,
+    for reproducible benchmarks and accuracy checks of detection and tracking
+    '''
+
+    def __init__(self, subjects=5, radius=8, speed=120, turn=1.5, noise=4, occlusions=0,
+                 gradient=40, width=1280, height=720, fps=25, duration=60, seed=0):
+        '''
+        :param subjects: number of moving subjects
+        :param radius: subject radius in pixels
+        :param speed: mean speed in pixels per second
+        :param turn: standard deviation of heading change in radians per second
+        :param noise: standard deviation of gaussian pixel noise
+        :param occlusions: number of static occluders hiding subjects passing below
+        :param gradient: brightness difference across the arena from left to right
+        :param width: frame width
+        :param height: frame height
+        :param fps: frame rate
+        :param duration: length of video in seconds
+        :param seed: seed of trajectories, occluders and noise
+        '''
+        self.subjects = int(subjects)
+        self.radius = int(radius)
+        self.speed = speed
+        self.turn = turn
+        self.noise = noise
+        self.gradient = gradient
+        self.width = int(width)
+        self.height = int(height)
+        self.fps = fps
+        self.frame_count = int(round(duration * fps))
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+
+        # left to right lighting gradient
+        ramp = np.linspace(-gradient / 2, gradient / 2, self.width, dtype=np.float32)
+        self.background = np.clip(200 + np.tile(ramp, (self.height, 1)), 0, 255).astype(np.uint8)
+        self.background = cv2.cvtColor(self.background, cv2.COLOR_GRAY2BGR)
+
+        # occluders (x1, y1, x2, y2), same brightness as arena so subjects disappear below them
+        self.occluders = []
+        for _ in range(int(occlusions)):
+            w = int(self.rng.uniform(0.05, 0.15) * self.width)
+            h = int(self.rng.uniform(0.05, 0.15) * self.height)
+            x = int(self.rng.uniform(0, self.width - w))
+            y = int(self.rng.uniform(0, self.height - h))
+            self.occluders.append((x, y, x + w, y + h))
+
+        self.positions = self.simulate()
+        self.visible = self.visibility()
+
+        # generating gaussian noise costs more than rendering, so every frame uses
+        # a randomly shifted window of a few pregenerated noise frames
+        self.noise_shift = 32
+        self.noise_bank = []
+        if self.noise > 0:
+            shape = (self.height + self.noise_shift, self.width + self.noise_shift, 3)
+            self.noise_bank = [self.rng.normal(0, self.noise, shape).astype(np.int16) for _ in range(4)]
+
+    def simulate(self):
+        '''
+        correlated random walk reflected at arena walls
+        :return: (frames, subjects, 2) array of x, y
+        '''
+        margin = self.radius + 1
+        low = np.array([margin, margin], dtype=float)
+        high = np.array([self.width - margin, self.height - margin], dtype=float)
+
+        positions = np.empty((self.frame_count, self.subjects, 2))
+        position = self.rng.uniform(low, high, size=(self.subjects, 2))
+        heading = self.rng.uniform(0, 2 * np.pi, self.subjects)
+        step = self.speed / self.fps
+        turn = self.turn / np.sqrt(self.fps)
+
+        for i in range(self.frame_count):
+            positions[i] = position
+            heading = heading + self.rng.normal(0, turn, self.subjects)
+            length = step * self.rng.uniform(0.5, 1.5, self.subjects)
+            position = position + np.stack([np.cos(heading), np.sin(heading)], axis=1) * length[:, None]
+
+            # reflect at walls
+            below = position < low
+            above = position > high
+            position = np.where(below, 2 * low - position, position)
+            position = np.where(above, 2 * high - position, position)
+            heading = np.where(below[:, 0] | above[:, 0], np.pi - heading, heading)
+            heading = np.where(below[:, 1] | above[:, 1], -heading, heading)
+
+        return positions
+
+    def visibility(self):
+        '''
+        :return: (frames, subjects) bool array, False when center is below an occluder
+        '''
+        visible = np.ones(self.positions.shape[:2], dtype=bool)
+        for x1, y1, x2, y2 in self.occluders:
+            x = self.positions[..., 0]
+            y = self.positions[..., 1]
+            visible &= ~((x >= x1) & (x <= x2) & (y >= y1) & (y <= y2))
+        return visible
+
+    def frame(self, frame_index):
+        '''
+        render one BGR frame
+        '''
+        frame = self.background.copy()
+        for x, y in self.positions[frame_index % self.frame_count]:
+            cv2.circle(frame, (int(round(x)), int(round(y))), self.radius, (30, 30, 30), -1, cv2.LINE_AA)
+        for x1, y1, x2, y2 in self.occluders:
+            frame[y1:y2, x1:x2] = self.background[y1:y2, x1:x2]
+
+        if self.noise_bank:
+            # same noise for the same frame index
+            rng = np.random.default_rng((self.seed, frame_index))
+            k, dy, dx = rng.integers(0, [len(self.noise_bank), self.noise_shift, self.noise_shift])
+            noise = self.noise_bank[k][dy:dy + self.height, dx:dx + self.width]
+            frame = cv2.add(frame, noise, dtype=cv2.CV_8U)
+        return frame
+
+    def generator(self, frame_index, width=None, height=None):
+        '''
+        frame generator of VirtualCameraSource, size is fixed by the arena
+        '''
+        return self.frame(frame_index)
+
+    def ground_truth(self):
+        '''
+        :return: DataFrame of frame, time, subject, x, y and visibility of every subject in every frame
+        '''
+        frame_index = np.repeat(np.arange(self.frame_count), self.subjects)
+        return pd.DataFrame({'Frame': frame_index,
+                             'Time (s)': frame_index / self.fps,
+                             'Subject': np.tile(np.arange(1, self.subjects + 1), self.frame_count),
+                             'pos_x': self.positions[..., 0].ravel(),
+                             'pos_y': self.positions[..., 1].ravel(),
+                             'Visible': self.visible.ravel()})
+
+    def write(self, video_path, codec='MJPG'):
+        '''
+        save video and ground truth csv with the same name
+        :return: path of ground truth file
+        '''
+        export = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*codec), self.fps,
+                                 (self.width, self.height), True)
+        for i in range(self.frame_count):
+            export.write(self.frame(i))
+        export.release()
+
+        truth_path = video_path.rsplit('.', 1)[0] + ' ground truth.csv'
+        self.ground_truth().to_csv(truth_path, index=False)
+        return truth_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic arena video with ground truth trajectories')
+    parser.add_argument('output', help='video file, e.g. arena.avi')
+    parser.add_argument('--subjects', type=int, default=5)
+    parser.add_argument('--radius', type=int, default=8, help='subject radius in pixels')
+    parser.add_argument('--speed', type=float, default=120, help='pixels per second')
+    parser.add_argument('--noise', type=float, default=4, help='standard deviation of pixel noise')
+    parser.add_argument('--occlusions', type=int, default=0)
+    parser.add_argument('--gradient', type=float, default=40, help='brightness change across arena')
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--fps', type=float, default=25)
+    parser.add_argument('--duration', type=float, default=60, help='seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--codec', default='MJPG')
+    args = parser.parse_args()
+
+    arena = SyntheticArena(args.subjects, args.radius, args.speed, noise=args.noise, occlusions=args.occlusions,
+                           gradient=args.gradient, width=args.width, height=args.height, fps=args.fps,
+                           duration=args.duration, seed=args.seed)
+    truth_path = arena.write(args.output, args.codec)
+    print(f'Saved {arena.frame_count} frames to {args.output}, ground truth to {truth_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+from detection_cache import cache_entries, trim_cache, clear_cache, touch_entry
+
+
+def write_entry(cache_dir, name, size, age):
+    '''
+    :param age: seconds since last use
+    '''
+    path = os.path.join(cache_dir, name)
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+    used = time.time() - age
+    os.utime(path, (used, used))
+    return path
+
+
+def test_files_of_an_entry_are_grouped(tmp_path):
+    cache_dir = str(tmp_path)
+    write_entry(cache_dir, 'abc.proxy.avi', 100, 10)
+    write_entry(cache_dir, 'abc.sidx.npz', 20, 5)
+    write_entry(cache_dir, 'def.frm', 30, 1)
+
+    entries = cache_entries(cache_dir)
+    assert sorted(entries) == ['abc', 'def']
+    assert entries['abc'][1] == 120
+    assert len(entries['abc'][2]) == 2
+
+
+def test_trim_removes_least_recently_used_first(tmp_path):
+    cache_dir = str(tmp_path)
+    write_entry(cache_dir, 'old.proxy.avi', 100, 300)
+    write_entry(cache_dir, 'mid.frm', 100, 200)
+    write_entry(cache_dir, 'new.sidx.npz', 100, 100)
+    # using an entry makes it the most recent one
+    touch_entry(os.path.join(cache_dir, 'old.proxy.avi'))
+
+    trim_cache(cache_dir, budget=200)
+    assert sorted(cache_entries(cache_dir)) == ['new', 'old']
+
+
+def test_entries_being_written_or_kept_are_not_removed(tmp_path):
+    cache_dir = str(tmp_path)
+    write_entry(cache_dir, 'busy.frm.part', 100, 400)
+    write_entry(cache_dir, 'busy.det.part', 100, 0)
+    write_entry(cache_dir, 'kept.json', 100, 300)
+    write_entry(cache_dir, 'other.json', 100, 200)
+
+    trim_cache(cache_dir, budget=0, keep=['kept'])
+    assert sorted(cache_entries(cache_dir)) == ['busy', 'kept']
+
+    clear_cache(cache_dir)
+    assert sorted(cache_entries(cache_dir)) == ['busy']
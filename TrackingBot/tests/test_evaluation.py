@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from evaluation import TrackingEvaluation, load_ground_truth, synthetic_case
+
+
+def test_synthetic_arena_accuracy(tmp_path):
+    video_path, truth_path, params = synthetic_case(str(tmp_path), subjects=3, width=320, height=240,
+                                                    duration=4, occlusions=0, seed=0)
+    evaluation = TrackingEvaluation(video_path, load_ground_truth(truth_path), 3, **params)
+    evaluation.track()
+    metrics = evaluation.evaluate()
+
+    assert metrics['frames'] == 100
+    assert metrics['MOTA'] >= 0.9
+    assert metrics['IDF1'] >= 0.9
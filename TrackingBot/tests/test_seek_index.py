@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import cv2
+import pytest
+import seek_index
+from seek_index import SeekIndex, IndexedCapture
+
+FRAMES = 60
+
+
+@pytest.fixture(scope='module')
+def video_path(tmp_path_factory):
+    # inter frame codec, so seeking has to decode from a keyframe
+    path = str(tmp_path_factory.mktemp('seek') / 'seek.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'XVID'), 25, (64, 48))
+    rng = np.random.default_rng(0)
+    for i in range(FRAMES):
+        frame = np.full((48, 64, 3), 40, dtype=np.uint8)
+        x, y = rng.integers(8, 56), rng.integers(8, 40)
+        cv2.circle(frame, (int(x), int(y)), 6, (255, 255, 255), -1)
+        cv2.putText(frame, str(i), (2, 46), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 255), 1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def sequential_frames(path, index):
+    capture = IndexedCapture()
+    capture.open(path)
+    capture.set_index(path, index)
+    frames = []
+    while True:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+@pytest.mark.parametrize('with_index', [True, False])
+def test_random_seek_matches_sequential_decode(video_path, with_index):
+    if with_index and seek_index.av is None:
+        pytest.skip('PyAV is not installed')
+    index = SeekIndex.build(video_path) if with_index else None
+    frames = sequential_frames(video_path, index)
+    assert len(frames) == FRAMES
+
+    capture = IndexedCapture()
+    capture.open(video_path)
+    capture.set_index(video_path, index)
+    rng = np.random.default_rng(1)
+    for position in list(rng.integers(0, FRAMES, 40)) + [FRAMES - 1, 0, 1]:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, int(position))
+        ret, frame = capture.read()
+        assert ret
+        assert capture.get(cv2.CAP_PROP_POS_FRAMES) == position + 1
+        np.testing.assert_array_equal(frame, frames[position])
+
+    # reading past the last frame stops
+    capture.set(cv2.CAP_PROP_POS_FRAMES, FRAMES)
+    assert not capture.read()[0]
+    capture.release()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from serial_channel import PacketParser, encode_packet, CMD_SET, CMD_PING, ACK_FLAG, GATE_CHANNEL, SYNC
+
+
+def test_round_trip():
+    packets = [(CMD_SET, 0, bytes([GATE_CHANNEL, 1])),
+               (CMD_PING, 1, b''),
+               (CMD_SET | ACK_FLAG, 255, bytes(range(63)))]
+    stream = b''.join(encode_packet(cmd, seq, data) for cmd, seq, data in packets)
+
+    parser = PacketParser()
+    assert parser.feed(stream) == packets
+    assert parser.errors == 0
+
+
+def test_round_trip_byte_by_byte():
+    packet = (CMD_SET, 7, bytes([GATE_CHANNEL, 0]))
+    parser = PacketParser()
+    received = []
+    for byte in encode_packet(*packet):
+        received.extend(parser.feed(bytes([byte])))
+    assert received == [packet]
+
+
+def test_resync_after_noise_and_corrupted_packet():
+    good = encode_packet(CMD_SET, 3, bytes([GATE_CHANNEL, 1]))
+    corrupted = bytearray(encode_packet(CMD_SET, 4, bytes([GATE_CHANNEL, 0])))
+    corrupted[-1] ^= 0xFF
+    # noise contains a SYNC byte followed by an invalid length
+    noise = bytes([0x00, 0x13, SYNC, 0xFF, 0x42])
+
+    parser = PacketParser()
+    packets = parser.feed(noise + bytes(corrupted) + good)
+    assert packets == [(CMD_SET, 3, bytes([GATE_CHANNEL, 1]))]
+    assert parser.errors > 0
+    # nothing of the valid packet is left over
+    assert parser.feed(b'') == []
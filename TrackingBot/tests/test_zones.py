@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+from zones import ZoneEngine
+
+
+def zone_engine(enter_frames=2, exit_frames=3):
+    zoneEngine = ZoneEngine(100, 100, enter_frames=enter_frames, exit_frames=exit_frames)
+    zoneEngine.add_rect(0, 0, 49, 99)
+    zoneEngine.add_rect(50, 0, 99, 99)
+    zoneEngine.build()
+    return zoneEngine
+
+
+def test_enter_after_consecutive_frames():
+    zoneEngine = zone_engine()
+    assert zoneEngine.update([1], [20], [20]) == ([], [])
+    events, commands = zoneEngine.update([1], [20], [20])
+    assert events == [(1, 0, True)]
+    assert commands == [(0, True)]
+
+
+def test_short_visit_is_ignored():
+    zoneEngine = zone_engine()
+    zoneEngine.update([1], [20], [20])
+    zoneEngine.update([1], [20], [20])
+    # one frame in the other zone resets the streak
+    for pos_x in (70, 20, 70, 20):
+        events, commands = zoneEngine.update([1], [pos_x], [20])
+        assert events == [] and commands == []
+
+
+def test_exit_after_consecutive_frames_and_lost_samples_keep_state():
+    zoneEngine = zone_engine()
+    zoneEngine.update([1], [20], [20])
+    zoneEngine.update([1], [20], [20])
+
+    assert zoneEngine.update([1], [np.nan], [np.nan]) == ([], [])
+    assert zoneEngine.update([1], [80], [20]) == ([], [])
+    events, _ = zoneEngine.update([1], [80], [20])
+    assert (1, 1, True) in events
+    events, commands = zoneEngine.update([1], [80], [20])
+    assert events == [(1, 0, False)]
+    assert commands == [(0, False)]
+
+
+def test_zone_stays_on_until_last_subject_exits():
+    zoneEngine = zone_engine(enter_frames=1, exit_frames=1)
+    assert zoneEngine.update([1, 2], [20, 20], [20, 30])[1] == [(0, True)]
+    events, commands = zoneEngine.update([1, 2], [80, 20], [20, 30])
+    assert (1, 0, False) in events
+    assert (0, False) not in commands
+    events, commands = zoneEngine.update([1, 2], [80, 80], [20, 30])
+    assert (0, False) in commands
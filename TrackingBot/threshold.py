@@ -26,26 +26,37 @@ from PyQt5.QtCore import Qt, pyqtSignal, QThread, QObject, QMutex, QMutexLocker
 from PyQt5.QtGui import QImage, QPixmap
 from PyQt5.QtWidgets import QMessageBox
 from datalog import TrackingTimeStamp
+from capture import CaptureThread
+from profiler import profiler
+from seek_index import IndexedCapture
+from proxy import ProxyMap
+from frame_index import frame_time
 import time
 from datetime import timedelta
 
 
 class ThreshVidThread(QThread):
 
-    def __init__(self, default_fps=25):
+    def __init__(self, default_fps=25, frameCache=None):
+        '''
+        :param frameCache: seek_index.FrameCache shared with other players
+        '''
         QThread.__init__(self)
 
         self.mutex = QMutex()
         self.timeSignal = Communicate()
         self.detection = Detection()
-        self.playCapture = cv2.VideoCapture()
+        self.playCapture = IndexedCapture(frameCache)
         self.video_prop = None
+        # frame index of a live recording, slider shows capture time
+        self.frameIndex = None
         self.interpolation_flag = cv2.INTER_AREA
         self.scale_aspect = 'widescreen'
 
         self.roi_canvas = np.zeros((576, 1024), dtype='uint8')
         self.mask_canvas = np.zeros((576, 1024), dtype='uint8')
         self.final_mask = None # combine roi and mask
+        self.scaled_mask = None # final mask resized to proxy frames
         self.stopped = False
         self.fps = default_fps
 
@@ -60,6 +71,10 @@ class ThreshVidThread(QThread):
         self.ROIs = []
         self.Masks = []
 
+        # last decoded frame, re-thresholded in place while playback is paused
+        self.last_frame = None
+        self.last_preview = None
+
     def run(self):
 
         with QMutexLocker(self.mutex):
@@ -79,143 +94,145 @@ class ThreshVidThread(QThread):
             if self.stopped:
                 return
             else:
-                ret, frame = self.playCapture.read()
+                with profiler.span('decode'):
+                    ret, frame = self.playCapture.read()
                 if ret:
 
-                    tic = time.perf_counter()
+                    frame_span = profiler.begin('frame', 'frame')
+
+                    self.last_frame = frame
+                    self.last_preview = None
 
                     # get and update video elapse time
-                    play_elapse = self.playCapture.get(cv2.CAP_PROP_POS_FRAMES) / self.playCapture.get(cv2.CAP_PROP_FPS)
+                    play_elapse = frame_time(self.playCapture, self.frameIndex)
                     self.timeSignal.updateSliderPos.emit(play_elapse)
 
-                    if self.invert_contrast:
-                        # brighter object, darker background
-                        invert_frame = cv2.bitwise_not(frame)
-
-                        if self.apply_roi_flag or self.apply_mask_flag:
-                            # if roi defined, apply the mask
-                            masked_frame = cv2.bitwise_and(invert_frame, invert_frame, mask=self.final_mask)
-
-                            thre_frame = self.detection.thresh_video(masked_frame,
-                                                                     self.block_size,
-                                                                     self.offset)
-
-                            contour_frame, max_detect_cnt,min_detect_cnt = self.detection.detect_contours(frame,
-                                                                              thre_frame,
-                                                                              self.min_contour,
-                                                                              self.max_contour)
-
-                            # scale threshlded frame to match the display window and roi/mask canvas
-                            scaled_frame = self.scale_frame(contour_frame, self.interpolation_flag, self.scale_aspect)
-
-                            # convert to QImage
-                            display_frame = self.convert_frame(scaled_frame)
-                            preview_frame = self.convert_preview_frame(thre_frame)
-
-                            # connected to MainWindow.displayThresholdVideo
-                            self.timeSignal.thresh_signal.emit(display_frame, preview_frame)  # QPixmap
-
-                            self.timeSignal.detect_cnt.emit(max_detect_cnt, min_detect_cnt)
-
-                            time.sleep(1 / self.fps)
-
-                        elif not self.apply_roi_flag and not self.apply_mask_flag:
-
-                            thre_frame = self.detection.thresh_video(invert_frame,
-                                                                     self.block_size,
-                                                                     self.offset)
-
-                            contour_frame, max_detect_cnt,min_detect_cnt = self.detection.detect_contours(frame,
-                                                                              thre_frame,
-                                                                              self.min_contour,
-                                                                              self.max_contour)
+                    # brighter object, darker background
+                    detect_frame = cv2.bitwise_not(frame) if self.invert_contrast else frame
 
-                            # scale threshlded frame to match the display window and roi/mask canvas
-                            scaled_frame = self.scale_frame(contour_frame, self.interpolation_flag, self.scale_aspect)
+                    if self.apply_roi_flag or self.apply_mask_flag:
+                        # if roi defined, apply the mask
+                        detect_frame = cv2.bitwise_and(detect_frame, detect_frame, mask=self.frame_mask(frame))
 
-                            # convert to QImage
-                            display_frame = self.convert_frame(scaled_frame)
-                            preview_frame = self.convert_preview_frame(thre_frame)
+                    # settings are in source video pixels, frames of a proxy are smaller
+                    frameMap = ProxyMap.from_frame(self.video_prop, frame)
+                    thre_frame = self.detection.thresh_video(detect_frame,
+                                                             frameMap.block_size_to_frame(self.block_size),
+                                                             self.offset)
 
-                            # connected to MainWindow.displayThresholdVideo
-                            self.timeSignal.thresh_signal.emit(display_frame, preview_frame)  # QPixmap
+                    self.show_threshold(frame, thre_frame, frameMap)
 
-                            self.timeSignal.detect_cnt.emit(max_detect_cnt, min_detect_cnt)
+                    # playback pacing is not part of frame processing time
+                    profiler.end(frame_span)
 
-                            time.sleep(1 / self.fps)
+                    time.sleep(1 / self.fps)
 
-                    elif not self.invert_contrast:
+                elif not ret:
+                    # video finished
+                    # connected to MainWindow.resetVideo
+                    self.timeSignal.thresh_reset.emit('1')
 
-                        if self.apply_roi_flag or self.apply_mask_flag:
-                            # if roi defined, apply the mask
-                            masked_frame = cv2.bitwise_and(frame, frame, mask=self.final_mask)
+                    return
 
-                            thre_frame = self.detection.thresh_video(masked_frame,
-                                                                     self.block_size,
-                                                                     self.offset)
+    def stop(self):
+        with QMutexLocker(self.mutex):
+            self.stopped = True
 
-                            contour_frame, max_detect_cnt,min_detect_cnt = self.detection.detect_contours(frame,
-                                                                              thre_frame,
-                                                                              self.min_contour,
-                                                                              self.max_contour)
+    def is_stopped(self):
+        with QMutexLocker(self.mutex):
+            return self.stopped
 
-                            # scale threshlded frame to match the display window and roi/mask canvas
-                            scaled_frame = self.scale_frame(contour_frame, self.interpolation_flag, self.scale_aspect)
+    def set_fps(self, video_fps):
+        self.fps = video_fps
 
-                            # convert to QImage
-                            display_frame = self.convert_frame(scaled_frame)
-                            preview_frame = self.convert_preview_frame(thre_frame)
+    def frame_mask(self, frame):
+        '''
+        final mask is created at source video size, resize it when frames come from a proxy
+        '''
+        if self.final_mask is None or self.final_mask.shape[:2] == frame.shape[:2]:
+            return self.final_mask
 
-                            # connected to MainWindow.displayThresholdVideo
-                            self.timeSignal.thresh_signal.emit(display_frame, preview_frame)  # QPixmap
+        key = (id(self.final_mask), frame.shape[:2])
+        if self.scaled_mask is None or self.scaled_mask[0] != key:
+            self.scaled_mask = (key, cv2.resize(self.final_mask, (frame.shape[1], frame.shape[0]),
+                                                interpolation=cv2.INTER_NEAREST))
+        return self.scaled_mask[1]
 
-                            self.timeSignal.detect_cnt.emit(max_detect_cnt, min_detect_cnt)
+    def show_threshold(self, frame, thre_frame, frameMap):
+        '''
+        filter contours of thresholded frame and send result to display
+        :param frameMap: ProxyMap from source video to frame, contour areas are shown in source pixels
+        '''
+        contour_frame, max_detect_cnt, min_detect_cnt = self.detection.detect_contours(frame,
+                                                              thre_frame,
+                                                              frameMap.area_to_frame(self.min_contour),
+                                                              frameMap.area_to_frame(self.max_contour))
 
-                            time.sleep(1 / self.fps)
+        # scale threshlded frame to match the display window and roi/mask canvas
+        scaled_frame = self.scale_frame(contour_frame, self.interpolation_flag, self.scale_aspect)
 
-                        if not self.apply_roi_flag and not self.apply_mask_flag:
+        # convert to QImage
+        display_frame = self.convert_frame(scaled_frame)
+        preview_frame = self.convert_preview_frame(thre_frame)
 
-                            thre_frame = self.detection.thresh_video(frame,
-                                                                     self.block_size,
-                                                                     self.offset)
+        # connected to MainWindow.displayThresholdVideo
+        self.timeSignal.thresh_signal.emit(display_frame, preview_frame)  # QPixmap
 
-                            contour_frame, max_detect_cnt,min_detect_cnt = self.detection.detect_contours(frame,
-                                                                              thre_frame,
-                                                                              self.min_contour,
-                                                                              self.max_contour)
+        self.timeSignal.detect_cnt.emit(frameMap.area_to_source(max_detect_cnt),
+                                        frameMap.area_to_source(min_detect_cnt))
 
-                            # scale threshlded frame to match the display window and roi/mask canvas
-                            scaled_frame = self.scale_frame(contour_frame, self.interpolation_flag, self.scale_aspect)
+    def preview_source(self):
+        '''
+        shrink the last decoded frame to display size and cache its blurred grayscale version,
+        the cache is kept until the next frame is decoded or contrast/mask setting changes
+        :return: frame for drawing contours, blurred grayscale frame, ProxyMap from source video to frame
+        '''
 
-                            # convert to QImage
-                            display_frame = self.convert_frame(scaled_frame)
-                            preview_frame = self.convert_preview_frame(thre_frame)
+        key = (self.invert_contrast, self.apply_roi_flag or self.apply_mask_flag, id(self.final_mask))
+        if self.last_preview is not None and self.last_preview[0] == key:
+            return self.last_preview[1:]
 
-                            # connected to MainWindow.displayThresholdVideo
-                            self.timeSignal.thresh_signal.emit(display_frame, preview_frame)  # QPixmap
+        frame = self.last_frame
+        detect_frame = cv2.bitwise_not(frame) if self.invert_contrast else frame
+        if self.apply_roi_flag or self.apply_mask_flag:
+            detect_frame = cv2.bitwise_and(detect_frame, detect_frame, mask=self.frame_mask(frame))
 
-                            self.timeSignal.detect_cnt.emit(max_detect_cnt, min_detect_cnt)
+        display_width = 768 if self.scale_aspect == 'classic' else 1024
+        if frame.shape[1] > display_width:
+            # only shrink, a smaller video or proxy is already cheap to threshold
+            frame = cv2.resize(frame, (display_width, 576), interpolation=cv2.INTER_AREA)
+            detect_frame = cv2.resize(detect_frame, (display_width, 576), interpolation=cv2.INTER_AREA)
 
-                            time.sleep(1 / self.fps)
+        gray_frame = self.detection.blur_gray(detect_frame)
+        self.last_preview = (key, frame, gray_frame, ProxyMap.from_frame(self.video_prop, frame))
 
-                elif not ret:
-                    # video finished
-                    # connected to MainWindow.resetVideo
-                    self.timeSignal.thresh_reset.emit('1')
+        return self.last_preview[1:]
 
-                    return
+    def refresh_frame(self, frame=None):
+        '''
+        re-run only threshold and contour stages on the last decoded frame,
+        so parameter changes show up while video is paused without decoding new frames.
+        block size and contour area limits are scaled with the preview resolution
+        :param frame: replace last decoded frame, e.g. when scrubbing or stepping paused video
+        :return: False if no frame has been decoded yet
+        '''
 
-    def stop(self):
-        with QMutexLocker(self.mutex):
-            self.stopped = True
+        if frame is not None:
+            self.last_frame = frame
+            self.last_preview = None
+        if self.last_frame is None:
+            return False
 
-    def is_stopped(self):
-        with QMutexLocker(self.mutex):
-            return self.stopped
+        with profiler.span('refresh'):
+            frame, gray_frame, frameMap = self.preview_source()
+            thre_frame = self.detection.thresh_gray(gray_frame,
+                                                    frameMap.block_size_to_frame(self.block_size),
+                                                    self.offset)
+            self.show_threshold(frame, thre_frame, frameMap)
 
-    def set_fps(self, video_fps):
-        self.fps = video_fps
+        return True
 
+    @profiler.traced()
     def scale_frame(self, frame, interpolation, aspect):
         '''
         scale video frame to display window size
@@ -233,6 +250,7 @@ class ThreshVidThread(QThread):
 
         return scaled_img
 
+    @profiler.traced()
     def convert_frame(self, frame):
         '''
         convert frame to QImage
@@ -246,6 +264,7 @@ class ThreshVidThread(QThread):
         frame_display = QPixmap.fromImage(frame_cvt)
         return frame_display
 
+    @profiler.traced()
     def convert_preview_frame(self, frame):
         '''
         convert frame to QImage
@@ -352,6 +371,8 @@ class ThreshCamThread(QThread):
         self.trackingTimeStamp = TrackingTimeStamp()
         self.cam_prop = None
         self.video_elapse = 0
+        # preview only needs the newest frame
+        self.captureThread = CaptureThread(mode='latest')
 
         self.block_size = 11
         self.offset = 11
@@ -368,7 +389,8 @@ class ThreshCamThread(QThread):
         with QMutexLocker(self.mutex):
             self.stopped = False
         try:
-            self.cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
+            # frames are grabbed in CaptureThread
+            self.captureThread.start()
 
         except Exception as e:
             error = str(e)
@@ -395,10 +417,11 @@ class ThreshCamThread(QThread):
 
         while True:
             if self.stopped:
-                self.cap.release()
+                self.captureThread.stop()
+                self.captureThread.wait()
                 return
             else:
-                ret, frame = self.cap.read()
+                ret, frame = self.captureThread.read()
                 if ret:
 
                     # get current date and time
@@ -406,7 +429,7 @@ class ThreshCamThread(QThread):
                     self.timeSignal.update_clock.emit(clock_time)
 
                     # absolute time elapsed after start capturing
-                    end_delta = time.perf_counter()
+                    end_delta = self.captureThread.capture_time
                     # elapse_delta = timedelta(seconds=end_delta - start_delta).total_seconds()
                     elapse_delta = timedelta(milliseconds=(end_delta - start_delta) * 1000)
 
@@ -463,6 +486,8 @@ class ThreshCamThread(QThread):
 
 
                 elif not ret:
+                    self.captureThread.stop()
+                    self.captureThread.wait()
                     # call reloadCamera() to try reload camera
                     self.timeSignal.cam_reload.emit('1')
                     self.error_msg = QMessageBox()
@@ -485,6 +510,7 @@ class ThreshCamThread(QThread):
     def set_fps(self, video_fps):
         self.fps = video_fps
 
+    @profiler.traced()
     def scale_frame(self, frame, interpolation, aspect):
         '''
         scale video frame to display window size
@@ -502,6 +528,7 @@ class ThreshCamThread(QThread):
 
         return scaled_img
 
+    @profiler.traced()
     def convert_frame(self, frame):
         '''
         convert frame to QImage
@@ -515,6 +542,7 @@ class ThreshCamThread(QThread):
         frame_display = QPixmap.fromImage(frame_cvt)
         return frame_display
 
+    @profiler.traced()
     def convert_preview_frame(self, frame):
         '''
         convert frame to QImage
@@ -538,6 +566,7 @@ class Detection():
     def __init__(self):
         super().__init__()
 
+    @profiler.traced()
     def thresh_video(self, vid, block_size, offset):
         """
         This function retrieves a video frame and preprocesses it for object tracking.
@@ -551,9 +580,30 @@ class Detection():
         block_size: int(optional), default = blocksize_ini
         offset: int(optional), default = offset_ini
         """
+        vid_gray = self.blur_gray(vid)
+
+        return self.thresh_gray(vid_gray, block_size, offset)
+
+    def blur_gray(self, vid):
+        '''
+        blur frame to reduce noise and convert it to greyscale
+        :param vid: source image containing all three colour channels
+        :return:
+        '''
+
         vid = cv2.GaussianBlur(vid, (5, 5), 1)
         # vid = cv2.blur(vid, (5, 5))
-        vid_gray = cv2.cvtColor(vid, cv2.COLOR_BGR2GRAY)
+        return cv2.cvtColor(vid, cv2.COLOR_BGR2GRAY)
+
+    def thresh_gray(self, vid_gray, block_size, offset):
+        '''
+        adaptive threshold a blurred greyscale frame and close small holes inside objects
+        :param vid_gray: output of blur_gray()
+        :param block_size:
+        :param offset:
+        :return:
+        '''
+
         vid_th = cv2.adaptiveThreshold(vid_gray,
                                        255,
                                        cv2.ADAPTIVE_THRESH_MEAN_C,
@@ -568,6 +618,7 @@ class Detection():
         return vid_closing
 
 
+    @profiler.traced()
     def detect_contours(self, vid, vid_th, cnt_min, cnt_max):
         """
         vid : original video source for drawing and visualize contours
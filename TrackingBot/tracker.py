@@ -19,13 +19,38 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
 import numpy as np
 import cv2
 from PyQt5.QtCore import pyqtSignal, QObject
 from PyQt5.QtWidgets import QMessageBox
 from kalman import KalmanFilter
+from profiler import profiler
 from scipy.optimize import linear_sum_assignment
 
+# identification settings of TrackingMethod, std_meas is used for both x and y
+DEFAULT_SETTINGS = {'dist_thresh': 15, 'max_lost_frames': 60, 'max_trace_len': 600,
+                    'std_acc': 1, 'std_meas': 0.1}
+
+
+def load_settings(settings_path):
+    '''
+    read tracker settings json, e.g. written by sweep.py --settings
+    :return: dict of DEFAULT_SETTINGS updated with values of the file, other keys are ignored
+    '''
+    with open(settings_path) as f:
+        values = json.load(f)
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update({key: values[key] for key in DEFAULT_SETTINGS if key in values})
+    settings['max_lost_frames'] = int(settings['max_lost_frames'])
+    settings['max_trace_len'] = int(settings['max_trace_len'])
+    return settings
+
+
+def save_settings(settings_path, settings):
+    with open(settings_path, 'w') as f:
+        json.dump({key: settings[key] for key in DEFAULT_SETTINGS}, f, indent=2)
+
 
 class Candidate(object):
     """This class register properties of every detected centroids(object)
@@ -33,19 +58,21 @@ class Candidate(object):
         None
     """
 
-    def __init__(self, pos_prediction, candidate_size, candidate_index, candidate_id, lost_sample):
+    def __init__(self, pos_prediction, candidate_size, candidate_index, candidate_id, lost_sample,
+                 kalman_params=(1, 1, 1, 1, 0.1, 0.1)):
         """Initialize variables used by TrackList class
         Args:
             candidate_size: candidate contour size
             candidate_index:total count of candidate been detected, including expired candidate
             candidate_id: the assigned object id, associated with identity
             lost_sample:flag if sample is lost
+            kalman_params: arguments of KalmanFilter (dt, u_x, u_y, std_acc, x_std_meas, y_std_meas)
         Return:
             None
         """
 
         # Apply Kalman filter
-        self.KF = KalmanFilter(1, 1, 1, 1, 0.1, 0.1)
+        self.KF = KalmanFilter(*kalman_params)
         # Convert the input to an array.
         # predicted centroids (x,y)
         self.pos_prediction = np.asarray(pos_prediction)
@@ -65,7 +92,8 @@ class TrackingMethod(object):
         None
     """
 
-    def __init__(self, obj_num, dist_thresh, max_lost_frames, max_trace_len):
+    def __init__(self, obj_num, dist_thresh, max_lost_frames, max_trace_len,
+                 std_acc=1, x_std_meas=0.1, y_std_meas=0.1):
         """Initialize variable used by Tracker class
         Args:
              obj_num: number of objects in video
@@ -77,6 +105,9 @@ class TrackingMethod(object):
                                    the track object being undetected
                                    as the threshold to un_assign (delete) the object
             max_trace_len: trace path history length
+            std_acc: process noise magnitude of Kalman filter
+            x_std_meas: measurement noise of Kalman filter in x-direction
+            y_std_meas: measurement noise of Kalman filter in y-direction
         Return:
             None
         """
@@ -88,6 +119,8 @@ class TrackingMethod(object):
         self.dist_thresh = dist_thresh
         self.max_lost_frames = max_lost_frames
         self.max_trace_len = max_trace_len
+        # Kalman filter of each registered object
+        self.kalman_params = (1, 1, 1, std_acc, x_std_meas, y_std_meas)
         # an array to hold registered centroids(objects)
         self.candidate_list = []
         # init candidate index and occupy 0, so that first id index will be 1
@@ -100,6 +133,16 @@ class TrackingMethod(object):
         # first frame out of index alarm
         self.timeSignal = Communicate()
 
+    @classmethod
+    def from_settings(cls, obj_num, settings=None):
+        '''
+        :param settings: dict like DEFAULT_SETTINGS, defaults if None
+        '''
+        settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        return cls(obj_num, settings['dist_thresh'], settings['max_lost_frames'], settings['max_trace_len'],
+                   std_acc=settings['std_acc'], x_std_meas=settings['std_meas'], y_std_meas=settings['std_meas'])
+
+    @profiler.traced()
     def identify(self, entrant, cnt_min, cnt_max):
         '''
         Create registration array if no centroids(object) found
@@ -126,7 +169,8 @@ class TrackingMethod(object):
                         self.candidate_index += 1
                         self.candidate_id += 1
                         object = Candidate(entrant[i].pos_detected, entrant[i].cnt_area,
-                                           self.candidate_index, self.candidate_id, lost_sample=False)
+                                           self.candidate_index, self.candidate_id, lost_sample=False,
+                                           kalman_params=self.kalman_params)
                         # a list of objects(centroids) that detected
                         self.candidate_list.append(object)
                     else:
@@ -141,11 +185,12 @@ class TrackingMethod(object):
                     # mandate C = E when pick up
                     if self.candidate_index < self.obj_num:
                         try:
-                            id = self.expired_id.pop()
+                            id = self.next_candidate_id()
                             self.candidate_id = id
                             self.candidate_index += 1
                             object = Candidate(entrant[i].pos_detected, entrant[i].cnt_area,
-                                               self.candidate_index, self.candidate_id, lost_sample=False)
+                                               self.candidate_index, self.candidate_id, lost_sample=False,
+                                               kalman_params=self.kalman_params)
                             self.candidate_list.append(object)
                         except Exception as e:
                             error = str(e)
@@ -288,12 +333,13 @@ class TrackingMethod(object):
                     if self.candidate_index < self.obj_num:
                         # need further test for robustness when 2 or more missing being reassigned
                         try:
-                            id = self.expired_id.pop()
+                            id = self.next_candidate_id()
                             # inherit id
                             self.candidate_id = id
                             self.candidate_index += 1
                             object = Candidate(entrant[j].pos_detected, entrant[j].cnt_area,
-                                               self.candidate_index, self.candidate_id, lost_sample=False)
+                                               self.candidate_index, self.candidate_id, lost_sample=False,
+                                               kalman_params=self.kalman_params)
                             self.candidate_list.append(object)
                         except Exception as e:
                             error = str(e)
@@ -342,6 +388,16 @@ class TrackingMethod(object):
 
                 self.candidate_list[i].KF.previousState = self.candidate_list[i].pos_prediction
 
+    def next_candidate_id(self):
+        '''
+        inherit id of an expired candidate, otherwise take a new id,
+        e.g. a subject not detected in the first frame appears later
+        '''
+        if self.expired_id:
+            return self.expired_id.pop()
+        return max([candidate.candidate_id for candidate in self.candidate_list], default=0) + 1
+
+    @profiler.traced()
     def visualize(self, video, is_centroid = True, is_mark = True,
                   is_trajectory=True):
         """visualize the indentity of tracked objects with marks and trajectories
@@ -367,13 +423,13 @@ class TrackingMethod(object):
                 if is_centroid:
                     # display centroid
                     cv2.circle(video,
-                               tuple([int(x) for x in self.candidate_list[i].pos_prediction]),
+                               tuple([int(x[0]) for x in self.candidate_list[i].pos_prediction]),
                                1, (41, 255, 255), -1, cv2.LINE_AA)
                 if is_mark:
                     # display id mark
                     cv2.putText(video,
                                 str(self.candidate_list[i].candidate_id),
-                                tuple([int(x) for x in self.candidate_list[i].pos_prediction]),
+                                tuple([int(x[0]) for x in self.candidate_list[i].pos_prediction]),
                                 cv2.FONT_HERSHEY_DUPLEX, 1, (0, 0, 255), 2)
 
                 if is_trajectory:
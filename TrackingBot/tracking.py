@@ -25,8 +25,11 @@ import time
 from PyQt5.QtCore import Qt, pyqtSignal, QThread, QObject, QMutex, QMutexLocker
 from PyQt5.QtGui import QImage, QPixmap
 from PyQt5.QtWidgets import QMessageBox
-from tracker import TrackingMethod
+from tracker import TrackingMethod, DEFAULT_SETTINGS
 from datalog import TrackingTimeStamp
+from capture import CaptureThread
+from profiler import profiler
+from frame_index import frame_time, position_time
 from datetime import datetime, timedelta
 
 
@@ -39,8 +42,7 @@ class TrackingThread(QThread):
         self.timeSignal = Communicate()
         self.mutex = QMutex()
         self.detection = Detection()
-        # obj_num, dist_thresh, max_lost_frames, max_trace_len
-        self.trackingMethod = TrackingMethod(self.obj_num, 15, 60, 600)
+        self.trackingMethod = TrackingMethod.from_settings(self.obj_num, DEFAULT_SETTINGS)
         self.trackingMethod.timeSignal.index_alarm.connect(self.index_alarm)
         self.trackingTimeStamp = TrackingTimeStamp()
         self.playCapture = cv2.VideoCapture()
@@ -68,6 +70,10 @@ class TrackingThread(QThread):
         self.invert_contrast = False
         self.apply_roi_flag = False
         self.apply_mask_flag = False
+        # frame index of live recording, None if video has no sidecar
+        self.frameIndex = None
+        # DetectionCacheWriter storing detections of this run, None to disable
+        self.detectionCache = None
 
     def run(self):
 
@@ -84,180 +90,216 @@ class TrackingThread(QThread):
         else:
             self.scale_aspect = 'widescreen'
 
-        while True:
-
-            if self.stopped:
-                return
-            else:
-                ret, frame = self.playCapture.read()
-
-                if ret:
-
-                    tic = time.perf_counter()
-
-                    # current position in milliseconds
-                    pos_elapse = self.playCapture.get(cv2.CAP_PROP_POS_MSEC)
-                    # current position calculated using current frame/fps, used for slider progress
-                    play_elapse = self.playCapture.get(cv2.CAP_PROP_POS_FRAMES) / self.playCapture.get(cv2.CAP_PROP_FPS)
-
-                    self.timeSignal.updateSliderPos.emit(play_elapse)
-
-                    self.frame_count += 1
-
-                    # get time stamp mark and store as thread instance
-                    # then pass to datalog thread when condition met
-                    self.is_timeStamp, self.video_elapse= self.trackingTimeStamp.local_time_stamp(pos_elapse, interval=None)
-
-
-                    if self.invert_contrast:
-                        # brighter object, dark background
-                        invert_frame = cv2.bitwise_not(frame)
-
-                        if self.apply_roi_flag or self.apply_mask_flag:
-                            # if roi defined, apply the mask
-                            masked_frame = cv2.bitwise_and(invert_frame, invert_frame, mask=self.valid_mask)
-
-                            thre_frame = self.detection.thresh_video(masked_frame,
-                                                                     self.block_size,
-                                                                     self.offset)
-
-                            contour_frame, entrant_detected = self.detection.detect_contours(frame,
-                                                                                             thre_frame,
-                                                                                             self.min_contour,
-                                                                                             self.max_contour)
-
-                            self.trackingMethod.identify(entrant_detected, self.min_contour, self.max_contour)
-
-                            # mark indentity of each objects
-                            self.trackingMethod.visualize(contour_frame, is_centroid=True,
-                                                          is_mark=True, is_trajectory=True)
-
-                            # pass tracking data to datalog thread when local tracking
-                            if self.is_timeStamp:
-                                self.timeSignal.track_results.emit(self.trackingMethod.candidate_list,
-                                                                   self.trackingMethod.expired_id,
-                                                                   self.trackingTimeStamp.result_index,
-                                                                   self.video_elapse)
-
-                            # scale threshlded frame to match the display window and roi/mask canvas
-                            scaled_frame = self.scale_frame(contour_frame, self.interpolation_flag,
-                                                            self.scale_aspect)
-                            display_frame = self.convert_frame(scaled_frame)
-
-                            # connected to MainWindow.display_tracking_video
-                            self.timeSignal.tracking_signal.emit(display_frame)  # QPixmap
-
-                        if not self.apply_roi_flag and not self.apply_mask_flag:
-
-                            thre_frame = self.detection.thresh_video(invert_frame,
-                                                                     self.block_size,
-                                                                     self.offset)
-
-                            contour_frame, entrant_detected = self.detection.detect_contours(frame,
-                                                                                             thre_frame,
-                                                                                             self.min_contour,
-                                                                                             self.max_contour)
-
-                            self.trackingMethod.identify(entrant_detected, self.min_contour, self.max_contour)
-
-                            ## mark indentity of each objects
-                            self.trackingMethod.visualize(contour_frame, is_centroid=True,
-                                                          is_mark=True, is_trajectory=True)
+        try:
+            while True:
 
-                            # # # pass tracking data to datalog thread when local tracking
-                            if self.is_timeStamp:
-                                self.timeSignal.track_results.emit(self.trackingMethod.candidate_list,
-                                                                   self.trackingMethod.expired_id,
-                                                                   self.trackingTimeStamp.result_index,
-                                                                   self.video_elapse)
+                if self.stopped:
+                    return
+                else:
+                    with profiler.span('decode'):
+                        ret, frame = self.playCapture.read()
 
-                            # scale threshlded frame to match the display window and roi/mask canvas
-                            scaled_frame = self.scale_frame(contour_frame, self.interpolation_flag,
-                                                            self.scale_aspect)
-                            display_frame = self.convert_frame(scaled_frame)
+                    if ret:
 
-                            # connected to MainWindow.display_tracking_video
-                            self.timeSignal.tracking_signal.emit(display_frame)  # QPixmap
+                        frame_span = profiler.begin('frame', 'frame')
 
-                    elif not self.invert_contrast:
+                        if self.frameIndex is not None:
+                            # exact capture time of live recording in milliseconds
+                            pos_frame = self.playCapture.get(cv2.CAP_PROP_POS_FRAMES) - 1
+                            pos_elapse = round(self.frameIndex.elapse(pos_frame) * 1000, 3)
+                        else:
+                            # current position in milliseconds
+                            pos_elapse = self.playCapture.get(cv2.CAP_PROP_POS_MSEC)
+                        # slider progress, same time base as seek_time()
+                        play_elapse = frame_time(self.playCapture, self.frameIndex)
 
-                        if self.apply_roi_flag or self.apply_mask_flag:
-                            # if roi defined, apply the mask
-                            masked_frame = cv2.bitwise_and(frame, frame, mask=self.valid_mask)
+                        self.timeSignal.updateSliderPos.emit(play_elapse)
 
-                            thre_frame = self.detection.thresh_video(masked_frame,
-                                                                     self.block_size,
-                                                                     self.offset)
+                        self.frame_count += 1
 
-                            contour_frame, entrant_detected = self.detection.detect_contours(frame,
-                                                                                             thre_frame,
-                                                                                             self.min_contour,
-                                                                                             self.max_contour)
+                        # get time stamp mark and store as thread instance
+                        # then pass to datalog thread when condition met
+                        self.is_timeStamp, self.video_elapse= self.trackingTimeStamp.local_time_stamp(pos_elapse, interval=None)
 
-                            self.trackingMethod.identify(entrant_detected, self.min_contour, self.max_contour)
 
-                            ## mark indentity of each objects
-                            self.trackingMethod.visualize(contour_frame, is_centroid=True,
-                                                          is_mark=True, is_trajectory=True)
+                        if self.invert_contrast:
+                            # brighter object, dark background
+                            invert_frame = cv2.bitwise_not(frame)
 
-                            # # # pass tracking data to datalog thread when local tracking
-                            if self.is_timeStamp:
-                                self.timeSignal.track_results.emit(self.trackingMethod.candidate_list,
-                                                                   self.trackingMethod.expired_id,
-                                                                   self.trackingTimeStamp.result_index,
-                                                                   self.video_elapse)
+                            if self.apply_roi_flag or self.apply_mask_flag:
+                                # if roi defined, apply the mask
+                                masked_frame = cv2.bitwise_and(invert_frame, invert_frame, mask=self.valid_mask)
 
-                            # scale threshold frame to match the display window and roi/mask canvas
-                            scaled_frame = self.scale_frame(contour_frame, self.interpolation_flag,
-                                                            self.scale_aspect)
-                            display_frame = self.convert_frame(scaled_frame)
+                                thre_frame = self.detection.thresh_video(masked_frame,
+                                                                         self.block_size,
+                                                                         self.offset)
 
-                            # connected to MainWindow.display_tracking_video
-                            self.timeSignal.tracking_signal.emit(display_frame)  # QPixmap
+                                contour_frame, entrant_detected = self.detection.detect_contours(frame,
+                                                                                                 thre_frame,
+                                                                                                 self.min_contour,
+                                                                                                 self.max_contour)
 
-                        if not self.apply_roi_flag and not self.apply_mask_flag:
+                                self.trackingMethod.identify(entrant_detected, self.min_contour, self.max_contour)
 
-                            thre_frame = self.detection.thresh_video(frame,
-                                                                     self.block_size,
-                                                                     self.offset)
+                                # mark indentity of each objects
+                                self.trackingMethod.visualize(contour_frame, is_centroid=True,
+                                                              is_mark=True, is_trajectory=True)
 
-                            contour_frame, entrant_detected = self.detection.detect_contours(frame,
-                                                                                             thre_frame,
-                                                                                             self.min_contour,
-                                                                                             self.max_contour)
+                                # pass tracking data to datalog thread when local tracking
+                                if self.is_timeStamp:
+                                    self.timeSignal.track_results.emit(self.trackingMethod.candidate_list,
+                                                                       self.trackingMethod.expired_id,
+                                                                       self.trackingTimeStamp.result_index,
+                                                                       self.video_elapse)
 
-                            self.trackingMethod.identify(entrant_detected, self.min_contour, self.max_contour)
+                                # scale threshlded frame to match the display window and roi/mask canvas
+                                scaled_frame = self.scale_frame(contour_frame, self.interpolation_flag,
+                                                                self.scale_aspect)
+                                display_frame = self.convert_frame(scaled_frame)
 
-                            # mark indentity of each objects
-                            self.trackingMethod.visualize(contour_frame, is_centroid=True,
-                                                          is_mark=True, is_trajectory=True)
+                                # connected to MainWindow.display_tracking_video
+                                self.timeSignal.tracking_signal.emit(display_frame)  # QPixmap
 
-                            # pass tracking data to datalog thread when local tracking
-                            if self.is_timeStamp:
-                                self.timeSignal.track_results.emit(self.trackingMethod.candidate_list,
-                                                                   self.trackingMethod.expired_id,
-                                                                   self.trackingTimeStamp.result_index,
-                                                                   self.video_elapse)
+                            if not self.apply_roi_flag and not self.apply_mask_flag:
 
-                            # scale threshlded frame to match the display window and roi/mask canvas
-                            scaled_frame = self.scale_frame(contour_frame, self.interpolation_flag,
-                                                            self.scale_aspect)
-                            display_frame = self.convert_frame(scaled_frame)
+                                thre_frame = self.detection.thresh_video(invert_frame,
+                                                                         self.block_size,
+                                                                         self.offset)
 
-                            # connected to MainWindow.display_tracking_video
-                            self.timeSignal.tracking_signal.emit(display_frame)  # QPixmap
+                                contour_frame, entrant_detected = self.detection.detect_contours(frame,
+                                                                                                 thre_frame,
+                                                                                                 self.min_contour,
+                                                                                                 self.max_contour)
 
-                    toc = time.perf_counter()
+                                self.trackingMethod.identify(entrant_detected, self.min_contour, self.max_contour)
 
-                elif not ret:
-                    # video finished
-                    self.timeSignal.track_reset_alarm.emit('1')  # complete_tracking()
-                    self.timeSignal.track_reset.emit('1')  # reset video()
-                    self.frame_count = -1
-                    self.trackingTimeStamp.result_index = -1
-                    self.video_elapse = 0
-                    self.is_timeStamp = False
-                    return
+                                ## mark indentity of each objects
+                                self.trackingMethod.visualize(contour_frame, is_centroid=True,
+                                                              is_mark=True, is_trajectory=True)
+
+                                # # # pass tracking data to datalog thread when local tracking
+                                if self.is_timeStamp:
+                                    self.timeSignal.track_results.emit(self.trackingMethod.candidate_list,
+                                                                       self.trackingMethod.expired_id,
+                                                                       self.trackingTimeStamp.result_index,
+                                                                       self.video_elapse)
+
+                                # scale threshlded frame to match the display window and roi/mask canvas
+                                scaled_frame = self.scale_frame(contour_frame, self.interpolation_flag,
+                                                                self.scale_aspect)
+                                display_frame = self.convert_frame(scaled_frame)
+
+                                # connected to MainWindow.display_tracking_video
+                                self.timeSignal.tracking_signal.emit(display_frame)  # QPixmap
+
+                        elif not self.invert_contrast:
+
+                            if self.apply_roi_flag or self.apply_mask_flag:
+                                # if roi defined, apply the mask
+                                masked_frame = cv2.bitwise_and(frame, frame, mask=self.valid_mask)
+
+                                thre_frame = self.detection.thresh_video(masked_frame,
+                                                                         self.block_size,
+                                                                         self.offset)
+
+                                contour_frame, entrant_detected = self.detection.detect_contours(frame,
+                                                                                                 thre_frame,
+                                                                                                 self.min_contour,
+                                                                                                 self.max_contour)
+
+                                self.trackingMethod.identify(entrant_detected, self.min_contour, self.max_contour)
+
+                                ## mark indentity of each objects
+                                self.trackingMethod.visualize(contour_frame, is_centroid=True,
+                                                              is_mark=True, is_trajectory=True)
+
+                                # # # pass tracking data to datalog thread when local tracking
+                                if self.is_timeStamp:
+                                    self.timeSignal.track_results.emit(self.trackingMethod.candidate_list,
+                                                                       self.trackingMethod.expired_id,
+                                                                       self.trackingTimeStamp.result_index,
+                                                                       self.video_elapse)
+
+                                # scale threshold frame to match the display window and roi/mask canvas
+                                scaled_frame = self.scale_frame(contour_frame, self.interpolation_flag,
+                                                                self.scale_aspect)
+                                display_frame = self.convert_frame(scaled_frame)
+
+                                # connected to MainWindow.display_tracking_video
+                                self.timeSignal.tracking_signal.emit(display_frame)  # QPixmap
+
+                            if not self.apply_roi_flag and not self.apply_mask_flag:
+
+                                thre_frame = self.detection.thresh_video(frame,
+                                                                         self.block_size,
+                                                                         self.offset)
+
+                                contour_frame, entrant_detected = self.detection.detect_contours(frame,
+                                                                                                 thre_frame,
+                                                                                                 self.min_contour,
+                                                                                                 self.max_contour)
+
+                                self.trackingMethod.identify(entrant_detected, self.min_contour, self.max_contour)
+
+                                # mark indentity of each objects
+                                self.trackingMethod.visualize(contour_frame, is_centroid=True,
+                                                              is_mark=True, is_trajectory=True)
+
+                                # pass tracking data to datalog thread when local tracking
+                                if self.is_timeStamp:
+                                    self.timeSignal.track_results.emit(self.trackingMethod.candidate_list,
+                                                                       self.trackingMethod.expired_id,
+                                                                       self.trackingTimeStamp.result_index,
+                                                                       self.video_elapse)
+
+                                # scale threshlded frame to match the display window and roi/mask canvas
+                                scaled_frame = self.scale_frame(contour_frame, self.interpolation_flag,
+                                                                self.scale_aspect)
+                                display_frame = self.convert_frame(scaled_frame)
+
+                                # connected to MainWindow.display_tracking_video
+                                self.timeSignal.tracking_signal.emit(display_frame)  # QPixmap
+
+                        if self.detectionCache is not None:
+                            try:
+                                self.detectionCache.write(pos_elapse, entrant_detected)
+                            except OSError as e:
+                                # e.g. disk full, tracking goes on without cache
+                                self.detectionCache.discard()
+                                self.detectionCache = None
+                                self.timeSignal.cache_failed.emit(str(e))
+
+                        profiler.end(frame_span, frame=self.frame_count)
+
+                    elif not ret:
+                        # video finished
+                        if self.detectionCache is not None:
+                            try:
+                                self.detectionCache.close()
+                            except OSError as e:
+                                self.timeSignal.cache_failed.emit(str(e))
+                            self.detectionCache = None
+                        self.timeSignal.track_reset_alarm.emit('1')  # complete_tracking()
+                        self.timeSignal.track_reset.emit('1')  # reset video()
+                        self.frame_count = -1
+                        self.trackingTimeStamp.result_index = -1
+                        self.video_elapse = 0
+                        self.is_timeStamp = False
+                        return
+        finally:
+            # cancelled or failed task leaves no cache entry, completed cache is closed above
+            if self.detectionCache is not None:
+                self.detectionCache.discard()
+                self.detectionCache = None
+
+    def reset_tracker(self, obj_num, settings=None):
+        '''
+        start identification from scratch with given tracker settings
+        :param settings: dict like tracker.DEFAULT_SETTINGS
+        '''
+        self.obj_num = obj_num
+        self.trackingMethod = TrackingMethod.from_settings(obj_num, settings)
+        self.trackingMethod.timeSignal.index_alarm.connect(self.index_alarm)
 
     def stop(self):
         with QMutexLocker(self.mutex):
@@ -266,6 +308,7 @@ class TrackingThread(QThread):
     def set_fps(self, video_fps):
         self.fps = video_fps
 
+    @profiler.traced()
     def scale_frame(self, frame, interpolation, aspect):
         '''
         scale video frame to display window size
@@ -283,6 +326,7 @@ class TrackingThread(QThread):
 
         return scaled_img
 
+    @profiler.traced()
     def convert_frame(self, frame):
         '''
         convert image to QImage
@@ -303,6 +347,87 @@ class TrackingThread(QThread):
         pass
 
 
+def replay_detections(detectionCache, trackingMethod, min_contour, max_contour):
+    '''
+    identify subjects from cached detections, used by RetrackThread and sweep.py
+    :param detectionCache: detection_cache.DetectionCache
+    :param trackingMethod: TrackingMethod, candidate_list holds the result of each frame
+    :return: generator of frame index, yielded after the frame is identified
+    '''
+    for frame_index in range(len(detectionCache)):
+        detections = detectionCache.frame_detections(frame_index)
+        entrant_detected = [EntrantProperty(np.array([[x], [y]]), area) for x, y, area in detections]
+        trackingMethod.identify(entrant_detected, min_contour, max_contour)
+        yield frame_index
+
+
+class RetrackThread(QThread):
+    '''
+    identify subjects from cached detections of a tracked video,
+    no decoding, thresholding or display, so tracker settings can be changed and re-run quickly
+    results are logged by DataLogThread in this thread
+    '''
+
+    def __init__(self):
+        QThread.__init__(self)
+        self.stopped = False
+        self.timeSignal = Communicate()
+        self.mutex = QMutex()
+        self.detectionCache = None
+        self.trackingMethod = TrackingMethod.from_settings(1, DEFAULT_SETTINGS)
+        self.trackingMethod.timeSignal.index_alarm.connect(self.index_alarm)
+        self.trackingTimeStamp = TrackingTimeStamp()
+        self.dataLogThread = None
+        self.min_contour = 1
+        self.max_contour = 100
+        # slider position is updated every n frames
+        self.progress_interval = 250
+        # slider time base of the tracked video
+        self.fps = 25
+        self.frameIndex = None
+
+    def run(self):
+        with QMutexLocker(self.mutex):
+            self.stopped = False
+        self.trackingTimeStamp.result_index = -1
+
+        for frame_index in replay_detections(self.detectionCache, self.trackingMethod,
+                                             self.min_contour, self.max_contour):
+            if self.stopped:
+                return
+
+            pos_elapse = self.detectionCache.elapse(frame_index)
+            _, video_elapse = self.trackingTimeStamp.local_time_stamp(pos_elapse, interval=None)
+
+            # logger appends expired subjects to the list it receives
+            self.dataLogThread.track_results(list(self.trackingMethod.candidate_list),
+                                             list(self.trackingMethod.expired_id),
+                                             self.trackingTimeStamp.result_index,
+                                             video_elapse)
+            self.dataLogThread.run()
+
+            if frame_index % self.progress_interval == 0:
+                self.timeSignal.updateSliderPos.emit(position_time(frame_index, self.fps, self.frameIndex))
+
+        self.timeSignal.track_reset_alarm.emit('1')  # complete_tracking()
+        self.timeSignal.track_reset.emit('1')  # reset video()
+
+    def stop(self):
+        with QMutexLocker(self.mutex):
+            self.stopped = True
+
+    def reset(self, obj_num, settings=None):
+        '''
+        start identification from scratch with given tracker settings
+        :param settings: dict like tracker.DEFAULT_SETTINGS
+        '''
+        self.trackingMethod = TrackingMethod.from_settings(obj_num, settings)
+        self.trackingMethod.timeSignal.index_alarm.connect(self.index_alarm)
+
+    def index_alarm(self):
+        self.timeSignal.exceed_index_alarm.emit('1')
+
+
 class TrackingCamThread(QThread):
 
     def __init__(self):
@@ -314,7 +439,7 @@ class TrackingCamThread(QThread):
         self.mutex = QMutex()
         self.detection = Detection()
         self.obj_num = 1  # default 1
-        self.trackingMethod = TrackingMethod(self.obj_num, 15, 60, 600)
+        self.trackingMethod = TrackingMethod.from_settings(self.obj_num, DEFAULT_SETTINGS)
         self.trackingMethod.timeSignal.index_alarm.connect(self.index_alarm)
         self.trackingTimeStamp = TrackingTimeStamp()
         self.cam_prop = None
@@ -336,13 +461,24 @@ class TrackingCamThread(QThread):
         self.video_elapse = 0
         self.is_timeStamp = False
         self.frame_count = -1  # first frame start from 0
+        # 'latest' keeps detection latency bounded for closed-loop control,
+        # 'every' processes all frames as long as the ring buffer does not overflow
+        self.captureThread = CaptureThread(mode='latest')
+        # recording writer, None for no recording
+        self.videoExportThread = None
+        # closed-loop latency measurement, None to disable
+        self.latencyMonitor = None
+        # draw latency percentiles on displayed frame
+        self.latency_overlay = False
 
     def run(self):
 
         with QMutexLocker(self.mutex):
             self.stopped = False
         try:
-            self.cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
+            # frames are grabbed in CaptureThread, which also feeds the recorder with every frame
+            self.captureThread.recorder = self.videoExportThread
+            self.captureThread.start()
 
         except Exception as e:
             error = str(e)
@@ -365,38 +501,36 @@ class TrackingCamThread(QThread):
         else:
             self.scale_aspect = 'widescreen'
 
-        now = datetime.now()
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        frame_size = (int(self.cam_prop.width), int(self.cam_prop.height))
-        export = cv2.VideoWriter('C:/Users/Public/Videos' + '/TrackingBot recording '
-                                 + now.strftime('%Y-%m-%d-%H%M') + '.mp4', fourcc, self.fps, frame_size, True)
-
         # stream start time
         start_delta = time.perf_counter()
 
         while True:
-            tic = time.perf_counter()
             if self.stopped:
-                self.cap.release()
+                self.captureThread.stop()
+                self.captureThread.wait()
                 return
             else:
-                ret, frame = self.cap.read()
+                with profiler.span('wait frame'):
+                    ret, frame = self.captureThread.read()
                 if ret:
+                    frame_span = profiler.begin('frame', 'frame')
+                    capture_time = self.captureThread.capture_time
+                    wall_time = self.captureThread.wall_time
                     # get current date and time
                     clock_time = self.trackingTimeStamp.update_clock()
                     self.timeSignal.update_clock.emit(clock_time)
 
                     self.frame_count += 1
 
-                    export.write(frame)
-
                     # absolute time elapsed after start capturing
-                    end_delta = time.perf_counter()
+                    end_delta = capture_time
                     # elapse_delta = timedelta(seconds=end_delta - start_delta).total_seconds()
                     elapse_delta = timedelta(milliseconds=(end_delta - start_delta) * 1000)
 
                     self.is_timeStamp, self.video_elapse = self.trackingTimeStamp.liveTimeStamp(elapse_delta,
                                                                                                 interval=None)
+                    if self.latencyMonitor is not None:
+                        self.latencyMonitor.stamp(self.trackingTimeStamp.result_index, 'capture', capture_time)
 
                     self.timeSignal.update_elapse.emit(self.video_elapse)
 
@@ -411,8 +545,12 @@ class TrackingCamThread(QThread):
                                                                                        thre_cam,
                                                                                        self.min_contour,
                                                                                        self.max_contour)
+                        if self.latencyMonitor is not None:
+                            self.latencyMonitor.stamp(self.trackingTimeStamp.result_index, 'detection')
 
                         self.trackingMethod.identify(entrant_detected, self.min_contour, self.max_contour)
+                        if self.latencyMonitor is not None:
+                            self.latencyMonitor.stamp(self.trackingTimeStamp.result_index, 'identify')
 
                         ## mark indentity of each objects
                         self.trackingMethod.visualize(contour_cam, is_centroid=True,
@@ -425,6 +563,9 @@ class TrackingCamThread(QThread):
                                                                    self.trackingTimeStamp.result_index,
                                                                    self.video_elapse)
 
+                        if self.latency_overlay and self.latencyMonitor is not None:
+                            self.latencyMonitor.overlay(contour_cam)
+
                         # scale threshlded frame to match the display window and roi/mask canvas
                         scaled_frame = self.scale_frame(contour_cam, self.interpolation_flag,
                                                         self.scale_aspect)
@@ -442,8 +583,12 @@ class TrackingCamThread(QThread):
                                                                                        thre_cam,
                                                                                        self.min_contour,
                                                                                        self.max_contour)
+                        if self.latencyMonitor is not None:
+                            self.latencyMonitor.stamp(self.trackingTimeStamp.result_index, 'detection')
 
                         self.trackingMethod.identify(entrant_detected, self.min_contour, self.max_contour)
+                        if self.latencyMonitor is not None:
+                            self.latencyMonitor.stamp(self.trackingTimeStamp.result_index, 'identify')
 
                         ## mark indentity of each objects
                         self.trackingMethod.visualize(contour_cam, is_centroid=True,
@@ -456,6 +601,9 @@ class TrackingCamThread(QThread):
                                                                    self.trackingTimeStamp.result_index,
                                                                    self.video_elapse)
 
+                        if self.latency_overlay and self.latencyMonitor is not None:
+                            self.latencyMonitor.overlay(contour_cam)
+
                         # scale threshlded frame to match the display window and roi/mask canvas
                         scaled_frame = self.scale_frame(contour_cam, self.interpolation_flag,
                                                         self.scale_aspect)
@@ -464,12 +612,13 @@ class TrackingCamThread(QThread):
                         self.timeSignal.cam_tracking_signal.emit(display_frame)
                         # time.sleep(1/25)
 
-                    toc = time.perf_counter()
+                    profiler.end(frame_span, frame=self.frame_count)
 
                 elif not ret:
                     # call cam_reload
                     self.timeSignal.cam_reload.emit('1')
-                    self.cap.release()
+                    self.captureThread.stop()
+                    self.captureThread.wait()
                     self.frame_count = -1
                     self.trackingTimeStamp.result_index = -1
                     self.video_elapse = 0
@@ -482,6 +631,15 @@ class TrackingCamThread(QThread):
                     self.error_msg.setIcon(QMessageBox.Warning)
                     self.error_msg.exec()
 
+    def reset_tracker(self, obj_num, settings=None):
+        '''
+        start identification from scratch with given tracker settings
+        :param settings: dict like tracker.DEFAULT_SETTINGS
+        '''
+        self.obj_num = obj_num
+        self.trackingMethod = TrackingMethod.from_settings(obj_num, settings)
+        self.trackingMethod.timeSignal.index_alarm.connect(self.index_alarm)
+
     def stop(self):
         with QMutexLocker(self.mutex):
             self.stopped = True
@@ -489,6 +647,7 @@ class TrackingCamThread(QThread):
     def set_fps(self, video_fps):
         self.fps = video_fps
 
+    @profiler.traced()
     def scale_frame(self, frame, interpolation, aspect):
         '''
         scale video frame to display window size
@@ -506,6 +665,7 @@ class TrackingCamThread(QThread):
 
         return scaled_img
 
+    @profiler.traced()
     def convert_frame(self, frame):
         '''
         convert frame to QImage
@@ -535,6 +695,7 @@ class Communicate(QObject):
     cam_tracking_signal = pyqtSignal(QPixmap)
     cam_track_results = pyqtSignal(list,list,int,str)
     cam_reload = pyqtSignal(str)
+    cache_failed = pyqtSignal(str)
 
 
 class Detection():
@@ -546,6 +707,7 @@ class Detection():
         super().__init__()
 
     ## video thresholding
+    @profiler.traced()
     def thresh_video(self, frame, block_size, offset):
         """
         This function retrieves a video frame and preprocesses it for object tracking.
@@ -576,6 +738,37 @@ class Detection():
 
         return morph_frame
 
+    @staticmethod
+    def find_contours(thresh_frame):
+        '''
+        contours of foreground blobs, the outline of ROI or mask shape is excluded
+        :param thresh_frame: the frame after threshold
+        :return: list of contours and list of their areas
+        '''
+        contours, hierarchy = cv2.findContours(thresh_frame.copy(), cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+        # From openCV 4.5.4, contours are returned as tuples instead of list
+        contours = list(contours)
+
+        # contours from mask item that need to be excluded
+        mask_cnt = []
+
+        for cnt in range(len(contours)):
+            # conditions to find inner cnt of mask shape
+            # hierarchy[0,i,0] == -1 and hierarchy[0,i,1] == -1 and hierarchy[0,i,2] == -1 and
+            if hierarchy[0, cnt, 3] != -1 and hierarchy[0, cnt, 1] == -1:
+                mask_cnt.append(cnt)
+
+        # exclude contours that belong to mask shape
+        for cnt in sorted(mask_cnt, reverse=True):
+            del contours[cnt]  # inner cnt
+            del contours[cnt - 1]  # outer cnt, parent of inner cnt
+
+        # compute areas of all contours after exclude the mask contours
+        cnt_area_list = [cv2.contourArea(contour) for contour in contours]
+
+        return contours, cnt_area_list
+
+    @profiler.traced()
     def detect_contours(self, frame, thresh_frame, cnt_min, cnt_max):
 
         """
@@ -592,43 +785,13 @@ class Detection():
             (  [[x0],[y0]]  ,  [[x1],[y1]]  , [[x2],[y2]] .....)
         """
 
-        contours, hierarchy = cv2.findContours(thresh_frame.copy(), cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
-        # From openCV 4.5.4, contours are returned as tuples instead of list
-        contours = list(contours)
+        contours, cnt_area_list = self.find_contours(thresh_frame)
 
         contour_frame = frame.copy()
 
         # list of detected centroids
         entrant_detection = []
 
-        # list of area of contours
-        cnt_area_list = []
-
-        # contours from mask item that need to be excluded
-        mask_cnt = []
-        # when  object contour intersect with two mask contours simutaneously
-        # a h1 contour can have 2 child that both in h2 level
-        mask_cnt_sibling = []
-
-        for cnt in range(len(contours)):
-            # conditions to find inner cnt of mask shape
-            # hierarchy[0,i,0] == -1 and hierarchy[0,i,1] == -1 and hierarchy[0,i,2] == -1 and
-            if hierarchy[0, cnt, 3] != -1 and hierarchy[0, cnt, 1] == -1:
-                mask_cnt.append(cnt)
-
-            if hierarchy[0, cnt, 3] != -1 and hierarchy[0, cnt, 1] != -1:
-                mask_cnt_sibling.append(cnt)
-
-        # exclude contours that belong to mask shape
-        for cnt in sorted(mask_cnt, reverse=True):
-            del contours[cnt]  # inner cnt
-            del contours[cnt - 1]  # outer cnt, parent of inner cnt
-
-        # compute areas of all contours after exclude the mask contours
-        for cnt in range(len(contours)):
-            cnt_area = cv2.contourArea(contours[cnt])
-            cnt_area_list.append(cnt_area)
-
         for i in sorted(range(len(cnt_area_list)), reverse=True):
             if cnt_area_list[i] < cnt_min or cnt_area_list[i] > cnt_max:
                 del contours[i]
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import threading
+import serial
+from serial_channel import PacketParser, encode_packet, CMD_SET, ACK_FLAG, GATE_CHANNEL
+
+# port name of the in-process fake Arduino
+LOOPBACK_PORT = 'loop://fake-arduino'
+
+# phases of the gate motor, same as MotorPhase of the firmware
+MOTOR_IDLE = 0
+MOTOR_RUNNING = 1
+MOTOR_RESTING = 2
+
+
+class FakeArduino(object):
+    '''
+    emulate the T-maze firmware: LEDs on channel 0-5, gate motor on channel 6,
+    ACK of every valid packet, and record receive time of every command
+    '''
+
+    def __init__(self, baudrate=19200, motor_run_time=1.5, motor_rest_time=1.0):
+        '''
+        :param baudrate: simulated line speed, 0 for no transmission delay
+        :param motor_run_time: seconds the gate motor runs for one action
+        :param motor_rest_time: seconds the gate motor rests before next action
+        '''
+        self.baudrate = baudrate
+        self.motor_run_time = motor_run_time
+        self.motor_rest_time = motor_rest_time
+        self.parser = PacketParser()
+        # reentrant, motor is advanced while a packet is handled
+        self.lock = threading.RLock()
+
+        self.leds = [0] * 6
+        # motionState and targetState of the firmware, the gate state changes when a run is completed
+        self.gate_state = False
+        self.gate_target = False
+        self.motor_phase = MOTOR_IDLE
+        self.motor_phase_start = 0
+        # (time, gate state) when each run is completed
+        self.gate_log = []
+        # (time received, seq, channel, value) of every command
+        self.log = []
+        # bytes sent back to host
+        self.output = bytearray()
+
+    def byte_time(self, size):
+        '''
+        seconds needed to transmit bytes, 10 bits per byte with start and stop bit
+        '''
+        return size * 10 / self.baudrate if self.baudrate else 0
+
+    def receive(self, data, sent_time=None):
+        '''
+        feed bytes written by host
+        :return: bytes of reply
+        '''
+        if sent_time is None:
+            sent_time = time.perf_counter()
+        received_time = sent_time + self.byte_time(len(data))
+
+        reply = bytearray()
+        with self.lock:
+            for cmd, seq, payload in self.parser.feed(data):
+                if cmd == CMD_SET:
+                    for i in range(0, len(payload) - 1, 2):
+                        self.set_channel(payload[i], payload[i + 1], received_time)
+                        self.log.append((received_time, seq, payload[i], payload[i + 1]))
+                reply.extend(encode_packet(cmd | ACK_FLAG, seq))
+            self.output.extend(reply)
+        return bytes(reply)
+
+    def set_channel(self, channel, value, received_time):
+        if channel < len(self.leds):
+            self.leds[channel] = 1 if value else 0
+        elif channel == GATE_CHANNEL:
+            # phases due before the command are completed with the previous target
+            self.update_motor(received_time)
+            self.gate_target = bool(value)
+            self.update_motor(received_time)
+
+    def update_motor(self, now=None):
+        '''
+        advance the motor state machine of firmware updateMotor() to now,
+        the firmware polls millis() continuously, so each phase ends exactly when its time is up
+        '''
+        if now is None:
+            now = time.perf_counter()
+        with self.lock:
+            # an idle motor starts when the target is set, or right after a rest that ends before now
+            rested = False
+            while True:
+                if self.motor_phase == MOTOR_IDLE:
+                    if self.gate_target == self.gate_state:
+                        return
+                    self.motor_phase = MOTOR_RUNNING
+                    if not rested:
+                        self.motor_phase_start = max(now, self.motor_phase_start)
+                elif self.motor_phase == MOTOR_RUNNING:
+                    end = self.motor_phase_start + self.motor_run_time
+                    if now < end:
+                        return
+                    self.gate_state = not self.gate_state
+                    self.gate_log.append((end, self.gate_state))
+                    self.motor_phase = MOTOR_RESTING
+                    self.motor_phase_start = end
+                elif self.motor_phase == MOTOR_RESTING:
+                    end = self.motor_phase_start + self.motor_rest_time
+                    if now < end:
+                        return
+                    self.motor_phase = MOTOR_IDLE
+                    self.motor_phase_start = end
+                    rested = True
+
+    def latency(self, sent_times):
+        '''
+        :param sent_times: dict of seq: time the packet was written by host
+        :return: list of seconds between writing and receiving each logged command
+        '''
+        return [received - sent_times[seq] for received, seq, channel, value in self.log if seq in sent_times]
+
+
+class LoopbackSerial(object):
+    '''
+    serial.Serial like transport connected to a FakeArduino in the same process
+    '''
+
+    def __init__(self, port=LOOPBACK_PORT, baudrate=19200, timeout=0, arduino=None):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.arduino = FakeArduino(baudrate) if arduino is None else arduino
+        self.is_open = True
+
+    def isOpen(self):
+        return self.is_open
+
+    def write(self, data):
+        if not self.is_open:
+            raise serial.SerialException('Attempting to use a port that is not open')
+        self.arduino.receive(bytes(data))
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        # host polls regularly, let pending gate action start
+        self.arduino.update_motor()
+        return len(self.arduino.output)
+
+    def read(self, size=1):
+        with self.arduino.lock:
+            data = bytes(self.arduino.output[:size])
+            del self.arduino.output[:size]
+        return data
+
+    def close(self):
+        self.is_open = False
+
+
+class PtyArduino(object):
+    '''
+    FakeArduino behind a pseudo terminal, so any program can open it as a serial port (POSIX only)
+    '''
+
+    def __init__(self, arduino=None):
+        import pty
+        import tty
+        self.arduino = FakeArduino(baudrate=0) if arduino is None else arduino
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        # port name to open with serial.Serial()
+        self.port = os.ttyname(self.slave)
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self.port
+
+    def run(self):
+        import select
+        while not self.stopped:
+            ready, _, _ = select.select([self.master], [], [], 0.01)
+            # firmware loop() runs updateMotor() between packets as well
+            self.arduino.update_motor()
+            if not ready:
+                continue
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                return
+            reply = self.arduino.receive(data)
+            with self.arduino.lock:
+                # reply is written to the pty, not kept for LoopbackSerial
+                del self.arduino.output[:]
+            if reply:
+                os.write(self.master, reply)
+
+    def stop(self):
+        self.stopped = True
+        self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def open_transport(port, baudrate=19200, timeout=0):
+    '''
+    open a serial port, or the fake Arduino for LOOPBACK_PORT
+    '''
+    if port.startswith('loop://'):
+        return LoopbackSerial(port, baudrate, timeout)
+    return serial.Serial(port, baudrate, timeout=timeout)
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+# TrackingBot - A software for video-based animal behavioral tracking and analysis
+# Developer: Yutao Bai <yutaobai@hotmail.com>
+# Version: 1.02
+# https://www.neurotoxlab.com
+
+# Copyright (C) 2022 Yutao Bai
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import cv2
+
+
+class ZoneEngine(object):
+    '''
+    Zone membership of all subjects with one raster lookup per frame
+
+    each zone owns one bit of a label raster in video frame coordinates, so zones may overlap.
+    a subject enters a zone after being inside for enter_frames consecutive frames
+    and exits after being outside for exit_frames consecutive frames,
+    a zone is switched on when the first subject enters and off when the last subject exits
+    '''
+
+    def __init__(self, width, height, enter_frames=1, exit_frames=3):
+        '''
+        :param width: frame width of the tracked source
+        :param height: frame height of the tracked source
+        :param enter_frames: consecutive frames inside a zone before entering
+        :param exit_frames: consecutive frames outside a zone before exiting
+        '''
+        self.width = int(width)
+        self.height = int(height)
+        self.enter_frames = max(int(enter_frames), 1)
+        self.exit_frames = max(int(exit_frames), 1)
+
+        # (shape type, parameters) of each zone in frame coordinates
+        self.zones = []
+        self.raster = None
+
+        # subject id: row of state arrays
+        self.subject_rows = {}
+        # (subjects, zones) subject inside zone after hysteresis
+        self.state = np.zeros((0, 0), dtype=bool)
+        # (subjects, zones) consecutive frames that observation differs from state
+        self.streak = np.zeros((0, 0), dtype=np.int32)
+
+    def add_rect(self, x1, y1, x2, y2):
+        self.zones.append(('rect', (x1, y1, x2, y2)))
+        return len(self.zones) - 1
+
+    def add_ellipse(self, center_x, center_y, axis_x, axis_y):
+        self.zones.append(('ellipse', (center_x, center_y, axis_x, axis_y)))
+        return len(self.zones) - 1
+
+    def add_polygon(self, points):
+        '''
+        :param points: list of (x, y) vertices
+        '''
+        self.zones.append(('polygon', np.asarray(points, dtype=float).reshape(-1, 2)))
+        return len(self.zones) - 1
+
+    def add_rois(self, ROIs, scale_x, scale_y):
+        '''
+        add zones from ROI items drawn on canvas
+        :param ROIs: list of graphic_interactive.ROI
+        :param scale_x: frame width / displayed frame width
+        :param scale_y: frame height / displayed frame height
+        '''
+        for roi in ROIs:
+            # map item coords to canvas coords
+            x, y, w, h = roi.ROI.mapRectToScene(roi.ROI.rect()).getRect()
+            if roi.type == 'rect':
+                self.add_rect(x * scale_x, y * scale_y, (x + w) * scale_x, (y + h) * scale_y)
+            elif roi.type == 'circ':
+                self.add_ellipse((x + w / 2) * scale_x, (y + h / 2) * scale_y, w / 2 * scale_x, h / 2 * scale_y)
+            else:  # lines have no area, keep zone index in drawing order
+                self.add_polygon([])
+
+    def build(self):
+        '''
+        draw all zones into the label raster
+        '''
+        if len(self.zones) > 64:
+            raise ValueError(f'At most 64 zones are supported, got {len(self.zones)}')
+        dtype = np.uint8 if len(self.zones) <= 8 else np.uint16 if len(self.zones) <= 16 \
+            else np.uint32 if len(self.zones) <= 32 else np.uint64
+        self.raster = np.zeros((self.height, self.width), dtype=dtype)
+
+        zone_mask = np.zeros((self.height, self.width), dtype=np.uint8)
+        for i, (shape, params) in enumerate(self.zones):
+            zone_mask[:] = 0
+            if shape == 'rect':
+                x1, y1, x2, y2 = params
+                cv2.rectangle(zone_mask, (int(round(x1)), int(round(y1))), (int(round(x2)), int(round(y2))), 1, -1)
+            elif shape == 'ellipse':
+                center_x, center_y, axis_x, axis_y = params
+                cv2.ellipse(zone_mask, (int(round(center_x)), int(round(center_y))),
+                            (int(round(axis_x)), int(round(axis_y))), 0, 0, 360, 1, -1)
+            elif shape == 'polygon' and len(params) >= 3:
+                cv2.fillPoly(zone_mask, [np.round(params).astype(np.int32)], 1)
+            self.raster[zone_mask > 0] |= dtype(1 << i)
+
+        self.reset()
+        return self.raster
+
+    def reset(self):
+        '''
+        clear state of all subjects, all zones are off
+        '''
+        self.subject_rows = {}
+        self.state = np.zeros((0, len(self.zones)), dtype=bool)
+        self.streak = np.zeros((0, len(self.zones)), dtype=np.int32)
+
+    def lookup(self, pos_x, pos_y):
+        '''
+        :return: bitmask of zones containing each position, 0 for lost or out of frame positions
+        '''
+        pos_x = np.asarray(pos_x, dtype=float)
+        pos_y = np.asarray(pos_y, dtype=float)
+        valid = (pos_x >= 0) & (pos_x < self.width) & (pos_y >= 0) & (pos_y < self.height)
+
+        masks = np.zeros(pos_x.shape, dtype=self.raster.dtype)
+        masks[valid] = self.raster[pos_y[valid].astype(np.intp), pos_x[valid].astype(np.intp)]
+        return masks
+
+    def inside(self, pos_x, pos_y):
+        '''
+        :return: (positions, zones) bool array
+        '''
+        masks = self.lookup(pos_x, pos_y).astype(np.uint64)
+        bits = np.arange(len(self.zones), dtype=np.uint64)
+        return ((masks[:, None] >> bits) & np.uint64(1)).astype(bool)
+
+    def update(self, subject_ids, pos_x, pos_y):
+        '''
+        update zone state with positions of current frame, lost subjects (NaN) keep their state
+        :return: events, list of (subject id, zone index, True for enter / False for exit);
+                 commands, list of (zone index, True for on / False for off)
+        '''
+        pos_x = np.asarray(pos_x, dtype=float)
+        pos_y = np.asarray(pos_y, dtype=float)
+        observed = ~(np.isnan(pos_x) | np.isnan(pos_y))
+        subject_ids = [subject_id for subject_id, seen in zip(subject_ids, observed) if seen]
+        if not subject_ids or not self.zones:
+            return [], []
+
+        for subject_id in subject_ids:
+            if subject_id not in self.subject_rows:
+                self.subject_rows[subject_id] = len(self.subject_rows)
+        if len(self.subject_rows) > len(self.state):
+            grow = len(self.subject_rows) - len(self.state)
+            self.state = np.vstack([self.state, np.zeros((grow, len(self.zones)), dtype=bool)])
+            self.streak = np.vstack([self.streak, np.zeros((grow, len(self.zones)), dtype=np.int32)])
+
+        rows = np.array([self.subject_rows[subject_id] for subject_id in subject_ids])
+        inside = self.inside(pos_x[observed], pos_y[observed])
+        occupied = self.state.any(axis=0)
+
+        state = self.state[rows]
+        differ = inside != state
+        streak = np.where(differ, self.streak[rows] + 1, 0)
+        switch = differ & (streak >= np.where(state, self.exit_frames, self.enter_frames))
+        streak[switch] = 0
+        self.state[rows] = state ^ switch
+        self.streak[rows] = streak
+
+        events = [(subject_ids[i], int(j), bool(inside[i, j])) for i, j in zip(*np.nonzero(switch))]
+        changed = np.nonzero(self.state.any(axis=0) != occupied)[0]
+        commands = [(int(j), bool(not occupied[j])) for j in changed]
+
+        return events, commands